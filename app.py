@@ -1,15 +1,13 @@
+import hashlib
 import logging
 import os
 import re
 from datetime import timedelta, datetime
 import threading
-import time
 
-import requests
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
-TORN_USER_BASIC_URL = "https://api.torn.com/user/"
 ADMIN_TORN_ID = 2823859
 MOD_TORN_IDS = {
     tid
@@ -30,6 +28,9 @@ class User(db.Model):
     sent_xanax_total = db.Column(db.Integer, nullable=False, default=0)
     insurance_total = db.Column(db.Integer, nullable=False, default=0)
     api_key = db.Column(db.String(128), nullable=True)  # User's Torn API key for verification
+    next_xan_report_at = db.Column(db.DateTime, nullable=True)  # XAN overdose cooldown, set on confirm
+    overdose_autodetect = db.Column(db.Boolean, default=False)  # opted in to overdose detection from their own events
+    events_cursor = db.Column(db.Integer, nullable=True)  # Torn timestamp of the newest event already scanned
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -62,6 +63,31 @@ class Order(db.Model):
     # Relationships
     user = db.relationship('User', backref='orders')
 
+    __table_args__ = (
+        # At most one pending and one active order per user and coverage type
+        db.Index('ux_order_pending_per_coverage', 'user_id', 'coverage_type', unique=True,
+                 postgresql_where=db.text("status = 'pending'"), sqlite_where=db.text("status = 'pending'")),
+        db.Index('ux_order_active_per_coverage', 'user_id', 'coverage_type', unique=True,
+                 postgresql_where=db.text("status = 'active'"), sqlite_where=db.text("status = 'active'")),
+        # Rollup refreshes read premiums by activation time, and an overdose's tier from the
+        # user's latest activation before it
+        db.Index('ix_order_activated_at', 'activated_at'),
+        db.Index('ix_order_user_type_activated', 'user_id', 'coverage_type', 'activated_at'),
+    )
+
+class PaymentMatch(db.Model):
+    """Ledger of which Torn event paid for which order; each event can be used once"""
+    id = db.Column(db.Integer, primary_key=True)
+    torn_event_id = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    sender_torn_id = db.Column(db.Integer, nullable=True)
+    amount = db.Column(db.Integer, nullable=False)
+    paid_at = db.Column(db.DateTime, nullable=True)  # Event timestamp
+    matched_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relationships
+    order = db.relationship('Order', backref='payment_matches')
+
 class PricingConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     coverage_type = db.Column(db.String(10), nullable=False)  # 'XAN' or 'EXTC'
@@ -80,6 +106,94 @@ class AutoVerifySettings(db.Model):
     auto_delete_enabled = db.Column(db.Boolean, default=False)
     auto_delete_hours = db.Column(db.Integer, default=24)
 
+class Job(db.Model):
+    """Background job queue row; claimed by workers with FOR UPDATE SKIP LOCKED"""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)  # verify, expire, sweep, recompute
+    payload = db.Column(db.Text, nullable=True)  # JSON
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(128), nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+class TaskRun(db.Model):
+    """One run of a periodic scheduler task (see services/scheduler.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(64), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    duration_ms = db.Column(db.Integer, nullable=True)
+    status = db.Column(db.String(16), nullable=False)  # ok, error, timeout
+    rows = db.Column(db.Integer, nullable=False, default=0)  # rows touched, summed from the task's result
+    error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_task_run_task_started', 'task', 'started_at'),
+        db.Index('ix_task_run_started', 'started_at'),
+    )
+
+class SchedulerLease(db.Model):
+    """The scheduler process allowed to run the periodic tasks (see services/scheduler.py)"""
+    name = db.Column(db.String(32), primary_key=True)
+    holder = db.Column(db.String(128), nullable=False)  # host:pid
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class Rollup(db.Model):
+    """Premiums and payouts per time bucket, coverage type and tier (see services/rollups.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(8), nullable=False)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    coverage_type = db.Column(db.String(10), nullable=False)  # 'XAN' or 'EXTC'
+    tier = db.Column(db.Integer, nullable=False)  # hours for XAN, jumps for EXTC; 0 when unknown
+    orders = db.Column(db.Integer, nullable=False, default=0)  # paid orders
+    premiums = db.Column(db.Integer, nullable=False, default=0)  # xanax_payment of paid orders
+    overdoses = db.Column(db.Integer, nullable=False, default=0)  # confirmed overdoses
+    payout_xanax = db.Column(db.Integer, nullable=False, default=0)
+    payout_edvds = db.Column(db.Integer, nullable=False, default=0)
+    payout_ecstasy = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ux_rollup_bucket', 'granularity', 'bucket_start', 'coverage_type', 'tier', unique=True),
+    )
+
+class ApiToken(db.Model):
+    """Bearer token for the /api/v1 endpoints; only the sha256 of the token is stored"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)  # who it was issued to, e.g. "faction bot"
+    token_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, nullable=True)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+class OutboxEvent(db.Model):
+    """Notification for one webhook destination, written in the same transaction as the change (services/outbox.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    destination = db.Column(db.String(512), nullable=False)
+    event = db.Column(db.String(32), nullable=False)  # order.activated, order.expired, overdose.reported, overdose.confirmed
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending, sending, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_event_status_next', 'status', 'next_attempt_at'),
+    )
+
 class Overdose(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -99,6 +213,54 @@ class Overdose(db.Model):
     # Relationships
     user = db.relationship('User', backref='overdoses')
 
+    __table_args__ = (
+        # One unconfirmed report per user and coverage type; concurrent double reports fail here
+        db.Index('ux_overdose_pending_report', 'user_id', 'coverage_type', unique=True,
+                 postgresql_where=db.text('confirmed = false'), sqlite_where=db.text('confirmed = 0')),
+        db.Index('ix_overdose_user_type_confirmed', 'user_id', 'coverage_type', 'confirmed_at'),
+        db.Index('ix_overdose_confirmed_at', 'confirmed_at'),
+    )
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name, "").strip()
+    return int(value) if value.isdigit() else default
+
+def engine_options(is_postgres: bool) -> dict:
+    """SQLAlchemy engine/pool settings; sizes are per process (each gunicorn worker has its own pool)"""
+    options = {
+        # No SELECT 1 on every checkout: SQLAlchemy already invalidates the whole pool when a
+        # query hits a disconnect error, TCP keepalives catch dead peers, and LIFO checkout lets
+        # surplus idle connections age out via pool_recycle. Set DB_POOL_PRE_PING=1 to restore.
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING") == "1",
+        "pool_recycle": 300,        # Recycle connections every 5 minutes
+        # Compiled-SQL cache shared by all connections of this engine
+        "query_cache_size": _env_int("DB_QUERY_CACHE_SIZE", 1000),
+    }
+    if not is_postgres:
+        return options
+
+    # One connection per gunicorn thread, plus a little overflow for the odd burst
+    options.update(
+        pool_size=_env_int("DB_POOL_SIZE", _env_int("GUNICORN_THREADS", 8)),
+        max_overflow=_env_int("DB_MAX_OVERFLOW", 2),
+        pool_timeout=_env_int("DB_POOL_TIMEOUT", 10),
+        pool_use_lifo=True,
+    )
+
+    # psycopg3 server-side prepares a statement once it has run prepare_threshold times on a
+    # connection, so the hot Order filter queries skip parse/plan. Use DB_PREPARE_THRESHOLD=off
+    # behind a transaction-mode PgBouncer, which cannot keep prepared statements.
+    prepare_threshold = os.environ.get("DB_PREPARE_THRESHOLD", "2").strip().lower()
+    options["connect_args"] = {
+        "connect_timeout": 10,  # 10 second connection timeout
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+        "prepare_threshold": None if prepare_threshold in ("off", "none", "") else int(prepare_threshold),
+    }
+    return options
+
 def create_app():
     app = Flask(__name__, instance_relative_config=True)
 
@@ -118,19 +280,16 @@ def create_app():
     if database_url.startswith("postgresql://"):
         database_url = database_url.replace("postgresql://", "postgresql+psycopg://", 1)
     
+    # sqlite:// is accepted for local benchmarks; Postgres-only options are skipped for it
+    is_postgres = database_url.startswith("postgresql")
+
     # Railway requires SSL; add query parameter if not present
-    if "sslmode=" not in database_url:
-        database_url += "?sslmode=require"
+    if is_postgres and "sslmode=" not in database_url:
+        database_url += ("&" if "?" in database_url else "?") + "sslmode=require"
     
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_pre_ping": True,      # Verify connections before using
-        "pool_recycle": 300,        # Recycle connections every 5 minutes
-        "connect_args": {
-            "connect_timeout": 10,  # 10 second connection timeout
-        },
-    }
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(is_postgres)
 
     # SECURITY: Session hardening (works best behind HTTPS in production)
     app.config["SESSION_COOKIE_HTTPONLY"] = True
@@ -140,8 +299,25 @@ def create_app():
 
     db.init_app(app)
 
-    with app.app_context():
-        db.create_all()
+    from services.instrumentation import init_instrumentation
+
+    init_instrumentation(app, db, User)
+
+    from services.outbox import init_outbox
+
+    init_outbox(app, db, User, Order, Overdose, OutboxEvent)
+
+    from services.cache import get_cache, init_cache_invalidation
+
+    # Which shared-cache namespaces go stale when a row of each model commits
+    init_cache_invalidation(db, {
+        PricingConfig: lambda p: ["pricing"],
+        Order: lambda o: ["leaderboard", f"user:{o.user_id}"],
+        Overdose: lambda o: ["leaderboard", f"user:{o.user_id}"],
+        User: lambda u: ["leaderboard", "user_directory", f"user:{u.id}"],
+    })
+
+    from services.torn_client import fetch_user_basic
 
     def fetch_torn_basic(api_key: str) -> dict:
         # Small input sanity check; Torn keys are typically hex-like strings.
@@ -152,97 +328,143 @@ def create_app():
         if not re.fullmatch(r"[A-Za-z0-9]+", api_key):
             raise ValueError("API key should be alphanumeric.")
 
-        # SECURITY: never log the key; keep request timeouts short
-        params = {"selections": "basic", "key": api_key}
-        r = requests.get(TORN_USER_BASIC_URL, params=params, timeout=8)
-        r.raise_for_status()
-        data = r.json()
+        # Circuit breaker + short timeouts; Torn error payloads raise TornAPIError (a ValueError).
+        # Identities are cached by key digest, so repeat logins skip Torn (only id and name are kept).
+        # Trade-off: a key revoked on Torn still logs in until its entry expires, so the TTL only
+        # needs to absorb bursts of retries and double submits - keep it short.
+        def load():
+            basic = fetch_user_basic(api_key)
+            return {"player_id": basic.get("player_id"), "name": basic.get("name")}
 
-        # Torn API commonly returns {"error": {"code": ..., "error": "..."}}
-        if isinstance(data, dict) and "error" in data:
-            msg = data["error"].get("error", "Torn API error")
-            raise ValueError(msg)
-
-        return data
+        digest = hashlib.sha256(api_key.encode()).hexdigest()
+        return get_cache().get_or_set("torn_identity", digest, load, ttl=_env_int("LOGIN_IDENTITY_TTL_SECONDS", 30))
 
     from routes import register_routes
 
-    register_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, Overdose, fetch_torn_basic, ADMIN_TORN_ID, MOD_TORN_IDS)
-
-    def _auto_verifier_loop():
-        """Background loop to auto-verify orders and auto-expire covers."""
-        with app.app_context():
-            while True:
-                try:
-                    settings = AutoVerifySettings.query.first()
-                    if not settings or not settings.enabled:
-                        interval = settings.interval_minutes if settings else 5
-                        time.sleep(max(1, int(interval)))
-                        continue
-
-                    # Determine interval in seconds (stored in interval_minutes field)
-                    interval_seconds = max(1, int(settings.interval_minutes or 5))
-
-                    # Find admin user with API key
-                    admin_user = User.query.filter_by(torn_user_id=ADMIN_TORN_ID, role_id=3).first()
-                    if not admin_user or not admin_user.api_key:
-                        # Fallback: any admin with api_key
-                        admin_user = User.query.filter(User.role_id == 3, User.api_key.isnot(None)).first()
-
-                    # Auto-expire active orders past their expires_at
-                    now = datetime.utcnow()
-                    expired_active = Order.query.filter(
-                        Order.status == 'active',
-                        Order.expires_at.isnot(None),
-                        Order.expires_at < now
-                    ).all()
-                    expired_count = 0
-                    for order in expired_active:
-                        order.status = 'expired'
-                        expired_count += 1
-
-                    # Auto-verify pending orders using Torn API
-                    verified_count = 0
-                    if admin_user and admin_user.api_key:
-                        from services.order_verification import verify_order_payment
-                        pending_orders = Order.query.filter_by(status='pending', payment_verified=False).all()
-                        for order in pending_orders:
-                            try:
-                                verified, payment_time, _ = verify_order_payment(order, admin_user.api_key)
-                                if verified:
-                                    order.payment_verified = True
-                                    order.payment_verified_at = payment_time or datetime.utcnow()
-                                    order.status = 'active'
-                                    order.activated_at = datetime.utcnow()
-                                    # Set expiration
-                                    if order.coverage_type == 'XAN' and order.hours:
-                                        order.expires_at = datetime.utcnow() + timedelta(hours=order.hours)
-                                    elif order.coverage_type == 'EXTC':
-                                        order.expires_at = datetime.utcnow() + timedelta(hours=2)
-                                    verified_count += 1
-                            except Exception:
-                                continue
-
-                    if expired_count or verified_count:
-                        db.session.commit()
-
-                    # Update last check timestamp
-                    settings.last_check = datetime.utcnow()
-                    db.session.commit()
-
-                    time.sleep(interval_seconds)
-                except Exception:
-                    # Sleep briefly on unexpected errors to avoid tight loop
-                    time.sleep(5)
-
-    # Start background thread (daemon so it won't block shutdown)
-    t = threading.Thread(target=_auto_verifier_loop, daemon=True)
-    t.start()
+    register_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, Overdose, Job, TaskRun, Rollup, ApiToken, fetch_torn_basic, ADMIN_TORN_ID, MOD_TORN_IDS)
 
     return app
 
-app = create_app()
+def init_db(app):
+    """Create missing tables, columns and indexes. Run once per deploy (manage.py migrate)."""
+    from services.schema import migrate
+    from services.overdose_eligibility import migration_steps as overdose_steps
+    from services.order_placement import migration_steps as order_steps
+
+    with app.app_context():
+        return migrate(db, data_steps={**overdose_steps(User, Overdose), **order_steps(Order)})
+
+def _verify_settings():
+    return AutoVerifySettings.query.first()
+
+def build_scheduler(app):
+    """The periodic tasks and their cadence; each is tuned on its own"""
+    from services.scheduler import Scheduler, prune_task_runs
+    from services.job_queue import enqueue, prune_jobs
+    from services.instrumentation import track_transactions, worker_stats
+    from services.rollups import refresh_recent
+    from services.outbox import deliver_due, prune_outbox, webhook_urls
+    from services.overdose_poller import poll_overdoses
+
+    scheduler = Scheduler(app, db, TaskRun, Lease=SchedulerLease)
+    with app.app_context():
+        tracker = track_transactions(db.engine)
+
+    def verify_enabled():
+        settings = _verify_settings()
+        return bool(settings and settings.enabled)
+
+    def verify_interval():
+        # Seconds, despite the column name
+        settings = _verify_settings()
+        return (settings.interval_minutes if settings else None) or 5
+
+    # Expiry, verification, the sweep and recomputes run on the job workers (services/job_queue.py),
+    # so they spread over --jobs-only hosts and never overlap an admin-queued job of the same kind.
+    # Queued jobs coalesce (enqueue dedupes) if the workers fall behind. Expire and verify run
+    # every few seconds and their work shows up as Job rows, so only their failures are recorded.
+    @scheduler.task("expire", interval=verify_interval, jitter=0.1, timeout=30, enabled=verify_enabled,
+                    record_idle=False)
+    def expire():
+        enqueue(db, Job, 'expire')
+
+    @scheduler.task("verify", interval=verify_interval, jitter=0.1, timeout=30, enabled=verify_enabled,
+                    record_idle=False)
+    def verify():
+        enqueue(db, Job, 'verify')
+
+    @scheduler.task("sweep", interval=900, jitter=0.2, timeout=30)
+    def sweep():
+        enqueue(db, Job, 'sweep')
+
+    @scheduler.task("recompute", interval=3600, jitter=0.2, timeout=30)
+    def recompute():
+        enqueue(db, Job, 'recompute')
+
+    @scheduler.task("rollups", interval=_env_int("ROLLUP_SECONDS", 300), jitter=0.1, timeout=300)
+    def rollups():
+        return refresh_recent(db, Order, Overdose, Rollup)
+
+    @scheduler.task("overdose_poll", interval=_env_int("OVERDOSE_POLL_SECONDS", 60), jitter=0.1, timeout=120)
+    def overdose_poll():
+        return poll_overdoses(db, User, Order, Overdose)
+
+    if webhook_urls():
+        # Only deliveries are recorded; most 5s ticks find nothing due
+        @scheduler.task("webhooks", interval=_env_int("WEBHOOK_SECONDS", 5), timeout=120, record_idle=False)
+        def webhooks():
+            return deliver_due(db, OutboxEvent)
+
+    @scheduler.task("prune_outbox", interval=86400, jitter=0.1, timeout=600)
+    def prune_webhooks():
+        return prune_outbox(db, OutboxEvent)
+
+    @scheduler.task("prune_jobs", interval=86400, jitter=0.1, timeout=600)
+    def prune_finished_jobs():
+        return prune_jobs(db, Job)
+
+    @scheduler.task("prune_task_runs", interval=86400, jitter=0.1, timeout=600)
+    def prune():
+        return prune_task_runs(db, TaskRun)
+
+    @scheduler.task("worker_stats", interval=_env_int("WORKER_STATS_SECONDS", 300), timeout=10)
+    def stats():
+        # Logged only; RSS and open transactions aren't rows touched
+        worker_stats(tracker)
+
+    return scheduler
+
+def run_scheduler(app, stop_event=None):
+    """Run the periodic tasks until stop_event is set"""
+    build_scheduler(app).run_forever(stop_event)
+
+def run_job_worker(app, index: int = 0, stop_event=None):
+    """Claim and run queued jobs until stop_event is set"""
+    from services.job_queue import work, worker_name
+    from services.tasks import build_job_handlers
+
+    handlers = build_job_handlers(db, User, Order, PricingConfig, AutoVerifySettings, PaymentMatch, ADMIN_TORN_ID)
+    work(app, db, Job, handlers, worker_name(index), stop_event)
+
+def start_job_workers(app, count: int):
+    threads = []
+    for index in range(count):
+        t = threading.Thread(target=run_job_worker, args=(app, index), name=f"job-worker-{index}", daemon=True)
+        t.start()
+        threads.append(t)
+    return threads
+
+def start_background_scheduler(app):
+    """Run the scheduler and one job worker in threads; only for the single-process dev server"""
+    start_job_workers(app, 1)
+    # Daemon thread so it won't block shutdown
+    t = threading.Thread(target=run_scheduler, args=(app,), name="scheduler", daemon=True)
+    t.start()
+    return t
 
 if __name__ == "__main__":
-    # Local testing only
+    # Local testing only: single process, so it creates tables and runs the scheduler itself
+    app = create_app()
+    init_db(app)
+    start_background_scheduler(app)
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=False, use_reloader=False)
@@ -0,0 +1,142 @@
+"""
+Shared cache check - for each backend: get/set latency, whether a value set
+and then invalidated in one process is seen by another, and the leaderboard
+and dashboard pricing with a cold and a warm cache
+
+    python -m bench.cache --backends memory sqlite redis --users 2000 --orders 20000
+
+The redis backend runs against bench.redis_stub unless --redis-url is given.
+Uses a throwaway SQLite database unless DATABASE_URL is set (it must be
+empty). Exits non-zero if a shared backend misses another process's value or
+still serves it after invalidation.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench import datagen
+from bench.redis_stub import RedisStub
+
+
+def _other_process(url: str, namespace: str, queue):
+    from services.cache import Cache, backend_from_url
+
+    queue.put(Cache(backend_from_url(url)).get(namespace, "probe"))
+
+
+def seen_by_other_process(url: str, namespace: str):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_other_process, args=(url, namespace, queue))
+    process.start()
+    value = queue.get(timeout=30)
+    process.join()
+    return value
+
+
+def time_ops(cache, ops: int) -> tuple:
+    """(get hit, set) median microseconds"""
+    payload = {"rows": [{"rank": i, "name": f"user{i}", "paid": i * 7} for i in range(50)]}
+    hits, sets = [], []
+    for i in range(ops):
+        start = time.perf_counter()
+        cache.set("bench", f"k{i % 100}", payload, ttl=60)
+        sets.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cache.get("bench", f"k{i % 100}")
+        hits.append(time.perf_counter() - start)
+    return statistics.median(hits) * 1e6, statistics.median(sets) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared cache backends")
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite", "redis"],
+                        choices=["memory", "sqlite", "redis"])
+    parser.add_argument("--redis-url", help="a real Redis-compatible server instead of the stand-in")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hjs-cache-")
+    if not os.environ.get("DATABASE_URL"):
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'cache-bench.db')}"
+    stub = None
+    urls = {"memory": "memory://", "sqlite": f"sqlite:///{os.path.join(workdir, 'cache.db')}"}
+    if "redis" in args.backends:
+        if args.redis_url:
+            urls["redis"] = args.redis_url
+        else:
+            stub = RedisStub().start()
+            urls["redis"] = stub.url
+
+    import app as hjs
+    from services import cache as cache_module
+    from services.cache import Cache, backend_from_url
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        datagen.seed_pricing(hjs)
+        admin_id = datagen.seed_admin(hjs)
+        user_ids = datagen.seed_users(hjs, args.users)
+        datagen.seed_orders(hjs, user_ids, args.orders)
+        datagen.seed_overdoses(hjs, user_ids, args.orders // 10)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = admin_id
+
+    def request_ms(path: str) -> float:
+        start = time.perf_counter()
+        assert client.get(path).status_code == 200
+        return (time.perf_counter() - start) * 1000
+
+    ok = True
+    for name in args.backends:
+        cache = Cache(backend_from_url(urls[name]))
+        # Route the app's caches through this backend
+        cache_module._cache = cache
+        namespace = f"probe-{name}-{os.getpid()}-{time.time_ns()}"
+
+        hit_us, set_us = time_ops(cache, args.ops)
+
+        cache.set(namespace, "probe", "shared", ttl=60)
+        before = seen_by_other_process(urls[name], namespace)
+        cache.invalidate(namespace)
+        after = seen_by_other_process(urls[name], namespace)
+        shared = before == "shared" and after is None
+        if name != "memory":
+            ok = ok and shared
+
+        cold = request_ms("/admin/leaderboard")
+        warm = statistics.median(request_ms("/admin/leaderboard") for _ in range(args.requests))
+        with app.app_context():
+            # An ORM commit touching an order invalidates the leaderboard
+            order = hjs.Order.query.first()
+            order.auto_detected = not order.auto_detected
+            hjs.db.session.commit()
+        after_commit = request_ms("/admin/leaderboard")
+        dashboard = statistics.median(request_ms("/dashboard") for _ in range(args.requests))
+
+        stats = cache.stats()["namespaces"]
+        print(f"{name:<7} get {hit_us:7.1f}us  set {set_us:7.1f}us  cross-process "
+              f"{'yes' if shared else 'no':<3}  leaderboard cold {cold:7.1f}ms warm {warm:6.1f}ms "
+              f"after commit {after_commit:7.1f}ms  dashboard {dashboard:5.1f}ms  "
+              f"leaderboard hit ratio {stats['leaderboard']['hit_ratio']}")
+
+    if stub:
+        stub.stop()
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
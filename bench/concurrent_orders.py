@@ -0,0 +1,97 @@
+"""
+Concurrent order placement - fires N parallel POST /order/place for the
+same user and checks that they converge on exactly one pending order
+
+    python -m bench.concurrent_orders --placements 100 --concurrency 32
+
+Also reports how many SQL statements one placement takes. Exits non-zero on
+any failed request or if the user ends up with anything but one pending
+order per coverage type.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import datagen
+from bench.run import summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel order placement for one user")
+    parser.add_argument("--placements", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-orders-"), "orders.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from sqlalchemy import event
+
+    import app as hjs
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+    db = hjs.db
+
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        datagen.seed_pricing(hjs)
+        (user_id,) = datagen.seed_users(hjs, 1)
+        engine = db.engine
+
+    statements = threading.local()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.count = getattr(statements, "count", 0) + 1
+
+    tiers = [h for h, _, _ in datagen.XAN_TIERS]
+
+    def place(i):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        statements.count = 0
+        start = time.perf_counter()
+        response = client.post("/order/place", data={"coverage_type": "XAN", "duration": tiers[i % len(tiers)]})
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code, statements.count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(place, range(args.placements)))
+    wall = time.perf_counter() - start
+
+    failed = [status for _, status, _ in results if status >= 400]
+    per_request = sorted(count for _, _, count in results)
+    summary = summarize("concurrent_orders", [elapsed for elapsed, _, _ in results], wall,
+                        concurrency=args.concurrency, failed=len(failed),
+                        statements_per_request=per_request[len(per_request) // 2])
+
+    with app.app_context():
+        counts = dict(
+            db.session.query(hjs.Order.status, db.func.count(hjs.Order.id))
+            .filter(hjs.Order.user_id == user_id)
+            .group_by(hjs.Order.status)
+            .all()
+        )
+
+    print(f"{summary['requests']} placements  p50={summary['p50_ms']:.2f}ms  p95={summary['p95_ms']:.2f}ms  "
+          f"{summary['throughput_rps']:.1f} req/s  failed={len(failed)}  "
+          f"statements/request={summary['statements_per_request']} (session lookup + placement)")
+    print(f"orders for the user by status: {counts}")
+
+    if failed or counts != {"pending": 1}:
+        print("FAIL")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
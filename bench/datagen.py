@@ -0,0 +1,143 @@
+"""
+Synthetic data generator for benchmarks - users, orders and overdoses in bulk
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+XAN_TIERS = [(4, 5, 20), (8, 8, 35), (12, 11, 50), (24, 20, 90)]  # (hours, cost, reward)
+EXTC_TIERS = [(1, 10, 30, 10, 10), (2, 18, 55, 20, 20), (3, 25, 80, 30, 30)]  # (jumps, cost, xanax, edvds, ecstasy)
+
+BASE_TORN_ID = 100000
+
+
+def _chunks(rows, size=5000):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def seed_pricing(hjs):
+    db = hjs.db
+    rows = [
+        dict(coverage_type='XAN', duration=h, cost=c, xanax_reward=r, active=True)
+        for h, c, r in XAN_TIERS
+    ] + [
+        dict(coverage_type='EXTC', duration=j, cost=c, xanax_reward=x, edvds_reward=e, ecstasy_reward=s, active=True)
+        for j, c, x, e, s in EXTC_TIERS
+    ]
+    db.session.execute(db.insert(hjs.PricingConfig), rows)
+    db.session.commit()
+
+
+def seed_admin(hjs, api_key: str = "stubadminkey"):
+    admin = hjs.User(torn_user_id=hjs.ADMIN_TORN_ID, torn_name="Danieltrsl", role_id=3, api_key=api_key)
+    hjs.db.session.add(admin)
+    hjs.db.session.commit()
+    return admin.id
+
+
+def seed_users(hjs, count: int) -> list:
+    """Insert `count` regular users; returns their database ids"""
+    db = hjs.db
+    rows = [
+        dict(torn_user_id=BASE_TORN_ID + i, torn_name=f"benchuser{BASE_TORN_ID + i}", role_id=1,
+             sent_xanax_total=0, insurance_total=0)
+        for i in range(count)
+    ]
+    for chunk in _chunks(rows):
+        db.session.execute(db.insert(hjs.User), chunk)
+    db.session.commit()
+    return [
+        uid for (uid,) in db.session.execute(
+            db.select(hjs.User.id).where(hjs.User.torn_user_id >= BASE_TORN_ID).order_by(hjs.User.id)
+        )
+    ]
+
+
+def _order_row(rng, user_id, coverage_type, status, created_at):
+    if coverage_type == 'XAN':
+        hours, cost, reward = rng.choice(XAN_TIERS)
+        row = dict(hours=hours, xanax_payment=cost, xanax_reward=reward)
+    else:
+        jumps, cost, xanax, edvds, ecstasy = rng.choice(EXTC_TIERS)
+        row = dict(jumps=jumps, xanax_payment=cost, xanax_reward=xanax, edvds_reward=edvds, ecstasy_reward=ecstasy)
+
+    row.update(user_id=user_id, coverage_type=coverage_type, status=status, created_at=created_at,
+               payment_verified=status != 'pending', auto_detected=False)
+    if status != 'pending':
+        row['payment_verified_at'] = created_at + timedelta(minutes=5)
+        row['activated_at'] = created_at + timedelta(minutes=5)
+        row['expires_at'] = created_at + timedelta(hours=row.get('hours') or 2)
+    return row
+
+
+def seed_orders(hjs, user_ids: list, count: int, seed: int = 1):
+    """Historical (expired) orders spread over the last 90 days"""
+    db = hjs.db
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    rows = [
+        _order_row(rng, rng.choice(user_ids), rng.choice(['XAN', 'EXTC']), 'expired',
+                   now - timedelta(minutes=rng.randint(60, 90 * 24 * 60)))
+        for _ in range(count)
+    ]
+    for chunk in _chunks(rows):
+        db.session.execute(db.insert(hjs.Order), chunk)
+    db.session.commit()
+
+
+def seed_pending_orders(hjs, user_ids: list, count: int, seed: int = 2) -> list:
+    """At most one pending XAN order per user; returns (user_id, amount) pairs in insert order"""
+    db = hjs.db
+    rng = random.Random(seed)
+    created_at = datetime.utcnow() - timedelta(minutes=10)
+    rows = [_order_row(rng, user_id, 'XAN', 'pending', created_at) for user_id in user_ids[:count]]
+    for chunk in _chunks(rows):
+        db.session.execute(db.insert(hjs.Order), chunk)
+    db.session.commit()
+    return [(r['user_id'], r['xanax_payment']) for r in rows]
+
+
+def seed_overdoses(hjs, user_ids: list, count: int, seed: int = 3):
+    db = hjs.db
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    rows = []
+    pending = set()
+    for _ in range(count):
+        user_id = rng.choice(user_ids)
+        coverage_type = rng.choice(['XAN', 'EXTC'])
+        reported_at = now - timedelta(minutes=rng.randint(60, 90 * 24 * 60))
+        # At most one unconfirmed report per user and coverage type (ux_overdose_pending_report)
+        confirmed = rng.random() < 0.8 or (user_id, coverage_type) in pending
+        if not confirmed:
+            pending.add((user_id, coverage_type))
+        row = dict(user_id=user_id, coverage_type=coverage_type, reported_at=reported_at,
+                   confirmed=confirmed)
+        if confirmed:
+            row.update(confirmed_at=reported_at + timedelta(minutes=30), payout_xanax=rng.choice([20, 35, 50]))
+            if coverage_type == 'EXTC':
+                row.update(payout_edvds=20, payout_ecstasy=20)
+            row['payout'] = row['payout_xanax']
+        rows.append(row)
+    for chunk in _chunks(rows):
+        db.session.execute(db.insert(hjs.Overdose), chunk)
+    db.session.commit()
+
+
+def payment_events_for(hjs, pending: list) -> list:
+    """Torn events that pay for each (user_id, amount) pending order"""
+    from bench.torn_stub import payment_event_text
+
+    users = {
+        u.id: u for u in hjs.User.query.filter(hjs.User.id.in_([uid for uid, _ in pending])).all()
+    }
+    ts = int(time.time())
+    return [
+        {
+            "timestamp": ts - i,
+            "event": payment_event_text(users[uid].torn_user_id, users[uid].torn_name, amount, 'HJSx'),
+            "seen": 0,
+        }
+        for i, (uid, amount) in enumerate(pending)
+    ]
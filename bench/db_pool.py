@@ -0,0 +1,105 @@
+"""
+Connection pool / prepared statement benchmark against a local Postgres
+
+    DATABASE_URL=postgresql://postgres@localhost/hjs_bench python -m bench.db_pool --seconds 10 --threads 8
+
+Runs the hot per-user Order filter queries (the dashboard/overdose lookups)
+with the old engine settings (pre-ping, no prepared statements) and with the
+tuned engine_options(), and prints queries per second for each.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from bench import datagen
+
+BASELINE_OPTIONS = {
+    "pool_pre_ping": True,
+    "pool_recycle": 300,
+    "connect_args": {"connect_timeout": 10, "prepare_threshold": None},
+}
+
+
+def _database_url() -> str:
+    url = os.environ.get("DATABASE_URL", "")
+    if not url.startswith("postgresql"):
+        sys.exit("bench.db_pool needs DATABASE_URL pointing at a local PostgreSQL database.")
+    if url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+
+def _ensure_data(hjs, users: int, orders: int) -> list:
+    app = hjs.create_app()
+    hjs.init_db(app)
+    with app.app_context():
+        if hjs.User.query.count() < users:
+            datagen.seed_pricing(hjs)
+            user_ids = datagen.seed_users(hjs, users)
+            datagen.seed_orders(hjs, user_ids, orders)
+        return [uid for (uid,) in hjs.db.session.execute(select(hjs.User.id))]
+
+
+def run(engine, Order, user_ids: list, seconds: float, threads: int) -> float:
+    """Queries per second across `threads` threads for `seconds`"""
+    deadline = time.perf_counter() + seconds
+    counts = [0] * threads
+
+    def worker(slot):
+        rng = random.Random(slot)
+        while time.perf_counter() < deadline:
+            # One session per "request", like Flask-SQLAlchemy's scoped session
+            with Session(engine) as session:
+                user_id = rng.choice(user_ids)
+                session.execute(
+                    select(Order).filter_by(user_id=user_id, coverage_type='XAN', status='active')
+                ).first()
+                session.execute(
+                    select(Order).filter_by(user_id=user_id, coverage_type='EXTC', status='active')
+                ).first()
+            counts[slot] += 2
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare baseline vs tuned engine settings")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=50000)
+    args = parser.parse_args()
+
+    url = _database_url()
+    import app as hjs
+
+    user_ids = _ensure_data(hjs, args.users, args.orders)
+
+    tuned_options = hjs.engine_options(is_postgres=True)
+    tuned_options["pool_size"] = max(tuned_options["pool_size"], args.threads)
+
+    results = {}
+    for label, options in (("baseline", BASELINE_OPTIONS), ("tuned", tuned_options)):
+        engine = create_engine(url, **options)
+        run(engine, hjs.Order, user_ids, min(2.0, args.seconds), args.threads)  # warm pool and caches
+        results[label] = run(engine, hjs.Order, user_ids, args.seconds, args.threads)
+        engine.dispose()
+        print(f"{label:<9} {results[label]:10.1f} queries/s")
+
+    print(f"speedup   {results['tuned'] / results['baseline']:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
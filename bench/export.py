@@ -0,0 +1,77 @@
+"""
+Export memory check - streams GET /admin/export/orders for growing table
+sizes and reports peak Python heap use while the response is consumed
+
+    python -m bench.export --sizes 10000 50000 200000
+
+Uses a throwaway SQLite database unless DATABASE_URL is set (it must be
+empty). Exits non-zero when the largest export peaks more than --max-ratio
+times higher than the smallest.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench import datagen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming export memory profile")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--max-ratio", type=float, default=2.0)
+    args = parser.parse_args()
+
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-export-"), "export.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import app as hjs
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        datagen.seed_pricing(hjs)
+        admin_id = datagen.seed_admin(hjs)
+        user_ids = datagen.seed_users(hjs, args.users)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = admin_id
+
+    peaks = []
+    seeded = 0
+    for size in sorted(args.sizes):
+        with app.app_context():
+            datagen.seed_orders(hjs, user_ids, size - seeded, seed=size)
+        seeded = size
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(f"/admin/export/orders?format={args.format}", buffered=False)
+        lines = sum(chunk.count(b"\n") for chunk in response.response)
+        response.close()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        peaks.append(peak)
+        print(f"{size:>8} orders  {lines:>8} lines  {elapsed:6.2f}s  peak heap {peak / 1e6:6.2f}MB")
+
+    ratio = peaks[-1] / peaks[0]
+    print(f"peak ratio largest/smallest: {ratio:.2f}")
+    if ratio > args.max_ratio:
+        print("FAIL")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
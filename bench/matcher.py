@@ -0,0 +1,103 @@
+"""
+Batch matcher scaling benchmark - no network
+
+    python -m bench.matcher --sizes 1000 2500 5000 10000
+
+For each size N, stores N pending orders and N payment events (half of them
+matching), loads the orders the way run_verification_pass does and times
+parse + match over those ORM rows. Linear scaling shows as a flat us/item
+column. Uses a throwaway SQLite database unless DATABASE_URL is set (it must
+be empty).
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import joinedload
+
+from bench.torn_stub import payment_event_text
+
+
+def build(hjs, n: int, seed: int = 1):
+    """Store n users with one pending order each; returns their payment events"""
+    db = hjs.db
+    rng = random.Random(seed)
+    created_at = datetime.utcnow() - timedelta(minutes=30)
+    ts = int(time.time())
+
+    db.session.execute(db.delete(hjs.Order))
+    db.session.execute(db.delete(hjs.User))
+    db.session.execute(db.insert(hjs.User), [
+        dict(torn_user_id=100000 + i, torn_name=f"benchuser{100000 + i}", role_id=1,
+             sent_xanax_total=0, insurance_total=0)
+        for i in range(n)
+    ])
+    user_ids = dict(db.session.execute(db.select(hjs.User.torn_user_id, hjs.User.id)).all())
+
+    orders = []
+    events = {}
+    for i in range(n):
+        torn_user_id, torn_name = 100000 + i, f"benchuser{100000 + i}"
+        coverage_type = rng.choice(['XAN', 'EXTC'])
+        amount = rng.choice([5, 8, 10, 11, 18, 20, 25])
+        orders.append(dict(user_id=user_ids[torn_user_id], coverage_type=coverage_type, xanax_payment=amount,
+                           xanax_reward=0, status='pending', payment_verified=False, created_at=created_at))
+
+        # Half the events pay for an order, the rest pay the wrong amount or come from strangers
+        code = 'HJSx' if coverage_type == 'XAN' else 'HJSe'
+        if i % 2 == 0:
+            text = payment_event_text(torn_user_id, torn_name, amount, code)
+        else:
+            text = payment_event_text(900000 + i, f"stranger{i}", amount + 1, code)
+        events[str(5000000 + i)] = {"timestamp": ts - rng.randint(0, 600), "event": text}
+    db.session.execute(db.insert(hjs.Order), orders)
+    db.session.commit()
+    return events
+
+
+def load_pending(hjs):
+    """The pending orders as run_verification_pass loads them"""
+    Order = hjs.Order
+    return Order.query.options(joinedload(Order.user)).filter_by(status='pending', payment_verified=False).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch matcher scaling benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2500, 5000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-matcher-"), "matcher.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import app as hjs
+    from services.order_verification import parse_payment_events, match_pending_orders
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+
+    print(f"{'orders x events':>18} {'load ms':>10} {'best ms':>10} {'us/item':>10} {'matched':>8}")
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        for n in args.sizes:
+            events = build(hjs, n)
+            start = time.perf_counter()
+            orders = load_pending(hjs)
+            load = time.perf_counter() - start
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                matches = match_pending_orders(orders, parse_payment_events(events))
+                best = min(best, time.perf_counter() - start)
+            print(f"{f'{n} x {n}':>18} {load * 1000:10.1f} {best * 1000:10.1f} {best * 1e6 / n:10.2f} "
+                  f"{len(matches):8d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Overdose poller throughput - opted-in members with active XAN cover all have
+a fresh overdose in their events; one pass is timed per pool size
+
+    python -m bench.overdose_poll --members 200 --latency-ms 100 --workers 1 8 16
+
+Uses a throwaway SQLite database unless DATABASE_URL is set (it must be
+empty) and the local Torn stub. Exits non-zero unless every pass detects one
+overdose per member.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench import datagen
+from bench.torn_stub import TornStub
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overdose poller throughput")
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 16])
+    args = parser.parse_args()
+
+    now = int(time.time())
+    stub = TornStub(latency_ms=args.latency_ms, events=[
+        {"timestamp": now - 60, "event": "You overdosed on Xanax and were hospitalized.", "seen": 0},
+        {"timestamp": now - 30, "event": "Someone attacked you and lost.", "seen": 0},
+    ]).start()
+    os.environ["TORN_API_BASE"] = stub.url
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-odpoll-"), "odpoll.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import app as hjs
+    from services.overdose_poller import KeyRateLimiter, poll_overdoses
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+    db = hjs.db
+
+    ok = True
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        datagen.seed_pricing(hjs)
+        user_ids = datagen.seed_users(hjs, args.members)
+        started = datetime.utcnow() - timedelta(minutes=30)
+        db.session.execute(db.insert(hjs.Order), [
+            dict(user_id=user_id, coverage_type='XAN', status='active', xanax_payment=30, hours=4,
+                 xanax_reward=50, payment_verified=True, created_at=started, activated_at=started,
+                 expires_at=started + timedelta(hours=4))
+            for user_id in user_ids
+        ])
+        db.session.commit()
+
+        for workers in args.workers:
+            db.session.execute(db.delete(hjs.Overdose))
+            # Stub keys resolve to their own player; the cursor predates the overdose event
+            db.session.execute(db.update(hjs.User), [
+                dict(id=user.id, overdose_autodetect=True, api_key=f"stub{user.torn_user_id}", events_cursor=now - 3600)
+                for user in hjs.User.query.filter(hjs.User.id.in_(user_ids))
+            ])
+            db.session.commit()
+
+            requests_before = stub.request_count
+            start = time.perf_counter()
+            counts = poll_overdoses(db, hjs.User, hjs.Order, hjs.Overdose, limiter=KeyRateLimiter(), workers=workers)
+            elapsed = time.perf_counter() - start
+            # With fresh rate limits a second pass refetches, but the cursor has moved past the overdose
+            again = poll_overdoses(db, hjs.User, hjs.Order, hjs.Overdose, limiter=KeyRateLimiter(), workers=workers)
+
+            print(f"{workers:>3} workers  {elapsed:6.2f}s  {stub.request_count - requests_before:>5} Torn calls  "
+                  f"{counts}  second pass {again}")
+            ok = ok and counts["detected"] == args.members and again["detected"] == again["ineligible"] == 0
+    stub.stop()
+
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
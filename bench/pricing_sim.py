@@ -0,0 +1,86 @@
+"""
+Pricing simulator check - POST /admin/pricing/simulate with no rollup
+history, then after seeding orders and rebuilding the rollups, timing each
+
+    python -m bench.pricing_sim --users 500 --orders 20000 --simulations 10000
+
+Uses a throwaway SQLite database unless DATABASE_URL is set (it must be
+empty). Exits non-zero unless both runs succeed, the empty history scores
+every candidate at zero and the seeded history prices some risk.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench import datagen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pricing simulator check")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--simulations", type=int, default=10000)
+    parser.add_argument("--horizon-days", type=int, default=30)
+    args = parser.parse_args()
+
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-pricing-"), "pricing.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import app as hjs
+    from services.rollups import rebuild_rollups
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        datagen.seed_pricing(hjs)
+        admin_id = datagen.seed_admin(hjs)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = admin_id
+
+    body = {
+        "grid": [{"coverage_type": "XAN", "duration": 4, "cost": [20, 30, 40]}],
+        "simulations": args.simulations,
+        "horizon_days": args.horizon_days,
+    }
+
+    def run(label: str) -> dict:
+        start = time.perf_counter()
+        response = client.post("/admin/pricing/simulate", json=body)
+        elapsed = (time.perf_counter() - start) * 1000
+        data = response.get_json()
+        results = data.get("results", [])
+        print(f"{label:<9} {response.status_code}  {elapsed:8.1f}ms  {len(data.get('tiers', [])):>3} tiers  "
+              f"expected profit {[r['expected_profit'] for r in results]}"
+              + (f"  error {data['error']}" if "error" in data else ""))
+        return data if response.status_code == 200 else {}
+
+    empty = run("empty")
+    ok = len(empty.get("results", [])) == 3 and all(
+        r["expected_profit"] == 0 and r["probability_of_loss"] == 0 for r in empty["results"]
+    )
+
+    with app.app_context():
+        user_ids = datagen.seed_users(hjs, args.users)
+        datagen.seed_orders(hjs, user_ids, args.orders)
+        datagen.seed_overdoses(hjs, user_ids, args.orders // 10)
+        rebuild_rollups(hjs.db, hjs.Order, hjs.Overdose, hjs.Rollup)
+        # The history is cached for a few minutes; this run should see the new rollups
+        from services.pricing_sim import get_pricing_history
+        get_pricing_history(hjs.Rollup).refresh()
+
+    seeded = run("seeded")
+    ok = ok and bool(seeded.get("tiers")) and any(r["expected_profit"] != 0 for r in seeded.get("results", []))
+
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
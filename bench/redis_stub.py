@@ -0,0 +1,125 @@
+"""
+Local Redis stand-in - speaks enough RESP (PING, AUTH, SELECT, GET, SET with
+EX/PX, DEL, INCR, FLUSHDB) for services/cache.py, so benchmarks and local
+runs don't need a Redis server
+
+Run standalone:  python -m bench.redis_stub --port 6390
+then:            CACHE_URL=redis://127.0.0.1:6390/0
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class RedisStub:
+    """Threaded TCP server with one shared keyspace (SELECT is accepted and ignored)"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.data = {}  # key -> (value bytes, expires_at or None)
+        self.command_count = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        args = self._read_command()
+                    except (ConnectionError, ValueError):
+                        return
+                    if args is None:
+                        return
+                    if stub.latency_ms:
+                        time.sleep(stub.latency_ms / 1000)
+                    self.wfile.write(stub.execute(args))
+
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                if not line.startswith(b"*"):
+                    raise ValueError("inline commands are not supported")
+                args = []
+                for _ in range(int(line[1:])):
+                    size = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(size + 2)[:-2])
+                return args
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, args: list) -> bytes:
+        command = args[0].upper()
+        with self._lock:
+            self.command_count += 1
+            if command == b"PING":
+                return b"+PONG\r\n"
+            if command in (b"AUTH", b"SELECT", b"FLUSHDB"):
+                if command == b"FLUSHDB":
+                    self.data.clear()
+                return b"+OK\r\n"
+            if command == b"GET":
+                entry = self._live(args[1])
+                return b"$-1\r\n" if entry is None else b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+            if command == b"SET":
+                expires_at = None
+                options = [a.upper() for a in args[3:]]
+                for i, option in enumerate(options[:-1]):
+                    if option in (b"EX", b"PX"):
+                        seconds = int(args[4 + i]) / (1 if option == b"EX" else 1000)
+                        expires_at = time.monotonic() + seconds
+                self.data[args[1]] = (args[2], expires_at)
+                return b"+OK\r\n"
+            if command == b"DEL":
+                deleted = sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+                return b":%d\r\n" % deleted
+            if command == b"INCR":
+                entry = self._live(args[1])
+                try:
+                    value = int(entry[0]) + 1 if entry else 1
+                except ValueError:
+                    return b"-ERR value is not an integer or out of range\r\n"
+                self.data[args[1]] = (str(value).encode(), entry[1] if entry else None)
+                return b":%d\r\n" % value
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Redis stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = RedisStub(args.host, args.port, args.latency_ms)
+    print(f"Redis stand-in listening on {stub.url} (latency {args.latency_ms}ms)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Benchmark runner - seeds a throwaway database, points the app at a local
+Torn API stub and runs the scripted scenarios
+
+    python -m bench.run                                  # all scenarios, temp SQLite db
+    python -m bench.run --scenario leaderboard --orders 100000
+    DATABASE_URL=postgresql://... python -m bench.run --json bench_output.json
+
+Every scenario reports p50/p95/p99 latency and throughput so runs can be
+diffed against each other.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import datagen
+from bench.torn_stub import TornStub, filler_events
+
+SCENARIOS = ["dashboard", "leaderboard", "verify", "order_burst"]
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(name: str, latencies: list, wall_seconds: float, **extra) -> dict:
+    values = sorted(latencies)
+    result = {
+        "scenario": name,
+        "requests": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 2),
+        "p95_ms": round(percentile(values, 95) * 1000, 2),
+        "p99_ms": round(percentile(values, 99) * 1000, 2),
+        "throughput_rps": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+        "wall_s": round(wall_seconds, 3),
+    }
+    result.update(extra)
+    return result
+
+
+def _timed_get(client, path: str, user_id: int) -> float:
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    start = time.perf_counter()
+    response = client.get(path)
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {path} returned {response.status_code}")
+    return elapsed
+
+
+def run_dashboard(hjs, ctx, args) -> dict:
+    client = ctx["app"].test_client()
+    rng = random.Random(args.seed)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        latencies.append(_timed_get(client, "/dashboard", rng.choice(ctx["user_ids"])))
+    return summarize("dashboard", latencies, time.perf_counter() - start)
+
+
+def run_leaderboard(hjs, ctx, args) -> dict:
+    client = ctx["app"].test_client()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(max(1, args.requests // 10)):
+        latencies.append(_timed_get(client, "/admin/leaderboard", ctx["admin_id"]))
+    return summarize("leaderboard", latencies, time.perf_counter() - start, orders=args.orders)
+
+
+def run_verify(hjs, ctx, args) -> dict:
+    with ctx["app"].app_context():
+        pending = datagen.seed_pending_orders(hjs, ctx["user_ids"], args.pending)
+        ctx["stub"].set_events(datagen.payment_events_for(hjs, pending) + filler_events(args.events))
+
+    client = ctx["app"].test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = ctx["admin_id"]
+
+    from services.job_queue import run_one
+    from services.tasks import build_job_handlers
+
+    handlers = build_job_handlers(hjs.db, hjs.User, hjs.Order, hjs.PricingConfig, hjs.AutoVerifySettings,
+                                  hjs.PaymentMatch, hjs.ADMIN_TORN_ID)
+
+    # Enqueue through the admin button, then drain the job in-process like a worker would
+    calls_before = ctx["stub"].request_count
+    start = time.perf_counter()
+    job_id = client.post("/admin/verify-orders-confirm").get_json()["job_id"]
+    with ctx["app"].app_context():
+        run_one(hjs.db, hjs.Job, handlers, "bench")
+        job = hjs.db.session.get(hjs.Job, job_id)
+        body = json.loads(job.result or "{}")
+    elapsed = time.perf_counter() - start
+
+    return summarize(
+        "verify", [elapsed], elapsed,
+        pending_orders=len(pending),
+        verified=body.get("verified"),
+        torn_calls=ctx["stub"].request_count - calls_before,
+        orders_per_s=round(len(pending) / elapsed, 2) if elapsed else 0.0,
+    )
+
+
+def run_order_burst(hjs, ctx, args) -> dict:
+    user_ids = ctx["user_ids"][-args.burst:]
+
+    def place(user_id):
+        client = ctx["app"].test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+        start = time.perf_counter()
+        response = client.post("/order/place", data={"coverage_type": "EXTC", "duration": 1})
+        elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f"POST /order/place returned {response.status_code}")
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(place, user_ids))
+    return summarize("order_burst", latencies, time.perf_counter() - start, concurrency=args.concurrency)
+
+
+RUNNERS = {
+    "dashboard": run_dashboard,
+    "leaderboard": run_leaderboard,
+    "verify": run_verify,
+    "order_burst": run_order_burst,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HJS benchmark suite")
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=100000, help="historical orders (leaderboard volume)")
+    parser.add_argument("--overdoses", type=int, default=5000)
+    parser.add_argument("--pending", type=int, default=1000, help="pending orders for the verify scenario")
+    parser.add_argument("--events", type=int, default=100, help="non-payment events served by the stub")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=100, help="orders placed in the burst scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated Torn API latency")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-bench-"), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    stub = TornStub(latency_ms=args.latency_ms).start()
+    os.environ["TORN_API_BASE"] = stub.url
+
+    import app as hjs
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Benchmarks need an empty database; refusing to seed over existing data.")
+
+        seed_start = time.perf_counter()
+        datagen.seed_pricing(hjs)
+        admin_id = datagen.seed_admin(hjs)
+        user_ids = datagen.seed_users(hjs, args.users)
+        datagen.seed_orders(hjs, user_ids, args.orders, seed=args.seed)
+        datagen.seed_overdoses(hjs, user_ids, args.overdoses, seed=args.seed)
+        print(f"Seeded {args.users} users, {args.orders} orders, {args.overdoses} overdoses "
+              f"in {time.perf_counter() - seed_start:.1f}s")
+
+    ctx = {"app": app, "admin_id": admin_id, "user_ids": user_ids, "stub": stub}
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+
+    results = []
+    for name in scenarios:
+        result = RUNNERS[name](hjs, ctx, args)
+        results.append(result)
+        extras = ", ".join(
+            f"{k}={v}" for k, v in result.items()
+            if k not in ("scenario", "requests", "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "wall_s")
+        )
+        print(f"{name:<12} n={result['requests']:<5} p50={result['p50_ms']:>8.2f}ms "
+              f"p95={result['p95_ms']:>8.2f}ms p99={result['p99_ms']:>8.2f}ms "
+              f"{result['throughput_rps']:>8.2f} req/s  {extras}")
+
+    stub.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
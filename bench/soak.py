@@ -0,0 +1,137 @@
+"""
+Soak test for the background worker - runs scheduler ticks and queued jobs
+back to back and checks that RSS stays flat and no transaction is left open
+between ticks
+
+    python -m bench.soak --ticks 100000 --max-growth-mb 10
+
+Uses a throwaway SQLite database unless DATABASE_URL is set (it must be
+empty). Exits non-zero when RSS grows by more than the allowance after warmup
+or a transaction is still open at a sample point.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bench import datagen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long-running worker memory soak")
+    parser.add_argument("--ticks", type=int, default=100000)
+    parser.add_argument("--warmup", type=int, default=2000, help="ticks before the RSS baseline is taken")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--load", type=int, default=25, help="orders (with users) loaded per tick")
+    parser.add_argument("--job-every", type=int, default=10, help="also enqueue and run a job every N ticks")
+    parser.add_argument("--max-growth-mb", type=float, default=10.0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-soak-"), "soak.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from sqlalchemy.orm import joinedload
+
+    import app as hjs
+    from services.instrumentation import rss_bytes, track_transactions
+    from services.job_queue import enqueue, run_one
+    from services.scheduler import Scheduler
+    from services.sessions import session_scope
+    from services.tasks import build_job_handlers, expire_orders
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+    db = hjs.db
+
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to soak against a non-empty database")
+        datagen.seed_pricing(hjs)
+        datagen.seed_admin(hjs)
+        user_ids = datagen.seed_users(hjs, args.users)
+        datagen.seed_orders(hjs, user_ids, args.orders)
+        datagen.seed_pending_orders(hjs, user_ids, args.users // 2)
+        tracker = track_transactions(db.engine)
+
+    scheduler = Scheduler(app, db, hjs.TaskRun)
+
+    @scheduler.task("soak_load", interval=1)
+    def soak_load():
+        # Touches every order and its user, as verification does
+        orders = (
+            hjs.Order.query
+            .options(joinedload(hjs.Order.user))
+            .filter(hjs.Order.status.in_(['pending', 'expired']))
+            .limit(args.load)
+            .all()
+        )
+        return {"orders": len(orders), "users": len({order.user.id for order in orders})}
+
+    @scheduler.task("expire", interval=1)
+    def expire():
+        return expire_orders(db, hjs.Order)
+
+    handlers = build_job_handlers(db, hjs.User, hjs.Order, hjs.PricingConfig, hjs.AutoVerifySettings,
+                                  hjs.PaymentMatch, hjs.ADMIN_TORN_ID)
+
+    def tick(i):
+        scheduler.run_now("soak_load")
+        if args.job_every and i % args.job_every == 0:
+            scheduler.run_now("expire")
+            with session_scope(app, db):
+                enqueue(db, hjs.Job, "recompute")
+            with session_scope(app, db):
+                run_one(db, hjs.Job, handlers, "soak")
+
+    start = time.perf_counter()
+    for i in range(args.warmup):
+        tick(i)
+
+    baseline = rss_bytes()
+    sample_every = max(1, args.ticks // args.samples)
+    samples = []
+    failures = []
+    for i in range(args.ticks):
+        tick(i)
+        if (i + 1) % sample_every == 0:
+            txns = tracker.snapshot()
+            rss_mb = rss_bytes() / (1024 * 1024)
+            samples.append({"tick": i + 1, "rss_mb": round(rss_mb, 1), "open_transactions": txns["open_transactions"]})
+            print(f"tick {i + 1:>8}  rss={rss_mb:7.1f}MB  open_transactions={txns['open_transactions']}", flush=True)
+            if txns["open_transactions"]:
+                failures.append(f"transaction left open at tick {i + 1}")
+
+    elapsed = time.perf_counter() - start
+    growth_mb = (max(rss_bytes(), *(s["rss_mb"] * 1024 * 1024 for s in samples)) - baseline) / (1024 * 1024)
+    if growth_mb > args.max_growth_mb:
+        failures.append(f"RSS grew {growth_mb:.1f}MB (allowed {args.max_growth_mb}MB)")
+
+    result = {
+        "ticks": args.ticks,
+        "seconds": round(elapsed, 1),
+        "ticks_per_second": round((args.ticks + args.warmup) / elapsed, 1),
+        "baseline_rss_mb": round(baseline / (1024 * 1024), 1),
+        "growth_mb": round(growth_mb, 1),
+        "samples": samples,
+        "failures": failures,
+    }
+    print(f"{result['ticks_per_second']} ticks/s, RSS growth after warmup {growth_mb:.1f}MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
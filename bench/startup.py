@@ -0,0 +1,71 @@
+"""
+Cold-start benchmark - time from a fresh interpreter importing wsgi.py to the
+first served response, measured in separate processes
+
+    python -m bench.startup --runs 10 --budget-ms 1500
+
+Exits non-zero when the median exceeds the budget, so it can gate a deploy.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.run import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from wsgi import app
+imported = time.perf_counter()
+response = app.test_client().get("/")
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (served - imported) * 1000,
+    "total_ms": (served - start) * 1000,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def measure_once(env) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import-to-first-response latency")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="fail if the median total exceeds this")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not env.get("DATABASE_URL"):
+        # "/" never touches the database, so an empty SQLite path is enough
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='hjs-startup-'), 'startup.db')}"
+
+    samples = [measure_once(env) for _ in range(args.runs)]
+
+    for key in ("import_ms", "first_response_ms", "total_ms"):
+        values = sorted(s[key] for s in samples)
+        print(f"{key:<18} p50={percentile(values, 50):8.1f}ms  p95={percentile(values, 95):8.1f}ms  "
+              f"max={values[-1]:8.1f}ms")
+    print(f"modules loaded     {samples[-1]['modules']}")
+
+    median_total = percentile(sorted(s["total_ms"] for s in samples), 50)
+    if median_total > args.budget_ms:
+        print(f"FAIL: median startup {median_total:.1f}ms exceeds budget {args.budget_ms:.0f}ms")
+        sys.exit(1)
+    print(f"OK: median startup {median_total:.1f}ms within budget {args.budget_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
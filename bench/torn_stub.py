@@ -0,0 +1,138 @@
+"""
+Local Torn API stub - serves synthetic `events` and `basic` selections so
+benchmarks never touch api.torn.com
+
+Run standalone:  python -m bench.torn_stub --port 8765 --latency-ms 50 --events 100
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def payment_event_text(sender_torn_id: int, sender_name: str, amount: int, message_code: str) -> str:
+    """Event HTML in the same shape Torn uses for incoming item transfers"""
+    return (
+        f'You were sent {amount}x Xanax from '
+        f'<a href = "http://www.torn.com/profiles.php?XID={sender_torn_id}">{sender_name}</a> '
+        f'with the message: {message_code}'
+    )
+
+
+def filler_events(count: int, seed: int = 1) -> list:
+    """Non-payment noise events (attacks, trades, ...) to pad out the event feed"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    templates = [
+        'Someone attacked you and lost.',
+        'You have been paid $1,000,000 for your job.',
+        'Your trade with <a href = "http://www.torn.com/profiles.php?XID=1">Chedburn</a> has been completed.',
+        'You were sent $5,000 from <a href = "http://www.torn.com/profiles.php?XID=2">Someone</a>.',
+    ]
+    return [
+        {"timestamp": now - rng.randint(60, 86400), "event": rng.choice(templates), "seen": 1}
+        for _ in range(count)
+    ]
+
+
+class TornStub:
+    """
+    Threaded HTTP server impersonating https://api.torn.com/user/
+
+    `events` is a list of {"timestamp", "event"} dicts; they are served keyed by
+    a synthetic event id like the real API. Keys of the form `stub<player_id>`
+    resolve to that player in the `basic` selection.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, events=None):
+        self.latency_ms = latency_ms
+        self.events = list(events or [])
+        self.request_count = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.request_count += 1
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000)
+
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                selections = (query.get("selections") or [""])[0]
+                key = (query.get("key") or [""])[0]
+                self._send(stub.respond(parsed.path, selections, key))
+
+            def _send(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def respond(self, path: str, selections: str, key: str) -> dict:
+        if not path.startswith("/user"):
+            return {"error": {"code": 4, "error": "Wrong selections"}}
+        if not key:
+            return {"error": {"code": 2, "error": "Incorrect Key"}}
+
+        if selections == "events":
+            with self._lock:
+                events = list(self.events)
+            return {"events": {str(1000000 + i): e for i, e in enumerate(events)}}
+
+        if selections == "basic":
+            player_id = int(key[4:]) if key.startswith("stub") and key[4:].isdigit() else 1
+            return {"player_id": player_id, "name": f"benchuser{player_id}", "level": 50, "gender": "Male"}
+
+        return {"error": {"code": 3, "error": "Incorrect selections"}}
+
+    def set_events(self, events):
+        with self._lock:
+            self.events = list(events)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Torn API stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--events", type=int, default=100, help="number of synthetic events to serve")
+    args = parser.parse_args()
+
+    stub = TornStub(args.host, args.port, args.latency_ms, filler_events(args.events))
+    print(f"Torn API stub listening on {stub.url} (latency {args.latency_ms}ms, {args.events} events)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
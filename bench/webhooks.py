@@ -0,0 +1,154 @@
+"""
+Webhook outbox check - activates and expires orders through the ORM, then
+drains the outbox into a local sink that fails a share of requests
+
+    python -m bench.webhooks --orders 2000 --fail-rate 0.3
+
+Uses a throwaway SQLite database unless DATABASE_URL is set (it must be
+empty). Exits non-zero unless every event reaches the sink at least once,
+in order per destination, with a valid signature.
+"""
+import argparse
+import hmac
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench import datagen
+
+SECRET = "bench-secret"
+
+
+class WebhookSink:
+    """Threaded HTTP server recording webhook batches; fails `fail_rate` of POSTs with a 503"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fail_rate: float = 0.0, seed: int = 1):
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.batches = []
+        self.failures = 0
+        self.bad_signatures = 0
+        self._lock = threading.Lock()
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self.send_response(sink.receive(body, self.headers.get("X-HJS-Signature", "")))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/hook"
+
+    def receive(self, body: bytes, signature: str) -> int:
+        from services.outbox import sign
+
+        with self._lock:
+            if not hmac.compare_digest(signature, sign(body, SECRET)):
+                self.bad_signatures += 1
+                return 401
+            if self.rng.random() < self.fail_rate:
+                self.failures += 1
+                return 503
+            self.batches.append(json.loads(body)["events"])
+            return 200
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook outbox delivery check")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--fail-rate", type=float, default=0.3)
+    parser.add_argument("--commit-every", type=int, default=50, help="orders activated per transaction")
+    args = parser.parse_args()
+
+    sink = WebhookSink(fail_rate=args.fail_rate).start()
+    os.environ["WEBHOOK_URLS"] = sink.url
+    os.environ["WEBHOOK_SECRET"] = SECRET
+    if not os.environ.get("DATABASE_URL"):
+        db_path = os.path.join(tempfile.mkdtemp(prefix="hjs-webhooks-"), "webhooks.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    import app as hjs
+    from services import outbox
+    from services.tasks import expire_orders
+
+    app = hjs.create_app()
+    hjs.init_db(app)
+    # Retry immediately so the run measures delivery, not backoff sleeps
+    outbox.BACKOFF_BASE_SECONDS = 0
+
+    with app.app_context():
+        if hjs.User.query.first() is not None:
+            sys.exit("Refusing to run against a non-empty database")
+        datagen.seed_pricing(hjs)
+        user_ids = datagen.seed_users(hjs, args.orders)
+        datagen.seed_pending_orders(hjs, user_ids, args.orders)
+
+        start = time.perf_counter()
+        now = datetime.utcnow()
+        orders = hjs.Order.query.filter_by(status='pending').order_by(hjs.Order.id).all()
+        for index, order in enumerate(orders, start=1):
+            order.status = 'active'
+            order.payment_verified = True
+            order.activated_at = now
+            # Every other order is already past its expiry, so expire_orders has work
+            order.expires_at = now + timedelta(hours=-1 if index % 2 else 24)
+            if index % args.commit_every == 0:
+                hjs.db.session.commit()
+        hjs.db.session.commit()
+        expired = expire_orders(hjs.db, hjs.Order)["expired"]
+        written = time.perf_counter() - start
+        queued = hjs.OutboxEvent.query.count()
+        print(f"{len(orders)} activated, {expired} expired in {written:.2f}s -> {queued} outbox rows")
+
+        start = time.perf_counter()
+        totals = {"delivered": 0, "failed": 0, "dead": 0}
+        runs = 0
+        while hjs.OutboxEvent.query.filter(hjs.OutboxEvent.status.in_(['pending', 'sending'])).count():
+            for key, value in outbox.deliver_due(hjs.db, hjs.OutboxEvent).items():
+                totals[key] += value
+            runs += 1
+        elapsed = time.perf_counter() - start
+    sink.stop()
+
+    received = [event for batch in sink.batches for event in batch]
+    ids = [event["id"] for event in received]
+    print(f"{runs} deliver_due runs in {elapsed:.2f}s: {totals}")
+    print(f"sink: {len(sink.batches)} batches, {len(received)} events, {sink.failures} injected failures, "
+          f"{sink.bad_signatures} bad signatures")
+
+    ok = (
+        len(set(ids)) == queued == len(orders) + expired
+        and ids == sorted(ids)
+        and sink.bad_signatures == 0
+        and totals["dead"] == 0
+    )
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Gunicorn settings for Railway.
+
+Most request time is spent waiting on api.torn.com (up to 8-10s per call), so
+workers are threaded: a few processes for CPU, many threads per process so a
+slow Torn call only pins one thread. All values can be overridden via env.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count() * 2)))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+
+# Torn calls time out at 10s; leave headroom before gunicorn kills the worker
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = 20
+keepalive = 5
+
+# Recycle workers periodically to cap slow memory growth
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+# Import the app once in the master so forked workers share the code pages
+preload_app = True
+
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "warning")
+
+# Set RUN_SCHEDULER=0 when worker.py runs as its own service
+run_scheduler = os.environ.get("RUN_SCHEDULER", "1") != "0"
+
+
+def post_fork(server, worker):
+    # The master imported the app (preload_app); drop any pooled connections it
+    # may hold so each worker opens its own instead of sharing sockets.
+    from app import db
+    from wsgi import app
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def when_ready(server):
+    # One scheduler child per replica, owned by the master rather than a thread in
+    # every worker. It isn't restarted if it dies (the master reaps it as a stray
+    # worker). With several replicas each starts one; the scheduler lease
+    # (services/scheduler.py) lets one of them run tasks at a time, and a standby
+    # on another replica takes over if the running one dies.
+    if not run_scheduler:
+        return
+    worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+    server.scheduler_process = subprocess.Popen([sys.executable, worker_script])
+    server.log.info("Started scheduler process (pid %s)", server.scheduler_process.pid)
+
+
+def on_exit(server):
+    process = getattr(server, "scheduler_process", None)
+    if process and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
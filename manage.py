@@ -0,0 +1,162 @@
+"""
+One-off management commands, run outside the web workers
+
+    python manage.py migrate        # create missing tables/columns/indexes
+    python manage.py check-schema   # exit 1 if the database is behind the models
+    python manage.py export orders --format csv --since 2024-01-01 -o orders.csv
+    python manage.py reconcile events.jsonl --report report.json [--apply]
+    python manage.py rebuild-rollups  # recompute analytics rollups from all history
+    python manage.py create-api-token "faction bot"  # prints the token once
+"""
+import argparse
+import sys
+
+
+def cmd_migrate(args):
+    from app import create_app, init_db
+
+    applied = init_db(create_app())
+    for item in applied:
+        print(f"Created {item}")
+    print("Database schema is up to date.")
+
+
+def cmd_check_schema(args):
+    from app import create_app, db
+    from services.schema import schema_diff, describe
+
+    app = create_app()
+    with app.app_context():
+        missing = schema_diff(db)
+
+    for item in missing:
+        print(f"Missing {describe(item)}")
+    if missing:
+        print("Run `python manage.py migrate` to apply.")
+        sys.exit(1)
+    print("Database schema is up to date.")
+
+
+def cmd_export(args):
+    from app import create_app, db, User, Order, Overdose
+    from services.exports import stream_export, parse_date
+
+    app = create_app()
+    with app.app_context():
+        try:
+            chunks = stream_export(
+                db, User, Order, Overdose, args.kind, args.format,
+                since=parse_date(args.since), until=parse_date(args.until),
+                status=args.status, coverage_type=args.coverage_type,
+            )
+        except ValueError as e:
+            sys.exit(str(e))
+
+        out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+
+
+def cmd_reconcile(args):
+    from app import create_app, db, User, Order, PaymentMatch
+    from services.reconciliation import read_payments, reconcile, apply_fixes, summarize, to_json
+    from services.user_directory import get_user_directory
+
+    # Parse before opening the app so the worker processes stay light
+    parsed = read_payments(args.dump, fmt=args.format, workers=args.workers, chunk_size=args.chunk_size)
+
+    app = create_app()
+    with app.app_context():
+        report = reconcile(db, User, Order, PaymentMatch, parsed["payments"], get_user_directory(User))
+        report.update(events_read=parsed["events_read"], bad_lines=parsed["bad_lines"],
+                      duplicate_events=parsed["duplicate_events"])
+        if args.apply:
+            report["applied"] = apply_fixes(db, Order, PaymentMatch, parsed["payments"], report, args.batch_size)
+
+    for key, value in summarize(report).items():
+        print(f"{key}: {value}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as out:
+            out.write(to_json(report))
+        print(f"Full report written to {args.report}")
+
+
+def cmd_rebuild_rollups(args):
+    from app import create_app, db, Order, Overdose, Rollup
+    from services.rollups import rebuild_rollups
+
+    app = create_app()
+    with app.app_context():
+        result = rebuild_rollups(db, Order, Overdose, Rollup)
+    print(f"Rebuilt {result['buckets']} rollup buckets.")
+
+
+def cmd_create_api_token(args):
+    from app import create_app, db, ApiToken
+    from services.api_tokens import create_token
+
+    app = create_app()
+    with app.app_context():
+        token, row = create_token(db, ApiToken, args.name)
+        print(f"Token {row.id} for {row.name!r} (shown once, store it now):")
+    print(token)
+
+
+def cmd_revoke_api_token(args):
+    from app import create_app, db, ApiToken
+    from services.api_tokens import revoke_token
+
+    app = create_app()
+    with app.app_context():
+        if not revoke_token(db, ApiToken, args.id):
+            sys.exit(f"No live token with id {args.id}")
+    print(f"Revoked token {args.id}.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HJS management commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("migrate", aliases=["init-db"], help="create missing tables, columns and indexes").set_defaults(func=cmd_migrate)
+    sub.add_parser("check-schema", help="report schema drift without changing anything").set_defaults(func=cmd_check_schema)
+
+    export = sub.add_parser("export", help="stream orders, overdoses or payouts as CSV/NDJSON")
+    export.add_argument("kind", choices=["orders", "overdoses", "payouts"])
+    export.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    export.add_argument("--since", help="ISO date/datetime, inclusive")
+    export.add_argument("--until", help="ISO date/datetime, exclusive")
+    export.add_argument("--status", help="orders: pending/active/completed/expired/cancelled; overdoses: pending/confirmed")
+    export.add_argument("--coverage-type", choices=["XAN", "EXTC"])
+    export.add_argument("-o", "--output", help="file to write (default: stdout)")
+    export.set_defaults(func=cmd_export)
+
+    reconcile = sub.add_parser("reconcile", help="replay a Torn events dump and reconcile it against orders")
+    reconcile.add_argument("dump", help="JSON events payload or JSONL (one event or API response per line)")
+    reconcile.add_argument("--format", choices=["json", "jsonl"], help="default: from the file extension")
+    reconcile.add_argument("--workers", type=int, help="parser processes (default: one per CPU, 0: no pool)")
+    reconcile.add_argument("--chunk-size", type=int, default=5000, help="lines/events per parser task")
+    reconcile.add_argument("--report", help="write the full report as JSON to this file")
+    reconcile.add_argument("--apply", action="store_true", help="activate paid pending orders")
+    reconcile.add_argument("--batch-size", type=int, default=500, help="orders per transaction with --apply")
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    sub.add_parser("rebuild-rollups", help="recompute analytics rollups from all history").set_defaults(func=cmd_rebuild_rollups)
+
+    create_token = sub.add_parser("create-api-token", help="issue a bearer token for /api/v1")
+    create_token.add_argument("name", help="who the token is for")
+    create_token.set_defaults(func=cmd_create_api_token)
+
+    revoke_token = sub.add_parser("revoke-api-token", help="revoke an API token by id")
+    revoke_token.add_argument("id", type=int)
+    revoke_token.set_defaults(func=cmd_revoke_api_token)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,24 @@
 """
 Admin routes for order management and verification
 """
-from flask import render_template, redirect, url_for, session, flash, request, jsonify
+import json
 from datetime import datetime, timedelta
-import sys
-import os
 
-# Add parent directory to path for imports
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import render_template, redirect, url_for, session, flash, request, jsonify, Response, stream_with_context
+from sqlalchemy.orm import joinedload
 
-from services.order_verification import verify_order_payment, auto_detect_new_orders
+from services.bulk_activation import bulk_activate, parse_rows, MAX_ROWS
+from services.cache import get_cache
+from services.exports import stream_export, parse_date
+from services.job_queue import enqueue
+from services.rollups import GRANULARITIES, rollup_series, rollup_totals
 
+# Pending overdoses listed on /admin; confirmed in bulk from there
+PENDING_OVERDOSE_LIMIT = 200
+LEADERBOARD_TTL = 300  # order commits invalidate it sooner; capped per process with memory://
 
-def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, Overdose=None):
+
+def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, Overdose=None, Job=None, TaskRun=None, Rollup=None):
     
     def require_admin():
         """Check if current user is admin"""
@@ -67,7 +73,18 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
         # Get pending overdoses only (not confirmed)
         pending_overdoses = []
         if Overdose:
-            pending_overdoses = Overdose.query.filter_by(confirmed=False).order_by(Overdose.reported_at.desc()).limit(20).all()
+            pending_overdoses = (
+                Overdose.query.options(joinedload(Overdose.user))
+                .filter_by(confirmed=False)
+                .order_by(Overdose.reported_at.desc())
+                .limit(PENDING_OVERDOSE_LIMIT)
+                .all()
+            )
+        
+        # Recent scheduler runs
+        task_runs = []
+        if TaskRun:
+            task_runs = TaskRun.query.order_by(TaskRun.started_at.desc()).limit(25).all()
         
         return render_template("admin.html",
                              user=admin,
@@ -76,7 +93,8 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
                              auto_settings=auto_settings,
                              xan_prices=xan_prices,
                              extc_prices=extc_prices,
-                             recent_overdoses=pending_overdoses)
+                             recent_overdoses=pending_overdoses,
+                             task_runs=task_runs)
     
     @app.get("/admin/orders/pending-to-verify")
     def get_pending_orders_to_verify():
@@ -142,43 +160,14 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
         if not admin.api_key:
             return jsonify({"error": "Admin API key not configured"}), 400
         
-        # Get all pending orders
-        pending_orders = Order.query.filter_by(status='pending', payment_verified=False).all()
-        
-        verified_count = 0
-        failed_count = 0
-        
-        for order in pending_orders:
-            try:
-                verified, payment_time, event = verify_order_payment(order, admin.api_key)
-                
-                if verified:
-                    order.payment_verified = True
-                    order.payment_verified_at = payment_time
-                    order.status = 'active'
-                    order.activated_at = datetime.utcnow()
-                    
-                    # Set expiration for orders
-                    if order.coverage_type == 'XAN' and order.hours:
-                        order.expires_at = datetime.utcnow() + timedelta(hours=order.hours)
-                    elif order.coverage_type == 'EXTC':
-                        order.expires_at = datetime.utcnow() + timedelta(hours=2)
-                    
-                    verified_count += 1
-                else:
-                    failed_count += 1
-            except Exception as e:
-                failed_count += 1
-                continue
-        
-        if verified_count > 0:
-            db.session.commit()
+        # Verification runs on the job workers; poll /admin/jobs/<id> for the result
+        job = enqueue(db, Job, 'verify', {"user_id": admin.id})
         
         return jsonify({
             "success": True,
-            "verified": verified_count,
-            "failed": failed_count
-        }), 200
+            "queued": True,
+            "job_id": job.id
+        }), 202
     
     @app.post("/admin/verify-orders")
     def verify_orders_manual():
@@ -190,59 +179,40 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
             flash("Admin API key not configured. Cannot verify orders.", "error")
             return redirect(url_for("admin_panel"))
         
-        # Get all pending orders
-        pending_orders = Order.query.filter_by(status='pending', payment_verified=False).all()
-        
-        verified_count = 0
-        for order in pending_orders:
-            verified, payment_time, event = verify_order_payment(order, admin.api_key)
-            
-            if verified:
-                order.payment_verified = True
-                order.payment_verified_at = payment_time
-                order.status = 'active'
-                order.activated_at = datetime.utcnow()
-                
-                # Set expiration for orders
-                if order.coverage_type == 'XAN' and order.hours:
-                    order.expires_at = datetime.utcnow() + timedelta(hours=order.hours)
-                elif order.coverage_type == 'EXTC':
-                    order.expires_at = datetime.utcnow() + timedelta(hours=2)
-                
-                verified_count += 1
-        
-        if verified_count > 0:
-            db.session.commit()
-            flash(f"✅ Successfully verified {verified_count} order(s)!", "success")
-        else:
-            flash("No pending payments found to verify.", "info")
+        enqueue(db, Job, 'verify', {"user_id": admin.id})
+        flash("Verification queued. Orders will activate as soon as a worker picks it up.", "info")
         
         return redirect(url_for("admin_panel"))
 
     @app.post("/admin/orders/expire-now")
     def expire_active_orders_now():
-        """Manually expire active orders whose expires_at has passed."""
+        """Queue expiry of active orders whose expires_at has passed."""
         admin = require_admin()
         if not admin:
             return jsonify({"error": "Unauthorized"}), 403
 
-        now = datetime.utcnow()
+        job = enqueue(db, Job, 'expire')
 
-        expired_active = Order.query.filter(
-            Order.status == 'active',
-            Order.expires_at.isnot(None),
-            Order.expires_at < now
-        ).all()
+        return jsonify({"success": True, "queued": True, "job_id": job.id}), 202
 
-        count = 0
-        for order in expired_active:
-            order.status = 'expired'
-            count += 1
+    @app.get("/admin/jobs/<int:job_id>")
+    def job_status(job_id):
+        admin = require_admin()
+        if not admin:
+            return jsonify({"error": "Unauthorized"}), 403
 
-        if count > 0:
-            db.session.commit()
+        job = Job.query.get(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
 
-        return jsonify({"success": True, "expired": count}), 200
+        return jsonify({
+            "id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "attempts": job.attempts,
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.last_error.strip().splitlines()[-1] if job.last_error else None
+        }), 200
     
     @app.post("/admin/toggle-auto-verify")
     def toggle_auto_verify():
@@ -430,6 +400,36 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
         
         return jsonify({"success": True}), 200
     
+    @app.post("/admin/pricing/simulate")
+    def simulate_pricing():
+        """
+        Monte Carlo profit and tail risk for candidate price sets against order/overdose history.
+        JSON: {candidates: [[tier, ...], ...], grid: [tier with value lists], simulations,
+               horizon_days, item_values: {edvds, ecstasy}}; tiers not given keep current prices
+        """
+        admin = require_admin()
+        if not admin:
+            return jsonify({"error": "Unauthorized"}), 403
+        
+        try:
+            from services.pricing_sim import current_prices, expand_candidates, get_pricing_history, simulate
+        except ImportError:
+            return jsonify({"error": "Pricing simulation needs numpy installed"}), 503
+        
+        data = request.get_json(silent=True) or {}
+        try:
+            price_sets = expand_candidates(current_prices(PricingConfig), data.get("candidates"), data.get("grid"))
+            result = simulate(
+                get_pricing_history(Rollup), price_sets,
+                simulations=data.get("simulations", 10000),
+                horizon_days=data.get("horizon_days", 30),
+                item_values=data.get("item_values"),
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({"success": True, **result}), 200
+    
     @app.post("/admin/settings/auto-delete")
     def toggle_auto_delete():
         admin = require_admin()
@@ -477,61 +477,132 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        # Get pricing for validation
-        pricing = PricingConfig.query.filter_by(
-            coverage_type=coverage_type,
-            duration=duration,
-            active=True
-        ).first()
-        
-        if not pricing:
+        # Same path as bulk activation, with a single row
+        (result,) = bulk_activate(db, User, Order, PricingConfig, [{
+            "torn_user_id": user.torn_user_id,
+            "coverage_type": coverage_type,
+            "duration": duration,
+        }])
+        if result["status"] != "activated":
             return jsonify({"error": "Invalid coverage configuration"}), 400
         
-        # Deactivate any existing active coverage of same type for this user
-        existing_active = Order.query.filter_by(
-            user_id=user.id,
-            coverage_type=coverage_type,
-            status='active'
-        ).first()
-        if existing_active:
-            existing_active.status = 'completed'
-        
-        # Delete any pending order of the same type
-        existing_pending = Order.query.filter_by(
-            user_id=user.id,
-            coverage_type=coverage_type,
-            status='pending'
-        ).first()
-        
-        if existing_pending:
-            db.session.delete(existing_pending)
-        
-        # Create new active order
-        now = datetime.utcnow()
-        # XAN orders expire after specified hours, EXTC orders always expire in 2 hours
-        expires_at = now + timedelta(hours=duration) if coverage_type == 'XAN' else now + timedelta(hours=2)
-        
-        order = Order(
-            user_id=user.id,
-            coverage_type=coverage_type,
-            status='active',
-            xanax_payment=pricing.cost,
-            payment_verified=True,
-            payment_verified_at=now,
-            activated_at=now,
-            expires_at=expires_at,
-            hours=duration if coverage_type == 'XAN' else None,
-            jumps=duration if coverage_type == 'EXTC' else None,
-            xanax_reward=pricing.xanax_reward,
-            edvds_reward=pricing.edvds_reward,
-            ecstasy_reward=pricing.ecstasy_reward
-        )
-        
-        db.session.add(order)
-        db.session.commit()
-        
         flash(f"Manually activated {coverage_type} cover for {user.torn_name}", "success")
-        return jsonify({"success": True, "order_id": order.id}), 201
+        return jsonify({"success": True, "order_id": result["order_id"]}), 201
+    
+    @app.post("/admin/orders/activate-bulk")
+    def activate_orders_bulk():
+        """
+        Activate many covers at once: JSON {"rows": [...], "dry_run": bool} or an
+        uploaded CSV/JSON file (form field "file", optional "dry_run")
+        """
+        admin = require_admin()
+        if not admin:
+            return jsonify({"error": "Unauthorized"}), 403
+        
+        upload = request.files.get("file")
+        try:
+            if upload:
+                fmt = "json" if upload.filename.lower().endswith(".json") else "csv"
+                rows = parse_rows(upload.read().decode("utf-8-sig"), fmt)
+                dry_run = request.form.get("dry_run") in ("1", "true", "on")
+            else:
+                data = request.get_json(silent=True) or {}
+                rows = data.get("rows")
+                if not isinstance(rows, list):
+                    return jsonify({"error": "Send rows as JSON or upload a CSV/JSON file"}), 400
+                dry_run = bool(data.get("dry_run"))
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({"error": f"Could not read upload: {e}"}), 400
+        
+        if len(rows) > MAX_ROWS:
+            return jsonify({"error": f"At most {MAX_ROWS} rows per import"}), 400
+        
+        results = bulk_activate(db, User, Order, PricingConfig, rows, dry_run=dry_run)
+        summary = {}
+        for result in results:
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+        
+        return jsonify({"success": True, "dry_run": dry_run, "summary": summary, "results": results}), 200
+    
+    @app.get("/admin/export/<kind>")
+    def export_records(kind):
+        """
+        Stream orders, overdoses or payouts as CSV (default) or NDJSON.
+        Filters: since/until (ISO dates), status, coverage_type
+        """
+        admin = require_admin()
+        if not admin:
+            return jsonify({"error": "Unauthorized"}), 403
+        
+        fmt = request.args.get("format", "csv")
+        try:
+            chunks = stream_export(
+                db, User, Order, Overdose, kind, fmt,
+                since=parse_date(request.args.get("since")),
+                until=parse_date(request.args.get("until")),
+                status=request.args.get("status") or None,
+                coverage_type=request.args.get("coverage_type") or None,
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={kind}.{fmt}"})
+    
+    def analytics_query():
+        """(granularity, series) for /admin/analytics and its JSON API; raises ValueError on bad filters"""
+        granularity = request.args.get("granularity", "day")
+        if granularity not in GRANULARITIES:
+            raise ValueError("granularity must be hour or day")
+        coverage_type = request.args.get("coverage_type") or None
+        if coverage_type not in (None, "XAN", "EXTC"):
+            raise ValueError("coverage_type must be XAN or EXTC")
+        # Default range: the last 30 days (48 hours when hourly)
+        default_span = timedelta(days=30) if granularity == "day" else timedelta(hours=48)
+        since = parse_date(request.args.get("since")) or datetime.utcnow() - default_span
+        until = parse_date(request.args.get("until"))
+        return granularity, rollup_series(Rollup, granularity, since, until, coverage_type)
+    
+    @app.get("/admin/analytics")
+    def analytics():
+        """Premiums, payouts and loss ratio from the precomputed rollups"""
+        admin = require_admin()
+        if not admin:
+            flash("Access denied. Admin privileges required.", "error")
+            return redirect(url_for("home"))
+        
+        try:
+            granularity, series = analytics_query()
+        except ValueError as e:
+            flash(str(e), "error")
+            return redirect(url_for("analytics"))
+        
+        return render_template("analytics.html",
+                             user=admin,
+                             granularity=granularity,
+                             series=series,
+                             totals=rollup_totals(series))
+    
+    @app.get("/admin/analytics.json")
+    def analytics_json():
+        admin = require_admin()
+        if not admin:
+            return jsonify({"error": "Unauthorized"}), 403
+        
+        try:
+            granularity, series = analytics_query()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify({"granularity": granularity, "series": series, "totals": rollup_totals(series)}), 200
+    
+    @app.get("/admin/cache/stats")
+    def cache_stats():
+        """Shared cache hit/miss counters per namespace, for the worker that serves this request"""
+        if not require_admin():
+            return jsonify({"error": "Admin access required"}), 403
+        return jsonify(get_cache().stats())
     
     @app.get("/admin/leaderboard")
     def leaderboard():
@@ -541,78 +612,83 @@ def init_admin_routes(app, db, User, Order, PricingConfig, AutoVerifySettings, O
             flash("Access denied. Admin privileges required.", "error")
             return redirect(url_for("home"))
         
-        # Get all users with their payment and overdose statistics
-        from sqlalchemy import func, case
-        
-        user_stats = db.session.query(
-            User.id,
-            User.torn_user_id,
-            User.torn_name,
-            func.count(Order.id).label('total_orders'),
-            func.sum(case(
-                (Order.coverage_type == 'XAN', Order.xanax_payment),
-                else_=0
-            )).label('xan_paid'),
-            func.sum(case(
-                (Order.coverage_type == 'EXTC', Order.xanax_payment),
-                else_=0
-            )).label('extc_paid'),
-            func.sum(case(
-                (Order.status == 'active', 1),
-                else_=0
-            )).label('active_orders'),
-            func.sum(Order.xanax_payment).label('total_xanax_spent')
-        ).outerjoin(Order, User.id == Order.user_id).group_by(
-            User.id,
-            User.torn_user_id,
-            User.torn_name
-        ).order_by(
-            func.count(Order.id).desc()
-        ).all()
-        
-        # Get overdose payouts per user and coverage type
-        overdose_stats = db.session.query(
-            Overdose.user_id,
-            Overdose.coverage_type,
-            func.sum(Overdose.payout_xanax).label('total_xanax_payout'),
-            func.sum(Overdose.payout_edvds).label('total_edvds_payout'),
-            func.sum(Overdose.payout_ecstasy).label('total_ecstasy_payout')
-        ).filter(
-            Overdose.confirmed == True
-        ).group_by(
-            Overdose.user_id,
-            Overdose.coverage_type
-        ).all()
-        
-        # Create a dictionary for quick lookup of overdose payouts
-        overdose_dict = {}
-        for stat in overdose_stats:
-            key = (stat.user_id, stat.coverage_type)
-            overdose_dict[key] = {
-                'xanax': stat.total_xanax_payout or 0,
-                'edvds': stat.total_edvds_payout or 0,
-                'ecstasy': stat.total_ecstasy_payout or 0
-            }
-        
-        # Format results
-        leaderboard_data = []
-        for rank, user in enumerate(user_stats, 1):
-            xan_payout_data = overdose_dict.get((user.id, 'XAN'), {'xanax': 0, 'edvds': 0, 'ecstasy': 0})
-            extc_payout_data = overdose_dict.get((user.id, 'EXTC'), {'xanax': 0, 'edvds': 0, 'ecstasy': 0})
+        def build_leaderboard():
+            # Get all users with their payment and overdose statistics
+            from sqlalchemy import func, case
+        
+            user_stats = db.session.query(
+                User.id,
+                User.torn_user_id,
+                User.torn_name,
+                func.count(Order.id).label('total_orders'),
+                func.sum(case(
+                    (Order.coverage_type == 'XAN', Order.xanax_payment),
+                    else_=0
+                )).label('xan_paid'),
+                func.sum(case(
+                    (Order.coverage_type == 'EXTC', Order.xanax_payment),
+                    else_=0
+                )).label('extc_paid'),
+                func.sum(case(
+                    (Order.status == 'active', 1),
+                    else_=0
+                )).label('active_orders'),
+                func.sum(Order.xanax_payment).label('total_xanax_spent')
+            ).outerjoin(Order, User.id == Order.user_id).group_by(
+                User.id,
+                User.torn_user_id,
+                User.torn_name
+            ).order_by(
+                func.count(Order.id).desc()
+            ).all()
+        
+            # Get overdose payouts per user and coverage type
+            overdose_stats = db.session.query(
+                Overdose.user_id,
+                Overdose.coverage_type,
+                func.sum(Overdose.payout_xanax).label('total_xanax_payout'),
+                func.sum(Overdose.payout_edvds).label('total_edvds_payout'),
+                func.sum(Overdose.payout_ecstasy).label('total_ecstasy_payout')
+            ).filter(
+                Overdose.confirmed == True
+            ).group_by(
+                Overdose.user_id,
+                Overdose.coverage_type
+            ).all()
+        
+            # Create a dictionary for quick lookup of overdose payouts
+            overdose_dict = {}
+            for stat in overdose_stats:
+                key = (stat.user_id, stat.coverage_type)
+                overdose_dict[key] = {
+                    'xanax': stat.total_xanax_payout or 0,
+                    'edvds': stat.total_edvds_payout or 0,
+                    'ecstasy': stat.total_ecstasy_payout or 0
+                }
+        
+            # Format results
+            leaderboard_data = []
+            for rank, user in enumerate(user_stats, 1):
+                xan_payout_data = overdose_dict.get((user.id, 'XAN'), {'xanax': 0, 'edvds': 0, 'ecstasy': 0})
+                extc_payout_data = overdose_dict.get((user.id, 'EXTC'), {'xanax': 0, 'edvds': 0, 'ecstasy': 0})
             
-            leaderboard_data.append({
-                'rank': rank,
-                'user_id': user.torn_user_id,
-                'user_name': user.torn_name,
-                'total_orders': user.total_orders or 0,
-                'xan_paid': user.xan_paid or 0,
-                'extc_paid': user.extc_paid or 0,
-                'xan_overdose_payout': xan_payout_data['xanax'],
-                'extc_overdose_xanax': extc_payout_data['xanax'],
-                'extc_overdose_edvds': extc_payout_data['edvds'],
-                'extc_overdose_ecstasy': extc_payout_data['ecstasy'],
-                'active_orders': user.active_orders or 0,
-                'total_xanax_spent': user.total_xanax_spent or 0
-            })
+                leaderboard_data.append({
+                    'rank': rank,
+                    'user_id': user.torn_user_id,
+                    'user_name': user.torn_name,
+                    'total_orders': user.total_orders or 0,
+                    'xan_paid': user.xan_paid or 0,
+                    'extc_paid': user.extc_paid or 0,
+                    'xan_overdose_payout': xan_payout_data['xanax'],
+                    'extc_overdose_xanax': extc_payout_data['xanax'],
+                    'extc_overdose_edvds': extc_payout_data['edvds'],
+                    'extc_overdose_ecstasy': extc_payout_data['ecstasy'],
+                    'active_orders': user.active_orders or 0,
+                    'total_xanax_spent': user.total_xanax_spent or 0
+                })
+            return leaderboard_data
+        
+        # Shared cache; order, overdose and user commits invalidate it
+        leaderboard_data = get_cache().get_or_set("leaderboard", "all", build_leaderboard, ttl=LEADERBOARD_TTL)
         
         return render_template("leaderboard.html", leaderboard=leaderboard_data, user=admin)
@@ -0,0 +1,35 @@
+"""
+Token-authenticated JSON API for bots and integrations (/api/v1)
+"""
+from flask import request, jsonify
+
+from services.api_tokens import authenticate
+from services.coverage_status import coverage_status, parse_torn_ids
+
+
+def init_api_routes(app, db, User, Order, Overdose, ApiToken):
+    
+    @app.route("/api/v1/coverage", methods=["GET", "POST"])
+    def api_coverage():
+        """
+        Coverage and overdose eligibility for up to 500 Torn ids in one query:
+        GET ?ids=1,2,3 or POST {"torn_ids": [...]}. Send If-None-Match with the
+        last ETag to get an empty 304 when nothing changed.
+        """
+        if not authenticate(db, ApiToken, request.headers.get("Authorization")):
+            return jsonify({"error": "Invalid or missing API token"}), 401, {"WWW-Authenticate": "Bearer"}
+        
+        if request.method == "POST":
+            data = request.get_json(silent=True) or {}
+            values = data.get("torn_ids")
+        else:
+            values = request.args.get("ids", "")
+        try:
+            torn_ids = parse_torn_ids(values)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        response = jsonify({"users": coverage_status(db, User, Order, Overdose, torn_ids)})
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.add_etag()
+        return response.make_conditional(request)
@@ -1,10 +1,15 @@
-import requests
+import time
+
 from flask import request, redirect, url_for, session, flash
 
+from services.torn_client import TornUnavailable
+
 
 def init_auth_routes(app, db, User, fetch_torn_basic, admin_torn_id, mod_torn_ids):
     @app.post("/login")
     def login():
+        import requests
+
         api_key = (request.form.get("api_key") or "").strip()
 
         try:
@@ -22,6 +27,9 @@ def init_auth_routes(app, db, User, fetch_torn_basic, admin_torn_id, mod_torn_id
             else:
                 role_id = 1
 
+        except TornUnavailable:
+            flash("Torn's API is having problems right now. Try again in a minute.", "error")
+            return redirect(url_for("home"))
         except requests.RequestException:
             flash("Network/API problem talking to Torn. Try again in a moment.", "error")
             return redirect(url_for("home"))
@@ -46,6 +54,14 @@ def init_auth_routes(app, db, User, fetch_torn_basic, admin_torn_id, mod_torn_id
             user.torn_name = torn_name
             user.role_id = role_id
 
+        # Opt-in only; turning detection off is on the overdose page
+        if request.form.get("watch_overdoses"):
+            user.api_key = api_key
+            if not user.overdose_autodetect:
+                user.overdose_autodetect = True
+                # Only overdoses from now on; older ones were handled by hand
+                user.events_cursor = int(time.time())
+
         db.session.commit()
 
         session.clear()
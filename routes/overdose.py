@@ -1,12 +1,18 @@
 """
 Overdose reporting and management routes
 """
-from flask import render_template, redirect, url_for, session, flash, request, jsonify
+import csv
+import io
+import time
 from datetime import datetime, timedelta
-import sys
-import os
 
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import render_template, redirect, url_for, session, flash, request, jsonify, Response
+from sqlalchemy.exc import IntegrityError
+
+from services.overdose_eligibility import cached_eligibility, check_eligibility, refresh_next_xan_report_at
+from services.overdose_payouts import confirm_overdoses, payout_sheet
+
+MAX_BULK_CONFIRM = 500
 
 
 def init_overdose_routes(app, db, User, Order, Overdose):
@@ -52,31 +58,22 @@ def init_overdose_routes(app, db, User, Order, Overdose):
         if not uid:
             return jsonify({"error": "Not logged in"}), 401
         
-        user = User.query.get(uid)
-        if not user:
+        # Active coverage, cooldowns and pending reports in one query
+        eligibility = check_eligibility(db, User, Order, Overdose, uid)
+        if eligibility is None:
             session.clear()
             return jsonify({"error": "User not found"}), 404
         
-        # Check for active coverage
-        active_xan = Order.query.filter_by(
-            user_id=user.id,
-            coverage_type='XAN',
-            status='active'
-        ).first()
-        
-        active_extc = Order.query.filter_by(
-            user_id=user.id,
-            coverage_type='EXTC',
-            status='active'
-        ).first()
+        has_xan = eligibility["has_xan"]
+        has_extc = eligibility["has_extc"]
         
         # Must have at least one active coverage
-        if not active_xan and not active_extc:
+        if not has_xan and not has_extc:
             return jsonify({"error": "No active coverage. Cannot report overdose."}), 400
         
         # If both are active, user must specify which one
         coverage_type = request.json.get("coverage_type") if request.is_json else None
-        if active_xan and active_extc and not coverage_type:
+        if has_xan and has_extc and not coverage_type:
             return jsonify({
                 "error": "Multiple active coverages detected. Please choose.",
                 "has_xan": True,
@@ -85,63 +82,76 @@ def init_overdose_routes(app, db, User, Order, Overdose):
         
         # Default to available coverage if only one active
         if not coverage_type:
-            coverage_type = 'XAN' if active_xan else 'EXTC'
+            coverage_type = 'XAN' if has_xan else 'EXTC'
         
         # Validate selected coverage exists
-        if coverage_type == 'XAN' and not active_xan:
+        if coverage_type == 'XAN' and not has_xan:
             return jsonify({"error": "No active Xanax coverage"}), 400
-        if coverage_type == 'EXTC' and not active_extc:
+        if coverage_type == 'EXTC' and not has_extc:
             return jsonify({"error": "No active Ecstasy coverage"}), 400
         
+        # One report awaiting confirmation at a time (the unique index covers concurrent requests)
+        if eligibility["xan_pending" if coverage_type == 'XAN' else "extc_pending"]:
+            return jsonify({"error": f"You already have a pending {coverage_type} overdose report."}), 409
+        
         # Check reporting limits
-        if coverage_type == 'EXTC':
-            # EXTC: Can report once per active order (not limited to 1 lifetime)
-            # Check if user has already reported an overdose for the current active EXTC order
-            current_extc_order = Order.query.filter_by(
-                user_id=user.id,
-                coverage_type='EXTC',
-                status='active'
-            ).first()
-            
-            if current_extc_order:
-                # Check if there's already a confirmed overdose for this specific order
-                existing_extc = Overdose.query.filter_by(
-                    user_id=user.id,
-                    coverage_type='EXTC',
-                    confirmed=True
-                ).filter(Overdose.confirmed_at >= current_extc_order.activated_at).first()
-                
-                if existing_extc:
-                    return jsonify({"error": "You have already reported an Ecstasy overdose for this order."}), 400
-        
-        elif coverage_type == 'XAN':
+        if coverage_type == 'EXTC' and not eligibility["can_report_extc"]:
+            # EXTC: Can report once per active order
+            return jsonify({"error": "You have already reported an Ecstasy overdose for this order."}), 400
+        if coverage_type == 'XAN' and not eligibility["can_report_xan"]:
             # XAN: Only 1 report per 4 hours
-            four_hours_ago = datetime.utcnow() - timedelta(hours=4)
-            recent_xan = Overdose.query.filter_by(
-                user_id=user.id,
-                coverage_type='XAN',
-                confirmed=True
-            ).filter(Overdose.confirmed_at > four_hours_ago).first()
-            if recent_xan:
-                time_diff = recent_xan.confirmed_at + timedelta(hours=4) - datetime.utcnow()
-                hours_remaining = time_diff.total_seconds() / 3600
-                return jsonify({
-                    "error": f"You can only report Xanax overdose once per 4 hours. Next available in {hours_remaining:.1f} hours."
-                }), 400
+            return jsonify({
+                "error": f"You can only report Xanax overdose once per 4 hours. Next available in {eligibility['hours_until_next_xan']:.1f} hours."
+            }), 400
         
         # Create overdose report with coverage type
         overdose = Overdose(
-            user_id=user.id,
+            user_id=uid,
             coverage_type=coverage_type,
             reported_at=datetime.utcnow()
         )
         
         db.session.add(overdose)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # ux_overdose_pending_report: a report for this coverage is already awaiting confirmation
+            db.session.rollback()
+            return jsonify({"error": f"You already have a pending {coverage_type} overdose report."}), 409
         
         flash(f"Overdose reported for {coverage_type}!", "success")
         return jsonify({"success": True, "overdose_id": overdose.id}), 201
     
+    @app.post("/overdose/autodetect")
+    def toggle_overdose_autodetect():
+        """Stop (or resume) automatic overdose detection from the member's own events"""
+        uid = session.get("user_id")
+        if not uid:
+            return redirect(url_for("home"))
+        
+        user = User.query.get(uid)
+        if not user:
+            session.clear()
+            return redirect(url_for("home"))
+        
+        if request.form.get("enabled") == "1":
+            if not user.api_key:
+                flash("Log in again with \"Detect my overdoses automatically\" ticked to turn this on.", "error")
+                return redirect(url_for("overdose_page"))
+            if not user.overdose_autodetect:
+                user.overdose_autodetect = True
+                # Only overdoses from now on, as at login; the gap while it was off is not replayed
+                user.events_cursor = int(time.time())
+            flash("Automatic overdose detection is on.", "success")
+        else:
+            user.overdose_autodetect = False
+            # The admin's key also reads payments; anyone else's is only kept for detection
+            if user.role_id != 3:
+                user.api_key = None
+            flash("Automatic overdose detection is off.", "success")
+        db.session.commit()
+        return redirect(url_for("overdose_page"))
+    
     @app.post("/admin/overdose/confirm")
     def confirm_overdose():
         # Check admin access
@@ -160,50 +170,84 @@ def init_overdose_routes(app, db, User, Order, Overdose):
         
         if not overdose_id:
             return jsonify({"error": "Overdose ID required"}), 400
+        if not str(overdose_id).isdigit():
+            return jsonify({"error": "Invalid overdose ID"}), 400
         
-        overdose = Overdose.query.get(overdose_id)
-        if not overdose:
+        result = confirm_overdoses(db, User, Order, Overdose, [overdose_id], notes)
+        reason = result["skipped"].get(int(overdose_id))
+        if reason == 'not_found':
             return jsonify({"error": "Overdose not found"}), 404
+        if reason == 'already_confirmed':
+            return jsonify({"error": "Overdose already confirmed"}), 400
+        if reason == 'no_active_cover':
+            overdose = Overdose.query.get(overdose_id)
+            return jsonify({"error": f"No active {overdose.coverage_type} cover found for this user"}), 400
         
-        # Get the active order for this user and coverage type to determine payout
-        active_order = Order.query.filter_by(
-            user_id=overdose.user_id,
-            coverage_type=overdose.coverage_type,
-            status='active'
-        ).first()
+        payout_details = result["confirmed"][int(overdose_id)]
+        flash(f"Overdose confirmed with payout: {payout_details}", "success")
+        return jsonify({"success": True, "payout": payout_details}), 200
+    
+    @app.post("/admin/overdose/confirm-bulk")
+    def confirm_overdoses_bulk():
+        """Confirm many overdoses in one transaction; returns per-id results and the payout sheet"""
+        uid = session.get("user_id")
+        if not uid:
+            return jsonify({"error": "Not logged in"}), 401
         
-        if not active_order:
-            return jsonify({"error": f"No active {overdose.coverage_type} cover found for this user"}), 400
+        admin = User.query.get(uid)
+        if not admin or admin.role_id != 3:
+            return jsonify({"error": "Admin access required"}), 403
         
-        # Build payout details
-        if overdose.coverage_type == 'XAN':
-            payout_details = f"{active_order.xanax_reward} Xanax"
-            payout = active_order.xanax_reward
-        else:  # EXTC
-            payout_details = f"{active_order.xanax_reward} Xanax, {active_order.edvds_reward} eDVDs, {active_order.ecstasy_reward} Ecstasy"
-            payout = active_order.xanax_reward  # Store primary payout
-        
-        # Update overdose
-        overdose.confirmed = True
-        overdose.confirmed_at = datetime.utcnow()
-        overdose.payout = payout
-        overdose.payout_details = payout_details
-        overdose.notes = notes
-        
-        # Store individual payout amounts
-        overdose.payout_xanax = active_order.xanax_reward
-        if overdose.coverage_type == 'EXTC':
-            overdose.payout_edvds = active_order.edvds_reward
-            overdose.payout_ecstasy = active_order.ecstasy_reward
-        
-        # Move EXTC order to expired so user can place a new one
-        if overdose.coverage_type == 'EXTC':
-            active_order.status = 'expired'
+        data = request.get_json(silent=True) or {}
+        overdose_ids = data.get("overdose_ids") or []
+        if not isinstance(overdose_ids, list) or not all(str(i).isdigit() for i in overdose_ids):
+            return jsonify({"error": "overdose_ids must be a list of ids"}), 400
+        if len(overdose_ids) > MAX_BULK_CONFIRM:
+            return jsonify({"error": f"At most {MAX_BULK_CONFIRM} overdoses per request"}), 400
         
-        db.session.commit()
+        result = confirm_overdoses(db, User, Order, Overdose, overdose_ids, data.get("notes", ""))
+        sheet = payout_sheet(db, User, Overdose, overdose_ids=result["confirmed"].keys()) if result["confirmed"] else []
         
-        flash(f"Overdose confirmed with payout: {payout_details}", "success")
-        return jsonify({"success": True, "payout": payout_details}), 200
+        return jsonify({
+            "success": True,
+            "confirmed": {str(k): v for k, v in result["confirmed"].items()},
+            "skipped": {str(k): v for k, v in result["skipped"].items()},
+            "payout_sheet": sheet
+        }), 200
+    
+    @app.get("/admin/overdose/payout-sheet")
+    def overdose_payout_sheet():
+        """Per-user payout totals for overdoses confirmed in [since, until) - JSON, or CSV with ?format=csv"""
+        uid = session.get("user_id")
+        if not uid:
+            return jsonify({"error": "Not logged in"}), 401
+        
+        admin = User.query.get(uid)
+        if not admin or admin.role_id != 3:
+            return jsonify({"error": "Admin access required"}), 403
+        
+        try:
+            since = datetime.fromisoformat(request.args["since"]) if request.args.get("since") else datetime.utcnow() - timedelta(hours=24)
+            until = datetime.fromisoformat(request.args["until"]) if request.args.get("until") else None
+        except ValueError:
+            return jsonify({"error": "since/until must be ISO dates"}), 400
+        
+        sheet = payout_sheet(db, User, Overdose, since=since, until=until)
+        
+        if request.args.get("format") == "csv":
+            out = io.StringIO()
+            writer = csv.DictWriter(out, fieldnames=["torn_user_id", "torn_name", "overdoses", "xanax", "edvds", "ecstasy"])
+            writer.writeheader()
+            writer.writerows(sheet)
+            return Response(out.getvalue(), mimetype="text/csv",
+                            headers={"Content-Disposition": f"attachment; filename=payouts-{since:%Y%m%d%H%M}.csv"})
+        
+        return jsonify({
+            "since": since.isoformat(),
+            "until": until.isoformat() if until else None,
+            "payout_sheet": sheet,
+            "totals": {key: sum(row[key] for row in sheet) for key in ("overdoses", "xanax", "edvds", "ecstasy")}
+        }), 200
     
     @app.delete("/admin/overdose/<int:overdose_id>")
     def delete_overdose(overdose_id):
@@ -220,7 +264,12 @@ def init_overdose_routes(app, db, User, Order, Overdose):
         if not overdose:
             return jsonify({"error": "Overdose not found"}), 404
         
+        was_xan_cooldown = overdose.confirmed and overdose.coverage_type == 'XAN'
+        user_id = overdose.user_id
         db.session.delete(overdose)
+        if was_xan_cooldown:
+            db.session.flush()
+            refresh_next_xan_report_at(db, User, Overdose, user_id)
         db.session.commit()
         
         return jsonify({"success": True}), 200
@@ -232,43 +281,12 @@ def init_overdose_routes(app, db, User, Order, Overdose):
         if not uid:
             return jsonify({"error": "Not logged in"}), 401
         
-        user = User.query.get(uid)
-        if not user:
+        eligibility = cached_eligibility(db, User, Order, Overdose, uid)
+        if eligibility is None:
             return jsonify({"error": "User not found"}), 404
         
-        # Check EXTC limit (1 per active order)
-        current_extc_order = Order.query.filter_by(
-            user_id=user.id,
-            coverage_type='EXTC',
-            status='active'
-        ).first()
-        
-        extc_limit_hit = False
-        if current_extc_order:
-            # Check if there's already a confirmed overdose for this specific order
-            existing_extc = Overdose.query.filter_by(
-                user_id=user.id,
-                coverage_type='EXTC',
-                confirmed=True
-            ).filter(Overdose.confirmed_at >= current_extc_order.activated_at).first()
-            extc_limit_hit = existing_extc is not None
-        
-        # Check XAN limit (1 per 4 hours)
-        four_hours_ago = datetime.utcnow() - timedelta(hours=4)
-        recent_xan = Overdose.query.filter_by(
-            user_id=user.id,
-            coverage_type='XAN',
-            confirmed=True
-        ).filter(Overdose.confirmed_at > four_hours_ago).first()
-        
-        xan_limit_hit = recent_xan is not None
-        hours_until_next_xan = 0.0
-        if xan_limit_hit:
-            time_diff = recent_xan.confirmed_at + timedelta(hours=4) - datetime.utcnow()
-            hours_until_next_xan = max(0, time_diff.total_seconds() / 3600)
-        
         return jsonify({
-            "can_report_xan": not xan_limit_hit,
-            "can_report_extc": not extc_limit_hit,
-            "hours_until_next_xan": hours_until_next_xan
+            "can_report_xan": eligibility["can_report_xan"],
+            "can_report_extc": eligibility["can_report_extc"],
+            "hours_until_next_xan": eligibility["hours_until_next_xan"]
         }), 200
@@ -1,6 +1,8 @@
 from flask import render_template, redirect, url_for, session
 from sqlalchemy import func, case
 
+from services.order_placement import active_price_lists
+
 
 def init_page_routes(app, db, User, Order, PricingConfig, Overdose=None):
     @app.get("/")
@@ -20,16 +22,10 @@ def init_page_routes(app, db, User, Order, PricingConfig, Overdose=None):
             session.clear()
             return redirect(url_for("home"))
         
-        # Get pricing configurations
-        xan_prices = PricingConfig.query.filter_by(
-            coverage_type='XAN',
-            active=True
-        ).order_by(PricingConfig.duration).all()
-        
-        extc_prices = PricingConfig.query.filter_by(
-            coverage_type='EXTC',
-            active=True
-        ).order_by(PricingConfig.duration).all()
+        # Get pricing configurations (shared cache; plain dicts)
+        prices = active_price_lists(PricingConfig)
+        xan_prices = prices['XAN']
+        extc_prices = prices['EXTC']
         
         # Get user's current orders
         pending_order = Order.query.filter_by(
@@ -0,0 +1,53 @@
+"""
+API tokens for bots and integrations.
+
+Tokens are random strings shown once at creation (manage.py create-api-token);
+only their sha256 is stored, so a leaked database doesn't leak usable tokens.
+"""
+import hashlib
+import secrets
+from datetime import datetime, timedelta
+
+TOKEN_PREFIX = "hjs_"
+# last_used_at is informational; don't write it on every poll
+LAST_USED_RESOLUTION = timedelta(minutes=5)
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_token(db, ApiToken, name: str) -> tuple:
+    """(plain token, ApiToken row); the plain token can't be recovered later"""
+    token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    row = ApiToken(name=name, token_hash=hash_token(token))
+    db.session.add(row)
+    db.session.commit()
+    return token, row
+
+
+def revoke_token(db, ApiToken, token_id: int) -> bool:
+    row = db.session.get(ApiToken, token_id)
+    if row is None or row.revoked_at is not None:
+        return False
+    row.revoked_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def authenticate(db, ApiToken, authorization: str):
+    """The live ApiToken for an 'Authorization: Bearer <token>' header value, or None"""
+    scheme, _, token = (authorization or "").partition(" ")
+    token = token.strip()
+    if scheme.lower() != "bearer" or not token.startswith(TOKEN_PREFIX):
+        return None
+
+    row = ApiToken.query.filter_by(token_hash=hash_token(token)).first()
+    if row is None or row.revoked_at is not None:
+        return None
+
+    now = datetime.utcnow()
+    if row.last_used_at is None or now - row.last_used_at > LAST_USED_RESOLUTION:
+        row.last_used_at = now
+        db.session.commit()
+    return row
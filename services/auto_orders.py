@@ -0,0 +1,114 @@
+"""
+Auto-order stage - turns payments that matched no pending order into active
+orders, so members who pay without placing an order first are covered
+without an admin stepping in.
+"""
+from datetime import datetime
+
+from services.order_verification import detect_orders, activate_order, record_payment
+
+
+def _pricing_by_amount(PricingConfig) -> dict:
+    """{(coverage_type, cost): tier} for active tiers; costs shared by two tiers are ambiguous and left out"""
+    tiers = {}
+    ambiguous = set()
+    for pricing in PricingConfig.query.filter_by(active=True).all():
+        key = (pricing.coverage_type, pricing.cost)
+        if key in tiers:
+            ambiguous.add(key)
+        tiers[key] = pricing
+    for key in ambiguous:
+        del tiers[key]
+    return tiers
+
+
+def create_auto_orders(db, User, Order, PricingConfig, PaymentMatch, payments, directory=None) -> int:
+    """
+    Create and activate an Order (auto_detected=True) for every recent payment
+    whose sender is a known user and whose amount is exactly one active pricing
+    tier. `payments` must already exclude consumed events (see fetch_new_payments).
+    Everything is written in one transaction; returns the number of orders created.
+    """
+    from sqlalchemy.exc import IntegrityError
+
+    detected = detect_orders(payments)
+    if not detected:
+        return 0
+
+    for item in detected:
+        if item['sender_torn_id'] is None and directory is not None:
+            item['sender_torn_id'] = directory.resolve(item['sender_name'])
+    detected = [item for item in detected if item['sender_torn_id'] is not None]
+    if not detected:
+        return 0
+
+    tiers = _pricing_by_amount(PricingConfig)
+    users = {
+        user.torn_user_id: user
+        for user in User.query.filter(User.torn_user_id.in_({item['sender_torn_id'] for item in detected})).all()
+    }
+
+    # Current active/pending orders of these users, fetched in one query
+    open_orders = {}
+    if users:
+        for order in Order.query.filter(
+            Order.user_id.in_([user.id for user in users.values()]),
+            Order.status.in_(['active', 'pending'])
+        ).all():
+            open_orders[(order.user_id, order.coverage_type, order.status)] = order
+
+    created = []
+    for item in sorted(detected, key=lambda d: (d['timestamp'], d['event_id'])):
+        user = users.get(item['sender_torn_id'])
+        pricing = tiers.get((item['coverage_type'], item['payment_amount']))
+        if not user or not pricing:
+            continue
+
+        coverage_type = item['coverage_type']
+        # Already covered: an admin decides what an extra payment is for
+        if (user.id, coverage_type, 'active') in open_orders:
+            continue
+
+        # The payment supersedes a pending order for a different tier
+        stale_pending = open_orders.pop((user.id, coverage_type, 'pending'), None)
+        if stale_pending is not None:
+            db.session.delete(stale_pending)
+
+        order = Order(
+            user=user,
+            coverage_type=coverage_type,
+            xanax_payment=pricing.cost,
+            hours=pricing.duration if coverage_type == 'XAN' else None,
+            jumps=pricing.duration if coverage_type == 'EXTC' else None,
+            xanax_reward=pricing.xanax_reward,
+            edvds_reward=pricing.edvds_reward if coverage_type == 'EXTC' else None,
+            ecstasy_reward=pricing.ecstasy_reward if coverage_type == 'EXTC' else None,
+            created_at=datetime.utcnow(),
+            auto_detected=True,
+        )
+        activate_order(order, item['timestamp'])
+        db.session.add(order)
+        open_orders[(user.id, coverage_type, 'active')] = order
+        created.append((order, item))
+
+    if not created:
+        return 0
+
+    # Ledger rows need order ids
+    db.session.flush()
+    for order, item in created:
+        db.session.add(record_payment(PaymentMatch, order, {
+            'event_id': item['event_id'],
+            'sender_torn_id': item['sender_torn_id'],
+            'quantity': item['payment_amount'],
+            'timestamp': item['timestamp'],
+        }))
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another pass consumed one of these events first
+        db.session.rollback()
+        return 0
+
+    return len(created)
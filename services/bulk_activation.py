@@ -0,0 +1,156 @@
+"""
+Bulk manual activation - for onboarding migrated customers or reconciling
+after an outage.
+
+Rows are {torn_user_id, coverage_type, duration[, torn_name]}. Every row is
+validated against the pricing catalog in memory, users are resolved by Torn
+id with one query (unknown ids are created when a torn_name is given), and all
+orders are written in a single transaction. Same rules as the single manual
+activation: existing active cover of that type is completed and a pending
+order is replaced.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import tuple_
+
+MAX_ROWS = 5000
+
+
+def parse_rows(text: str, fmt: str) -> list:
+    """Rows from CSV (header line required) or JSON (a list, or {"rows": [...]})"""
+    if fmt == "json":
+        data = json.loads(text)
+        rows = data.get("rows") if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            raise ValueError("JSON must be a list of rows or {\"rows\": [...]}")
+        return rows
+
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or "torn_user_id" not in reader.fieldnames:
+        raise ValueError("CSV needs a header row with torn_user_id, coverage_type, duration")
+    return [{key.strip(): (value or "").strip() for key, value in row.items() if key} for row in reader]
+
+
+def _validate(row, tiers):
+    """(torn_user_id, coverage_type, duration, torn_name, pricing) or raises ValueError"""
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+    try:
+        torn_user_id = int(row.get("torn_user_id"))
+        duration = int(row.get("duration"))
+    except (TypeError, ValueError):
+        raise ValueError("torn_user_id and duration must be integers")
+
+    coverage_type = str(row.get("coverage_type") or "").strip().upper()
+    if coverage_type not in ("XAN", "EXTC"):
+        raise ValueError("coverage_type must be XAN or EXTC")
+
+    pricing = tiers.get((coverage_type, duration))
+    if pricing is None:
+        raise ValueError(f"No active {coverage_type} tier with duration {duration}")
+
+    torn_name = str(row.get("torn_name") or "").strip() or None
+    return torn_user_id, coverage_type, duration, torn_name, pricing
+
+
+def bulk_activate(db, User, Order, PricingConfig, rows, dry_run: bool = False, now=None) -> list:
+    """
+    Activate cover for every valid row in one transaction (nothing is written
+    with dry_run). Returns one result per input row:
+    {"row": n, "torn_user_id", "status": "activated"|"valid"|"error", "order_id"|"error"}
+    """
+    now = now or datetime.utcnow()
+    tiers = {(p.coverage_type, p.duration): p for p in PricingConfig.query.filter_by(active=True).order_by(PricingConfig.id.desc())}
+
+    results = []
+    valid = []
+    seen = set()
+    for index, row in enumerate(rows, start=1):
+        result = {"row": index, "torn_user_id": row.get("torn_user_id") if isinstance(row, dict) else None}
+        results.append(result)
+        try:
+            torn_user_id, coverage_type, duration, torn_name, pricing = _validate(row, tiers)
+        except ValueError as e:
+            result.update(status="error", error=str(e))
+            continue
+        if (torn_user_id, coverage_type) in seen:
+            result.update(status="error", error="Duplicate row for this user and coverage type")
+            continue
+        seen.add((torn_user_id, coverage_type))
+        result["torn_user_id"] = torn_user_id
+        valid.append((result, torn_user_id, coverage_type, duration, torn_name, pricing))
+
+    # Users by Torn id, one query
+    users = {}
+    torn_ids = {item[1] for item in valid}
+    if torn_ids:
+        users = {u.torn_user_id: u for u in User.query.filter(User.torn_user_id.in_(torn_ids))}
+
+    to_activate = []
+    for item in valid:
+        result, torn_user_id, coverage_type, duration, torn_name, pricing = item
+        if torn_user_id not in users:
+            if not torn_name:
+                result.update(status="error", error="Unknown Torn id (add torn_name to create the user)")
+                continue
+            users[torn_user_id] = User(torn_user_id=torn_user_id, torn_name=torn_name, role_id=1,
+                                       sent_xanax_total=0, insurance_total=0)
+            db.session.add(users[torn_user_id])
+        to_activate.append(item)
+
+    if dry_run or not to_activate:
+        for result, *_ in to_activate:
+            result["status"] = "valid"
+        db.session.rollback()
+        return results
+
+    db.session.flush()  # ids for newly created users
+
+    # Existing active/pending orders for every (user, coverage type), one query
+    keys = {(users[item[1]].id, item[2]) for item in to_activate}
+    open_orders = {}
+    for order in Order.query.filter(
+        Order.status.in_(['active', 'pending']),
+        tuple_(Order.user_id, Order.coverage_type).in_(keys)
+    ):
+        open_orders[(order.user_id, order.coverage_type, order.status)] = order
+
+    created = []
+    for result, torn_user_id, coverage_type, duration, torn_name, pricing in to_activate:
+        user = users[torn_user_id]
+        existing_active = open_orders.get((user.id, coverage_type, 'active'))
+        if existing_active:
+            existing_active.status = 'completed'
+        existing_pending = open_orders.get((user.id, coverage_type, 'pending'))
+        if existing_pending:
+            db.session.delete(existing_pending)
+
+        # XAN orders expire after specified hours, EXTC orders always expire in 2 hours
+        expires_at = now + timedelta(hours=duration) if coverage_type == 'XAN' else now + timedelta(hours=2)
+        order = Order(
+            user_id=user.id,
+            coverage_type=coverage_type,
+            status='active',
+            xanax_payment=pricing.cost,
+            payment_verified=True,
+            payment_verified_at=now,
+            activated_at=now,
+            expires_at=expires_at,
+            hours=duration if coverage_type == 'XAN' else None,
+            jumps=duration if coverage_type == 'EXTC' else None,
+            xanax_reward=pricing.xanax_reward,
+            edvds_reward=pricing.edvds_reward if coverage_type == 'EXTC' else None,
+            ecstasy_reward=pricing.ecstasy_reward if coverage_type == 'EXTC' else None,
+        )
+        db.session.add(order)
+        created.append((result, order))
+
+    # Read ids before commit expires the objects
+    db.session.flush()
+    for result, order in created:
+        result.update(status="activated", order_id=order.id)
+    db.session.commit()
+    return results
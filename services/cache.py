@@ -0,0 +1,388 @@
+"""
+Shared cache behind every server-side cache in the app.
+
+CACHE_URL picks the backend:
+
+    memory://                   per-process LRU with TTLs capped at
+                                CACHE_MEMORY_MAX_TTL seconds (default)
+    sqlite:///path/to/cache.db  one file shared by every worker on the host
+    redis://[:password@]host:6379/0
+                                any Redis-compatible server (Redis, Valkey,
+                                KeyDB, or bench.redis_stub for local runs)
+
+Keys live in namespaces. invalidate(namespace) bumps a version counter kept
+in the backend, and the version is part of every key. So one call hides the
+old entries from every worker at once, and they age out by TTL.
+init_cache_invalidation() does this on commit for the models' namespaces.
+Core-level UPDATEs bypass it and are only bounded by the TTLs.
+
+With memory:// the version counter is per process too, so a commit in one
+gunicorn worker can't hide another worker's entries. That backend therefore
+keeps nothing longer than a few seconds, whatever TTL the caller asks for.
+Use sqlite:// or redis:// to get the callers' TTLs across several workers.
+
+Values are pickled, so cache plain data (dicts, lists, tuples, datetimes,
+numpy arrays), never ORM objects. A failing backend counts as a miss and is
+logged; callers always get a value. Hits, misses, sets, invalidations and
+errors are counted per namespace family in this process (stats()).
+"""
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+from sqlalchemy import event
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "4096"))
+# Bounds how long other workers serve a value after a commit invalidated it elsewhere
+MEMORY_MAX_TTL = float(os.environ.get("CACHE_MEMORY_MAX_TTL", "5"))
+KEY_PREFIX = os.environ.get("CACHE_PREFIX", "hjs")
+SOCKET_TIMEOUT = 0.5
+SQLITE_PURGE_EVERY = 500  # sets between sweeps of expired rows
+
+logger = logging.getLogger("hjs.cache")
+
+_MISSING = object()
+_installed = set()
+
+
+class CacheError(Exception):
+    """The backend failed or answered with an error"""
+
+
+class MemoryBackend:
+    """
+    LRU of (expires_at, value); counters are kept apart so they are never
+    evicted. TTLs are capped at max_ttl, as invalidations don't leave the process.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_ttl: float = MEMORY_MAX_TTL):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + min(ttl, self.max_ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, key: str) -> int:
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class SQLiteBackend:
+    """One WAL-mode SQLite file; a connection per thread and process (workers fork)"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._sets = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_entry "
+                         "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_counter (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        row = self._conn().execute(
+            "SELECT value FROM cache_entry WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, value, time.time() + ttl))
+        self._sets += 1
+        if self._sets % SQLITE_PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache_entry WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+    def counter(self, key: str) -> int:
+        row = self._conn().execute("SELECT value FROM cache_counter WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key: str) -> int:
+        return self._conn().execute(
+            "INSERT INTO cache_counter (key, value) VALUES (?, 1) "
+            "ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value", (key,)
+        ).fetchone()[0]
+
+
+class RedisBackend:
+    """
+    Just enough RESP for GET/SET PX/DEL/INCR, over one socket per thread and
+    process, so any Redis-compatible server works without a client library
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=SOCKET_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        self._local.pid = os.getpid()
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _read(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise CacheError("Connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise CacheError(body.decode())
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            size = int(body)
+            if size < 0:
+                return None
+            return self._local.reader.read(size + 2)[:-2]
+        if kind == b"*":
+            size = int(body)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise CacheError(f"Unexpected reply {line[:20]!r}")
+
+    def _send(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _command(self, *args):
+        try:
+            if getattr(self._local, "sock", None) is None or self._local.pid != os.getpid():
+                self._connect()
+            return self._send(*args)
+        except (OSError, CacheError):
+            # Drop the connection; a half-read reply would poison the next command
+            if getattr(self._local, "sock", None) is not None:
+                self._local.sock.close()
+            self._local.sock = None
+            raise
+
+    def get(self, key: str):
+        return self._command("GET", key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._command("SET", key, value, "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str):
+        self._command("DEL", key)
+
+    def counter(self, key: str) -> int:
+        value = self._command("GET", key)
+        return int(value) if value is not None else 0
+
+    def incr(self, key: str) -> int:
+        return self._command("INCR", key)
+
+
+def backend_from_url(url: str):
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return MemoryBackend()
+    if scheme == "sqlite":
+        return SQLiteBackend(url[len("sqlite:///"):] or "cache.db")
+    if scheme == "redis":
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL scheme: {scheme}")
+
+
+class Cache:
+    def __init__(self, backend, prefix: str = KEY_PREFIX):
+        self.backend = backend
+        self.prefix = prefix
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, namespace: str, name: str):
+        # Per-entity namespaces ("user:42") are counted under their family ("user")
+        family = namespace.split(":", 1)[0]
+        with self._stats_lock:
+            counts = self._stats.setdefault(
+                family, {"hits": 0, "misses": 0, "sets": 0, "invalidations": 0, "errors": 0}
+            )
+            counts[name] += 1
+
+    def _error(self, namespace: str, action: str, e: Exception):
+        self._count(namespace, "errors")
+        logger.warning("Cache %s failed for %s: %s: %s", action, namespace, type(e).__name__, e)
+
+    def _key(self, namespace: str, key: str) -> str:
+        version = self.backend.counter(f"{self.prefix}:ns:{namespace}")
+        return f"{self.prefix}:{namespace}:{version}:{key}"
+
+    def version(self, namespace: str):
+        """The namespace's current version (None when the backend fails)"""
+        try:
+            return self.backend.counter(f"{self.prefix}:ns:{namespace}")
+        except Exception as e:
+            self._error(namespace, "version", e)
+            return None
+
+    def _lookup(self, namespace: str, key: str):
+        """(full key or None, value or _MISSING)"""
+        try:
+            full_key = self._key(namespace, key)
+            data = self.backend.get(full_key)
+            value = pickle.loads(data) if data is not None else _MISSING
+        except Exception as e:
+            self._error(namespace, "get", e)
+            return None, _MISSING
+        self._count(namespace, "misses" if value is _MISSING else "hits")
+        return full_key, value
+
+    def _store(self, namespace: str, full_key: str, value, ttl: float):
+        try:
+            self.backend.set(full_key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+        except Exception as e:
+            self._error(namespace, "set", e)
+            return
+        self._count(namespace, "sets")
+
+    def get(self, namespace: str, key: str, default=None):
+        _, value = self._lookup(namespace, key)
+        return default if value is _MISSING else value
+
+    def set(self, namespace: str, key: str, value, ttl: float):
+        try:
+            full_key = self._key(namespace, key)
+        except Exception as e:
+            self._error(namespace, "set", e)
+            return
+        self._store(namespace, full_key, value, ttl)
+
+    def get_or_set(self, namespace: str, key: str, loader, ttl: float):
+        """Cached value, or loader()'s result (cached, None included)"""
+        full_key, value = self._lookup(namespace, key)
+        if value is _MISSING:
+            value = loader()
+            if full_key is not None:
+                self._store(namespace, full_key, value, ttl)
+        return value
+
+    def delete(self, namespace: str, key: str):
+        try:
+            self.backend.delete(self._key(namespace, key))
+        except Exception as e:
+            self._error(namespace, "delete", e)
+
+    def invalidate(self, namespace: str):
+        try:
+            self.backend.incr(f"{self.prefix}:ns:{namespace}")
+        except Exception as e:
+            self._error(namespace, "invalidate", e)
+            return
+        self._count(namespace, "invalidations")
+
+    def stats(self) -> dict:
+        """Counters per namespace family for this process, with the hit ratio"""
+        with self._stats_lock:
+            stats = {namespace: dict(counts) for namespace, counts in self._stats.items()}
+        for counts in stats.values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_ratio"] = round(counts["hits"] / lookups, 3) if lookups else None
+        return {"backend": self.backend.name, "namespaces": stats}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Cache:
+    """Process-wide cache for CACHE_URL"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = Cache(backend_from_url(os.environ.get("CACHE_URL", "memory://")))
+        return _cache
+
+
+def init_cache_invalidation(db, namespaces_for: dict):
+    """
+    Invalidate namespaces when models change. `namespaces_for` maps a model to
+    fn(obj) -> namespaces; they are collected at flush and invalidated after
+    commit, so no worker re-caches the old rows in between.
+    """
+    if db in _installed:
+        return
+    _installed.add(db)
+
+    @event.listens_for(db.session, "after_flush")
+    def _collect(session, flush_context):
+        pending = session.info.setdefault("cache_invalidate", set())
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            namespaces = namespaces_for.get(type(obj))
+            if namespaces and (obj not in session.dirty or session.is_modified(obj)):
+                pending.update(namespaces(obj))
+
+    @event.listens_for(db.session, "after_commit")
+    def _invalidate(session):
+        cache = get_cache()
+        for namespace in session.info.pop("cache_invalidate", ()):
+            cache.invalidate(namespace)
+
+    @event.listens_for(db.session, "after_rollback")
+    def _discard(session):
+        session.info.pop("cache_invalidate", None)
@@ -0,0 +1,98 @@
+"""
+Coverage and overdose eligibility for many users at once, for /api/v1/coverage.
+
+One SELECT over the requested Torn ids with the same correlated subqueries
+check_eligibility uses. The output only has absolute timestamps, no
+countdowns, so it stays byte-identical between polls until something changes
+and ETags work.
+"""
+from datetime import datetime
+
+from sqlalchemy import exists, select
+
+from services.overdose_eligibility import eligibility_columns, eligibility_from_row
+
+MAX_IDS = 500
+
+
+def parse_torn_ids(values) -> list:
+    """Unique Torn ids in request order from a list or comma-separated string; raises ValueError"""
+    if isinstance(values, str):
+        values = [v for v in values.split(",") if v.strip()]
+    if not isinstance(values, list) or not values:
+        raise ValueError("Pass Torn ids as ?ids=1,2,3 or JSON {\"torn_ids\": [...]}")
+    try:
+        ids = list(dict.fromkeys(int(v) for v in values))
+    except (TypeError, ValueError):
+        raise ValueError("Torn ids must be integers")
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} Torn ids per request")
+    return ids
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def coverage_status(db, User, Order, Overdose, torn_ids: list, now=None) -> list:
+    """One entry per Torn id, in the order given"""
+    now = now or datetime.utcnow()
+
+    def active_expiry(coverage_type):
+        return (
+            select(Order.expires_at)
+            .where(Order.user_id == User.id, Order.coverage_type == coverage_type, Order.status == 'active')
+            .order_by(Order.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    def pending_order(coverage_type):
+        return exists().where(Order.user_id == User.id, Order.coverage_type == coverage_type, Order.status == 'pending')
+
+    rows = db.session.execute(
+        select(
+            User.torn_user_id,
+            User.torn_name,
+            active_expiry('XAN').label('xan_expires_at'),
+            active_expiry('EXTC').label('extc_expires_at'),
+            pending_order('XAN').label('xan_order_pending'),
+            pending_order('EXTC').label('extc_order_pending'),
+            *eligibility_columns(User, Order, Overdose),
+        ).where(User.torn_user_id.in_(torn_ids))
+    ).all()
+    by_id = {row.torn_user_id: row for row in rows}
+
+    statuses = []
+    for torn_id in torn_ids:
+        row = by_id.get(torn_id)
+        if row is None:
+            statuses.append({"torn_user_id": torn_id, "registered": False})
+            continue
+
+        eligibility = eligibility_from_row(row, now)
+        coverage = {}
+        for coverage_type, active, expires_at, pending in (
+            ('XAN', eligibility["has_xan"], row.xan_expires_at, row.xan_order_pending),
+            ('EXTC', eligibility["has_extc"], row.extc_expires_at, row.extc_order_pending),
+        ):
+            coverage[coverage_type] = {
+                "status": 'active' if active else 'pending' if pending else 'none',
+                "expires_at": _iso(expires_at) if active else None,
+            }
+
+        cooling_down = eligibility["hours_until_next_xan"] > 0
+        statuses.append({
+            "torn_user_id": torn_id,
+            "registered": True,
+            "torn_name": row.torn_name,
+            "coverage": coverage,
+            "overdose": {
+                "can_report_xan": eligibility["has_xan"] and eligibility["can_report_xan"] and not eligibility["xan_pending"],
+                "can_report_extc": eligibility["has_extc"] and eligibility["can_report_extc"] and not eligibility["extc_pending"],
+                "next_xan_report_at": _iso(row.next_xan_report_at) if cooling_down else None,
+                "xan_pending": eligibility["xan_pending"],
+                "extc_pending": eligibility["extc_pending"],
+            },
+        })
+    return statuses
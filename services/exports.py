@@ -0,0 +1,144 @@
+"""
+Streaming exports of orders, overdoses and payouts for accounting.
+
+Rows are read through a server-side cursor (yield_per) and encoded as CSV or
+NDJSON a chunk at a time, so memory stays flat however large the tables get.
+Used by the /admin/export/<kind> routes (as a generator response) and by
+`python manage.py export`.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+CHUNK_ROWS = 1000
+FORMATS = ("csv", "ndjson")
+
+ORDER_FIELDS = [
+    "id", "torn_user_id", "torn_name", "coverage_type", "status", "xanax_payment", "payment_verified",
+    "payment_verified_at", "hours", "jumps", "xanax_reward", "edvds_reward", "ecstasy_reward",
+    "created_at", "activated_at", "expires_at", "auto_detected",
+]
+OVERDOSE_FIELDS = [
+    "id", "torn_user_id", "torn_name", "coverage_type", "reported_at", "confirmed", "confirmed_at",
+    "payout", "payout_xanax", "payout_edvds", "payout_ecstasy", "payout_details", "notes",
+]
+PAYOUT_FIELDS = [
+    "overdose_id", "torn_user_id", "torn_name", "coverage_type", "confirmed_at",
+    "payout_xanax", "payout_edvds", "payout_ecstasy", "payout_details",
+]
+
+# Statuses accepted by the status filter, per export
+STATUSES = {
+    "orders": ("pending", "active", "completed", "expired", "cancelled"),
+    "overdoses": ("pending", "confirmed"),
+    "payouts": (),
+}
+
+
+def _query(User, Order, Overdose, kind, status=None, coverage_type=None):
+    """(select, date column the since/until range applies to, field names)"""
+    if kind == "orders":
+        columns = [getattr(Order, name) for name in ORDER_FIELDS if name not in ("torn_user_id", "torn_name")]
+        stmt = select(*columns, User.torn_user_id, User.torn_name).join(User, User.id == Order.user_id)
+        if status:
+            stmt = stmt.where(Order.status == status)
+        if coverage_type:
+            stmt = stmt.where(Order.coverage_type == coverage_type)
+        return stmt.order_by(Order.id), Order.created_at, ORDER_FIELDS
+
+    if kind == "overdoses":
+        columns = [getattr(Overdose, name) for name in OVERDOSE_FIELDS if name not in ("torn_user_id", "torn_name")]
+        stmt = select(*columns, User.torn_user_id, User.torn_name).join(User, User.id == Overdose.user_id)
+        if status:
+            stmt = stmt.where(Overdose.confirmed.is_(status == "confirmed"))
+        if coverage_type:
+            stmt = stmt.where(Overdose.coverage_type == coverage_type)
+        return stmt.order_by(Overdose.id), Overdose.reported_at, OVERDOSE_FIELDS
+
+    if kind == "payouts":
+        # One line per confirmed overdose, by confirmation time
+        stmt = (
+            select(
+                Overdose.id.label("overdose_id"), User.torn_user_id, User.torn_name, Overdose.coverage_type,
+                Overdose.confirmed_at, Overdose.payout_xanax, Overdose.payout_edvds, Overdose.payout_ecstasy,
+                Overdose.payout_details,
+            )
+            .join(User, User.id == Overdose.user_id)
+            .where(Overdose.confirmed.is_(True))
+        )
+        if coverage_type:
+            stmt = stmt.where(Overdose.coverage_type == coverage_type)
+        return stmt.order_by(Overdose.confirmed_at, Overdose.id), Overdose.confirmed_at, PAYOUT_FIELDS
+
+    raise ValueError(f"Unknown export: {kind}")
+
+
+def validate_filters(kind, fmt, status=None, coverage_type=None):
+    """Raise ValueError for anything the export can't serve"""
+    if kind not in STATUSES:
+        raise ValueError(f"Unknown export: {kind} (expected one of {', '.join(STATUSES)})")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if status and status not in STATUSES[kind]:
+        allowed = ", ".join(STATUSES[kind]) or "none"
+        raise ValueError(f"status for {kind} must be one of: {allowed}")
+    if coverage_type and coverage_type not in ("XAN", "EXTC"):
+        raise ValueError("coverage_type must be XAN or EXTC")
+
+
+def iter_rows(db, User, Order, Overdose, kind, since=None, until=None, status=None, coverage_type=None):
+    """Yield dicts for the export, CHUNK_ROWS at a time from the database"""
+    stmt, date_column, fields = _query(User, Order, Overdose, kind, status, coverage_type)
+    if since is not None:
+        stmt = stmt.where(date_column >= since)
+    if until is not None:
+        stmt = stmt.where(date_column < until)
+
+    result = db.session.execute(stmt, execution_options={"yield_per": CHUNK_ROWS})
+    for partition in result.mappings().partitions():
+        for row in partition:
+            yield {name: row[name] for name in fields}
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode(rows, fields, fmt):
+    """Yield CSV (with a header) or NDJSON text, one chunk per CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(fields)
+
+    count = 0
+    for row in rows:
+        if writer:
+            writer.writerow(["" if row[name] is None else _plain(row[name]) for name in fields])
+        else:
+            buffer.write(json.dumps({name: _plain(row[name]) for name in fields}))
+            buffer.write("\n")
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_export(db, User, Order, Overdose, kind, fmt="csv", since=None, until=None, status=None, coverage_type=None):
+    """Validated export as a generator of text chunks"""
+    validate_filters(kind, fmt, status, coverage_type)
+    _, _, fields = _query(User, Order, Overdose, kind)
+    rows = iter_rows(db, User, Order, Overdose, kind, since, until, status, coverage_type)
+    return encode(rows, fields, fmt)
+
+
+def parse_date(value):
+    """ISO date/datetime from a query string or CLI flag, None when empty"""
+    return datetime.fromisoformat(value) if value else None
@@ -0,0 +1,210 @@
+"""
+Request instrumentation - Server-Timing header, slow-query log and an
+on-demand sampling profiler for admins - plus memory and open-transaction
+stats for the long-running background worker
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request, session, has_request_context, Response
+from sqlalchemy import event
+
+slow_query_logger = logging.getLogger("hjs.slow_query")
+worker_logger = logging.getLogger("hjs.worker")
+
+# Warn when a background transaction has been open this long
+LONG_TRANSACTION_SECONDS = float(os.environ.get("LONG_TRANSACTION_SECONDS", "30"))
+
+
+class SamplingProfiler:
+    """Periodically samples the call stack of a single thread"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            self._stop.wait(self.interval)
+
+    def report(self, limit: int = 50) -> str:
+        """Collapsed-stack output (flamegraph.pl compatible), hottest first"""
+        total = sum(self.samples.values())
+        lines = [f"# {total} samples at {self.interval * 1000:.1f}ms interval"]
+        for stack, count in self.samples.most_common(limit):
+            lines.append(f"{stack} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def rss_bytes() -> int:
+    """Current resident set size; peak RSS where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class TransactionTracker:
+    """Counts database transactions that are open right now, via engine events"""
+
+    def __init__(self, engine):
+        self._open = {}
+        self._lock = threading.Lock()
+        event.listen(engine, "begin", self._begin)
+        event.listen(engine, "commit", self._end)
+        event.listen(engine, "rollback", self._end)
+
+    def _begin(self, conn):
+        with self._lock:
+            self._open[id(conn)] = (time.monotonic(), threading.current_thread().name)
+
+    def _end(self, conn):
+        with self._lock:
+            self._open.pop(id(conn), None)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            open_txns = list(self._open.values())
+        oldest = max((now - started for started, _ in open_txns), default=0.0)
+        return {
+            "open_transactions": len(open_txns),
+            "oldest_transaction_seconds": round(oldest, 1),
+            "threads": sorted({name for _, name in open_txns}),
+        }
+
+
+_trackers = {}
+
+
+def track_transactions(engine) -> TransactionTracker:
+    """Process-wide tracker for this engine (listeners are attached once)"""
+    tracker = _trackers.get(engine)
+    if tracker is None:
+        tracker = _trackers[engine] = TransactionTracker(engine)
+    return tracker
+
+
+def worker_stats(tracker: TransactionTracker) -> dict:
+    """Log RSS and open transactions; warns about transactions left open between ticks"""
+    stats = tracker.snapshot()
+    stats["rss_mb"] = round(rss_bytes() / (1024 * 1024), 1)
+    if stats["oldest_transaction_seconds"] > LONG_TRANSACTION_SECONDS:
+        worker_logger.warning(
+            "Transaction open for %.0fs (threads: %s)",
+            stats["oldest_transaction_seconds"], ", ".join(stats["threads"])
+        )
+    worker_logger.info(
+        "rss=%.1fMB open_transactions=%d", stats["rss_mb"], stats["open_transactions"]
+    )
+    return stats
+
+
+def init_instrumentation(app, db, User):
+    """Attach timing hooks to the app and its engine (opt-in via INSTRUMENTATION_ENABLED)"""
+    enabled = os.environ.get("INSTRUMENTATION_ENABLED", "").lower() in ("1", "true", "yes")
+    app.config["INSTRUMENTATION_ENABLED"] = enabled
+    if not enabled:
+        return
+
+    slow_query_ms = float(os.environ.get("SLOW_QUERY_MS", "200"))
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+
+        path = None
+        if has_request_context():
+            g.query_count = g.get("query_count", 0) + 1
+            g.query_ms = g.get("query_ms", 0.0) + elapsed_ms
+            path = request.path
+
+        if elapsed_ms >= slow_query_ms:
+            # SECURITY: log the statement only, never bound parameters (may hold API keys)
+            slow_query_logger.warning(
+                "Slow query (%.1fms) on %s: %s",
+                elapsed_ms, path or "<background>", " ".join(statement.split())[:1000]
+            )
+
+    def _is_admin():
+        uid = session.get("user_id")
+        if not uid:
+            return False
+        user = User.query.get(uid)
+        return bool(user and user.role_id == 3)
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+        g.query_ms = 0.0
+        g.profiler = None
+
+        # On-demand profile of a single request: append ?_profile=1 (admins only)
+        if request.args.get("_profile") and _is_admin():
+            g.profiler = SamplingProfiler(threading.get_ident())
+            g.profiler.start()
+
+    @app.after_request
+    def _add_server_timing(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+
+        total_ms = (time.perf_counter() - start) * 1000
+        query_ms = g.get("query_ms", 0.0)
+        query_count = g.get("query_count", 0)
+
+        profiler = g.get("profiler")
+        if profiler:
+            # Sampling has to end before the report is read; teardown stops it on error paths too
+            profiler.stop()
+            response = Response(profiler.report(), mimetype="text/plain")
+
+        response.headers["Server-Timing"] = (
+            f'db;dur={query_ms:.1f};desc="{query_count} queries", '
+            f'app;dur={max(0.0, total_ms - query_ms):.1f}, '
+            f'total;dur={total_ms:.1f}'
+        )
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc):
+        # Runs even when the view raised and after_request was skipped; stop() is idempotent
+        profiler = g.get("profiler")
+        if profiler:
+            profiler.stop()
@@ -0,0 +1,155 @@
+"""
+Database-backed job queue.
+
+Producers (admin buttons, the scheduler) insert Job rows; any number of
+worker threads/processes claim them with SELECT ... FOR UPDATE SKIP LOCKED,
+so adding worker processes adds throughput without double-processing.
+Failed jobs are retried with exponential backoff and dead-lettered
+(status 'dead') after max_attempts.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from services.sessions import session_scope
+
+JOB_KINDS = ("verify", "expire", "sweep", "recompute")
+
+# A job still 'running' after this long is assumed to belong to a dead worker
+LEASE_SECONDS = 600
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 900
+
+
+def worker_name(index: int = 0) -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def enqueue(db, Job, kind: str, payload=None, run_at=None, dedupe: bool = True):
+    """
+    Queue a job and commit. With `dedupe`, an already queued job of the same
+    kind is returned instead of adding another (repeated clicks coalesce).
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    if dedupe:
+        existing = Job.query.filter_by(kind=kind, status='queued').order_by(Job.id).first()
+        if existing:
+            return existing
+
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        status='queued',
+        run_at=run_at or datetime.utcnow(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim(db, Job, worker_id: str):
+    """Lock and mark running the next due job, or None. Skips rows other workers hold."""
+    now = datetime.utcnow()
+    lease_cutoff = now - timedelta(seconds=LEASE_SECONDS)
+
+    job = (
+        Job.query
+        .filter(or_(
+            and_(Job.status == 'queued', Job.run_at <= now),
+            and_(Job.status == 'running', Job.locked_at < lease_cutoff),
+        ))
+        .order_by(Job.run_at, Job.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is None:
+        db.session.rollback()
+        return None
+
+    job.status = 'running'
+    job.locked_at = now
+    job.locked_by = worker_id
+    job.attempts = (job.attempts or 0) + 1
+    db.session.commit()
+    return job
+
+
+def complete(db, job, result: dict):
+    job.status = 'done'
+    job.result = json.dumps(result or {})
+    job.finished_at = datetime.utcnow()
+    job.last_error = None
+    db.session.commit()
+
+
+def fail(db, job, error: str):
+    """Schedule a retry with exponential backoff, or dead-letter after max_attempts"""
+    job.last_error = error[-2000:]
+    if job.attempts >= (job.max_attempts or 1):
+        job.status = 'dead'
+        job.finished_at = datetime.utcnow()
+    else:
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (job.attempts - 1))
+        job.status = 'queued'
+        job.run_at = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+        job.locked_at = None
+        job.locked_by = None
+    db.session.commit()
+
+
+def run_one(db, Job, handlers: dict, worker_id: str) -> bool:
+    """Claim and run a single job; returns False when nothing was due"""
+    job = claim(db, Job, worker_id)
+    if job is None:
+        return False
+
+    job_id = job.id
+    handler = handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise RuntimeError(f"No handler for job kind {job.kind!r}")
+        result = handler(json.loads(job.payload or "{}"))
+    except Exception:
+        error = traceback.format_exc()
+        db.session.rollback()
+        fail(db, db.session.get(Job, job_id), error)
+        return True
+
+    complete(db, db.session.get(Job, job_id), result)
+    return True
+
+
+def work(app, db, Job, handlers: dict, worker_id: str, stop_event=None, poll_interval: float = 1.0):
+    """Worker loop: drain due jobs, then poll. Each job runs in its own session scope."""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        ran = False
+        try:
+            with session_scope(app, db):
+                ran = run_one(db, Job, handlers, worker_id)
+        except Exception:
+            # Database hiccup: back off and keep the worker alive
+            stop_event.wait(5)
+        if not ran:
+            stop_event.wait(poll_interval)
+
+
+def prune_jobs(db, Job, keep_days: int = 1, dead_keep_days: int = 30) -> dict:
+    """Drop finished jobs: done ones after keep_days, dead ones (kept for inspection) after dead_keep_days"""
+    now = datetime.utcnow()
+    deleted = Job.query.filter(
+        or_(
+            and_(Job.status == 'done', Job.finished_at < now - timedelta(days=keep_days)),
+            and_(Job.status == 'dead', Job.finished_at < now - timedelta(days=dead_keep_days)),
+        )
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return {"deleted": deleted}
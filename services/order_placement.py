@@ -0,0 +1,148 @@
+"""
+Order placement as one statement.
+
+    INSERT INTO "order" (...)
+    SELECT ... FROM pricing_config
+     WHERE <tier matches> AND NOT EXISTS (<active order of this type>)
+    ON CONFLICT (user_id, coverage_type) WHERE status = 'pending'
+    DO UPDATE SET <new tier>
+    RETURNING id, xanax_payment
+
+The pricing lookup, the active-cover check and replacing an existing pending
+order all happen in a single round-trip and transaction; the partial unique
+indexes on Order (ux_order_pending_per_coverage / ux_order_active_per_coverage)
+make concurrent placements converge on one pending row instead of racing.
+"""
+from datetime import datetime
+
+from sqlalchemy import exists, false, func, literal, select
+
+from services.cache import get_cache
+
+# Pricing edits invalidate the "pricing" namespace on commit, in every worker with a shared
+# CACHE_URL; the default memory:// backend caps this at a few seconds instead
+PRICE_LIST_TTL = 3600
+PRICE_LIST_FIELDS = ("id", "duration", "cost", "xanax_reward", "edvds_reward", "ecstasy_reward")
+
+
+def _dialect_insert(db):
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def place_pending_order(db, Order, PricingConfig, user_id: int, coverage_type: str, duration: int):
+    """
+    Create or replace the user's pending order for this tier and commit.
+    Returns (order_id, cost), or None when the tier doesn't exist or the user
+    already has active cover of this type (see placement_failure).
+    """
+    is_xan = coverage_type == 'XAN'
+    tier = (
+        select(
+            literal(user_id).label("user_id"),
+            PricingConfig.coverage_type,
+            literal('pending').label("status"),
+            PricingConfig.cost,
+            false().label("payment_verified"),
+            (PricingConfig.duration if is_xan else literal(None)).label("hours"),
+            (literal(None) if is_xan else PricingConfig.duration).label("jumps"),
+            PricingConfig.xanax_reward,
+            (literal(None) if is_xan else PricingConfig.edvds_reward).label("edvds_reward"),
+            (literal(None) if is_xan else PricingConfig.ecstasy_reward).label("ecstasy_reward"),
+            literal(datetime.utcnow()).label("created_at"),
+            false().label("auto_detected"),
+        )
+        .where(
+            PricingConfig.coverage_type == coverage_type,
+            PricingConfig.duration == duration,
+            PricingConfig.active.is_(True),
+            ~exists().where(
+                Order.user_id == user_id,
+                Order.coverage_type == coverage_type,
+                Order.status == 'active',
+            ),
+        )
+        .order_by(PricingConfig.id)
+        .limit(1)
+    )
+
+    insert = _dialect_insert(db)
+    stmt = insert(Order).from_select(
+        ["user_id", "coverage_type", "status", "xanax_payment", "payment_verified", "hours", "jumps",
+         "xanax_reward", "edvds_reward", "ecstasy_reward", "created_at", "auto_detected"],
+        tier,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Order.user_id, Order.coverage_type],
+        index_where=Order.status == 'pending',
+        set_={
+            "xanax_payment": stmt.excluded.xanax_payment,
+            "hours": stmt.excluded.hours,
+            "jumps": stmt.excluded.jumps,
+            "xanax_reward": stmt.excluded.xanax_reward,
+            "edvds_reward": stmt.excluded.edvds_reward,
+            "ecstasy_reward": stmt.excluded.ecstasy_reward,
+            "created_at": stmt.excluded.created_at,
+        },
+    ).returning(Order.id, Order.xanax_payment)
+
+    row = db.session.execute(stmt).first()
+    db.session.commit()
+    return (row.id, row.xanax_payment) if row else None
+
+
+def active_price_lists(PricingConfig) -> dict:
+    """{'XAN': [...], 'EXTC': [...]} active tiers as plain dicts ordered by duration, from the shared cache"""
+    def load():
+        lists = {'XAN': [], 'EXTC': []}
+        for p in PricingConfig.query.filter_by(active=True).order_by(PricingConfig.duration):
+            lists.setdefault(p.coverage_type, []).append({field: getattr(p, field) for field in PRICE_LIST_FIELDS})
+        return lists
+
+    return get_cache().get_or_set("pricing", "active", load, ttl=PRICE_LIST_TTL)
+
+
+def placement_failure(Order, user_id: int, coverage_type: str) -> str:
+    """Why place_pending_order returned None: 'active' or 'unavailable' (error path only)"""
+    active = Order.query.filter_by(user_id=user_id, coverage_type=coverage_type, status='active').first()
+    return 'active' if active else 'unavailable'
+
+
+def migration_steps(Order) -> dict:
+    """Data fix-ups run by services.schema.migrate before the unique indexes are built"""
+    orders = Order.__table__
+
+    def superseded(status, order_column):
+        # Every row but the newest per (user, coverage type)
+        ranked = (
+            select(
+                orders.c.id,
+                func.row_number().over(
+                    partition_by=(orders.c.user_id, orders.c.coverage_type),
+                    order_by=(order_column.desc().nulls_last(), orders.c.id.desc()),
+                ).label("rank"),
+            )
+            .where(orders.c.status == status)
+            .subquery()
+        )
+        return select(ranked.c.id).where(ranked.c.rank > 1)
+
+    def drop_duplicate_pending(conn):
+        # place_order used to replace pending orders; keep the newest
+        conn.execute(orders.delete().where(orders.c.id.in_(superseded('pending', orders.c.created_at))))
+
+    def complete_duplicate_active(conn):
+        # Same rule as manual activation: older active cover of the same type is completed
+        conn.execute(
+            orders.update()
+            .where(orders.c.id.in_(superseded('active', orders.c.expires_at)))
+            .values(status='completed')
+        )
+
+    return {
+        "index order.ux_order_pending_per_coverage": drop_duplicate_pending,
+        "index order.ux_order_active_per_coverage": complete_duplicate_active,
+    }
@@ -3,122 +3,326 @@ Order verification service - handles Torn API checks for insurance orders
 """
 import re
 from datetime import datetime, timedelta
-import requests
+
+from services.torn_client import events_snapshot
 
 
 def fetch_torn_events(api_key: str) -> dict:
-    """Fetch user events from Torn API"""
+    """User events from the Torn API (cached snapshot; {} when Torn is unavailable)"""
     try:
-        url = f"https://api.torn.com/user/?selections=events&key={api_key}"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if isinstance(data, dict) and "error" in data:
-            raise ValueError(data["error"].get("error", "Torn API error"))
-        
-        return data.get("events", {})
+        return events_snapshot.get(api_key)
     except Exception as e:
-        print(f"Error fetching Torn events: {e}")
+        # SECURITY: request errors embed the URL, which carries the key
+        print(f"Error fetching Torn events: {type(e).__name__}")
         return {}
 
 
-def verify_order_payment(order, admin_api_key: str) -> tuple:
+# Payments sent a little before the order was placed (clock skew, impatient users) still count
+PAYMENT_CLOCK_SKEW = timedelta(minutes=5)
+
+MESSAGE_CODES = {'XAN': 'hjsx', 'EXTC': 'hjse'}
+
+_MESSAGE_CODE_RE = re.compile(r'hjs[xe]')
+_XANAX_AMOUNT_RE = re.compile(r'(\d+)x?\s*xanax')
+_SENDER_LINK_RE = re.compile(r'from.*?>([^<]+)</a>')
+_SENDER_XID_RE = re.compile(r'from\s*<a[^>]*?XID=(\d+)', re.IGNORECASE)
+
+
+def normalize_name(name: str) -> str:
+    return " ".join((name or "").lower().split())
+
+
+def iter_events(events):
+    """Yield (event_id, entry) from the Torn events payload (dict keyed by id, or a list)"""
+    if isinstance(events, dict):
+        items = events.items()
+    elif isinstance(events, list):
+        items = enumerate(events)
+    else:
+        return
+    for event_id, entry in items:
+        if isinstance(entry, dict):
+            yield str(event_id), entry
+
+
+def parse_payment_event(event_id: str, log_entry: dict):
     """
-    Verify if payment for an order has been received via Torn API
-    Returns: (verified: bool, payment_time: datetime or None, matched_event: dict or None)
+    Parse one Torn event into an insurance payment, or None if it isn't one.
+    Returns dict with event_id, message_code, quantity, sender_torn_id, sender_name, timestamp, log_text
     """
-    if not admin_api_key:
-        return False, None, None
-    
+    log_text = log_entry.get('log', '') or log_entry.get('event', '')
+    if not isinstance(log_text, str):
+        log_text = str(log_text)
+    log_text_lower = log_text.lower()
+
+    log_timestamp = log_entry.get('timestamp', 0)
+    if not log_timestamp or not isinstance(log_timestamp, (int, float)):
+        return None
+
+    if 'xanax' not in log_text_lower:
+        return None
+    has_transfer = (
+        ('sent' in log_text_lower and 'to you' in log_text_lower) or
+        'you were sent' in log_text_lower or
+        'received' in log_text_lower
+    )
+    if not has_transfer:
+        return None
+
+    code_match = _MESSAGE_CODE_RE.search(log_text_lower)
+    if not code_match:
+        return None
+
+    xanax_pattern = _XANAX_AMOUNT_RE.search(log_text_lower)
+    if xanax_pattern:
+        quantity = int(xanax_pattern.group(1))
+    elif 'some xanax' in log_text_lower:
+        quantity = 1
+    else:
+        return None
+
+    # Torn links the sender's profile (profiles.php?XID=<id>); the id is exact, the name is not
+    xid_match = _SENDER_XID_RE.search(log_text)
+    sender_torn_id = int(xid_match.group(1)) if xid_match else None
+
+    sender_name = None
+    name_match = _SENDER_LINK_RE.search(log_text)
+    if name_match:
+        sender_name = name_match.group(1).strip()
+    else:
+        parts = log_text.split(' from ')
+        if len(parts) > 1:
+            sender_name = parts[1].split(' with')[0].strip()
+
+    return {
+        'event_id': event_id,
+        'message_code': code_match.group(0),
+        'quantity': quantity,
+        'sender_torn_id': sender_torn_id,
+        'sender_name': sender_name,
+        'timestamp': datetime.utcfromtimestamp(log_timestamp),
+        'log_text': log_text,
+    }
+
+
+def parse_payment_events(events, skip_ids=None) -> list:
+    """Parse every payment in an events payload, skipping event ids in `skip_ids`"""
+    parsed = []
+    for event_id, entry in iter_events(events):
+        if skip_ids and event_id in skip_ids:
+            continue
+        payment = parse_payment_event(event_id, entry)
+        if payment:
+            parsed.append(payment)
+    return parsed
+
+
+def match_pending_orders(orders, payments: list, directory=None) -> dict:
+    """
+    Hash-join pending orders against parsed payments.
+
+    Payments are indexed by (message code, quantity, sender Torn id) and each
+    order probes the index once with its user's torn_user_id, so a pass is
+    O(orders + events). The sender id comes from the event's profile link; when
+    only a name is present it is resolved through `directory` (a UserDirectory),
+    and payments whose sender can't be resolved are ignored.
+
+    Each payment satisfies at most one order. When several orders share a key
+    they are served oldest first (created_at, id), each taking the earliest
+    unused payment made no earlier than the order itself (minus PAYMENT_CLOCK_SKEW).
+
+    Returns {order.id: payment}
+    """
+    index = {}
+    for payment in payments:
+        sender_torn_id = payment['sender_torn_id']
+        if sender_torn_id is None and directory is not None:
+            sender_torn_id = directory.resolve(payment['sender_name'])
+        if sender_torn_id is None:
+            continue
+        key = (payment['message_code'], payment['quantity'], sender_torn_id)
+        index.setdefault(key, []).append(payment)
+    for bucket in index.values():
+        bucket.sort(key=lambda p: (p['timestamp'], p['event_id']))
+
+    cursors = {}
+    matches = {}
+    for order in sorted(orders, key=lambda o: (o.created_at or datetime.min, o.id)):
+        key = (MESSAGE_CODES.get(order.coverage_type), order.xanax_payment, order.user.torn_user_id)
+        bucket = index.get(key)
+        if not bucket:
+            continue
+
+        # Orders arrive in creation order, so payments too old for this order are
+        # too old for every later one as well: the cursor only moves forward.
+        earliest = (order.created_at or datetime.min) - PAYMENT_CLOCK_SKEW
+        position = cursors.get(key, 0)
+        while position < len(bucket) and bucket[position]['timestamp'] < earliest:
+            position += 1
+        if position < len(bucket):
+            matches[order.id] = bucket[position]
+            position += 1
+        cursors[key] = position
+
+    return matches
+
+
+def verify_pending_orders(orders, admin_api_key: str, directory=None, consumed_ids=None) -> dict:
+    """Fetch events once and match every pending order against them. Returns {order.id: payment}"""
+    if not admin_api_key or not orders:
+        return {}
+
     events = fetch_torn_events(admin_api_key)
     if not events:
+        return {}
+
+    return match_pending_orders(orders, parse_payment_events(events, consumed_ids), directory)
+
+
+def consumed_event_ids(PaymentMatch, event_ids) -> set:
+    """Subset of `event_ids` already recorded in the PaymentMatch ledger"""
+    event_ids = list(event_ids)
+    consumed = set()
+    for i in range(0, len(event_ids), 1000):
+        chunk = event_ids[i:i + 1000]
+        consumed.update(
+            event_id for (event_id,) in
+            PaymentMatch.query.with_entities(PaymentMatch.torn_event_id).filter(PaymentMatch.torn_event_id.in_(chunk))
+        )
+    return consumed
+
+
+def record_payment(PaymentMatch, order, payment):
+    """Ledger row tying `payment` to `order`; add it in the same transaction as the activation"""
+    return PaymentMatch(
+        torn_event_id=payment['event_id'],
+        order_id=order.id,
+        sender_torn_id=payment['sender_torn_id'] or order.user.torn_user_id,
+        amount=payment['quantity'],
+        paid_at=payment['timestamp'],
+    )
+
+
+def fetch_new_payments(PaymentMatch, admin_api_key: str) -> list:
+    """Fetch events once and parse the payments not yet recorded in the ledger"""
+    events = dict(iter_events(fetch_torn_events(admin_api_key))) if admin_api_key else {}
+    if not events:
+        return []
+
+    # Only events not yet used by an earlier pass are parsed and matched
+    consumed = consumed_event_ids(PaymentMatch, events.keys())
+    return parse_payment_events(events, consumed)
+
+
+def run_verification_pass(db, Order, PaymentMatch, directory, admin_api_key: str, payments=None) -> tuple:
+    """
+    One verification pass: match new (unconsumed) payments against all pending
+    orders and commit activations together with their ledger rows. `payments`
+    can be passed in to share one fetch with later stages; otherwise they are
+    fetched here. Returns (verified_count, pending_count).
+    """
+    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy.orm import joinedload
+
+    # The matcher reads order.user for every order; load them in the same query
+    pending_orders = (
+        Order.query.options(joinedload(Order.user))
+        .filter_by(status='pending', payment_verified=False)
+        .all()
+    )
+    if not pending_orders:
+        return 0, 0
+
+    if payments is None:
+        payments = fetch_new_payments(PaymentMatch, admin_api_key)
+    matches = match_pending_orders(pending_orders, payments, directory)
+    if not matches:
+        return 0, len(pending_orders)
+
+    # Users already holding active cover of a type keep it; an admin decides what the payment is for
+    # (and ux_order_active_per_coverage would reject the whole pass)
+    matched_users = {order.user_id for order in pending_orders if order.id in matches}
+    covered = set(
+        Order.query.with_entities(Order.user_id, Order.coverage_type)
+        .filter(Order.status == 'active', Order.user_id.in_(matched_users))
+        .all()
+    )
+
+    activated = 0
+    for order in pending_orders:
+        payment = matches.get(order.id)
+        if payment and (order.user_id, order.coverage_type) not in covered:
+            activate_order(order, payment['timestamp'])
+            activated += 1
+            db.session.add(record_payment(PaymentMatch, order, payment))
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent pass consumed one of these events first; its activations win
+        db.session.rollback()
+        return 0, len(pending_orders)
+
+    return activated, len(pending_orders)
+
+
+def activate_order(order, payment_time=None):
+    """Mark a paid order active and start its coverage window"""
+    now = datetime.utcnow()
+    order.payment_verified = True
+    order.payment_verified_at = payment_time or now
+    order.status = 'active'
+    order.activated_at = now
+
+    # XAN covers last the purchased hours, EXTC covers always expire in 2 hours
+    if order.coverage_type == 'XAN' and order.hours:
+        order.expires_at = now + timedelta(hours=order.hours)
+    elif order.coverage_type == 'EXTC':
+        order.expires_at = now + timedelta(hours=2)
+
+
+def verify_order_payment(order, admin_api_key: str, directory=None) -> tuple:
+    """
+    Verify if payment for a single order has been received via Torn API
+    Returns: (verified: bool, payment_time: datetime or None, matched_event: dict or None)
+    """
+    payment = verify_pending_orders([order], admin_api_key, directory).get(order.id)
+    if not payment:
         return False, None, None
 
-    # Determine message code based on coverage type
-    message_code = 'HJSx' if order.coverage_type == 'XAN' else 'HJSe'
-    expected_payment = order.xanax_payment
-    
-    # Get user's Torn name for matching
-    user_torn_name = order.user.torn_name.lower()
+    return True, payment['timestamp'], {
+        'log_text': payment['log_text'],
+        'timestamp': payment['timestamp'],
+        'log_id': payment['event_id']
+    }
+
+
+# Payments older than this are left for an admin instead of becoming orders automatically
+AUTO_DETECT_LOOKBACK = timedelta(hours=1)
+
+
+def detect_orders(payments) -> list:
+    """Turn parsed payments into detected-order dicts (recent, identifiable senders only)"""
+    lookback_limit = datetime.utcnow() - AUTO_DETECT_LOOKBACK
     
-    # Normalize events to a list and only check the latest 3 by timestamp
-    normalized = []
-    if isinstance(events, dict):
-        for k, v in events.items():
-            if isinstance(v, dict):
-                v['_id'] = str(k)
-                normalized.append(v)
-    elif isinstance(events, list):
-        for i, v in enumerate(events):
-            if isinstance(v, dict):
-                v['_id'] = str(i)
-                normalized.append(v)
-
-    # Sort by timestamp desc and take last 3 entries
-    normalized = [e for e in normalized if 'timestamp' in e and isinstance(e.get('timestamp'), (int, float))]
-    normalized.sort(key=lambda e: e.get('timestamp', 0), reverse=True)
-    recent_entries = normalized[:3]
-
-    for log_entry in recent_entries:
-        if not isinstance(log_entry, dict):
-            continue
-        
-        # Get log text
-        log_text = log_entry.get('log', '') or log_entry.get('event', '')
-        if not isinstance(log_text, str):
-            log_text = str(log_text)
-        
-        log_text_lower = log_text.lower()
-        
-        # Get timestamp
-        log_timestamp = log_entry.get('timestamp', 0)
-        if not log_timestamp:
-            continue
-        log_time = datetime.fromtimestamp(log_timestamp)
-        
-        # Check for required components
-        has_xanax = 'xanax' in log_text_lower
-        has_message_code = message_code.lower() in log_text_lower
-        has_transfer = (
-            ('sent' in log_text_lower and 'to you' in log_text_lower) or
-            'you were sent' in log_text_lower or
-            'received' in log_text_lower
-        )
-        
-        if not (has_xanax and has_message_code and has_transfer):
-            continue
-        
-        # Verify payment amount
-        payment_match = False
-        xanax_pattern = re.search(r'(\d+)x?\s*xanax', log_text_lower)
-        if xanax_pattern:
-            found_amount = int(xanax_pattern.group(1))
-            payment_match = (found_amount == expected_payment)
-        elif 'some xanax' in log_text_lower and expected_payment == 1:
-            payment_match = True
-        
-        if not payment_match:
+    detected_orders = []
+    for payment in payments:
+        if payment['timestamp'] < lookback_limit:
             continue
-        
-        # Verify sender name
-        name_match = user_torn_name in log_text_lower
-        if not name_match:
-            # Try partial matching
-            name_words = user_torn_name.split()
-            name_match = any(word in log_text_lower for word in name_words if len(word) > 2)
-        
-        if not name_match:
+        if payment['sender_torn_id'] is None and not payment['sender_name']:
             continue
         
-        # All checks passed - payment verified
-        return True, log_time, {
-            'log_text': log_text,
-            'timestamp': log_time,
-            'log_id': log_entry.get('_id')
-        }
+        detected_orders.append({
+            'event_id': payment['event_id'],
+            'sender_torn_id': payment['sender_torn_id'],
+            'sender_name': payment['sender_name'],
+            'coverage_type': 'XAN' if payment['message_code'] == MESSAGE_CODES['XAN'] else 'EXTC',
+            'payment_amount': payment['quantity'],
+            'timestamp': payment['timestamp'],
+            'log_text': payment['log_text']
+        })
     
-    return False, None, None
+    return detected_orders
 
 
 def auto_detect_new_orders(admin_api_key: str, existing_user_ids: set) -> list:
@@ -133,83 +337,4 @@ def auto_detect_new_orders(admin_api_key: str, existing_user_ids: set) -> list:
     if not events:
         return []
     
-    detected_orders = []
-    current_time = datetime.utcnow()
-    lookback_limit = current_time - timedelta(hours=1)  # Only last hour for auto-detection
-    
-    # Process events
-    log_items = []
-    if isinstance(events, dict):
-        log_items = list(events.items())
-    elif isinstance(events, list):
-        log_items = [(i, entry) for i, entry in enumerate(events)]
-    
-    for log_id, log_entry in log_items:
-        if not isinstance(log_entry, dict):
-            continue
-        
-        log_text = log_entry.get('log', '') or log_entry.get('event', '')
-        if not isinstance(log_text, str):
-            log_text = str(log_text)
-        
-        log_text_lower = log_text.lower()
-        log_timestamp = log_entry.get('timestamp', 0)
-        
-        if not log_timestamp:
-            continue
-        
-        log_time = datetime.fromtimestamp(log_timestamp)
-        
-        if log_time < lookback_limit:
-            continue
-        
-        # Check for insurance orders
-        has_xanax = 'xanax' in log_text_lower
-        has_hjsx = 'hjsx' in log_text_lower
-        has_hjse = 'hjse' in log_text_lower
-        has_transfer = (
-            ('sent' in log_text_lower and 'to you' in log_text_lower) or
-            'you were sent' in log_text_lower or
-            'received' in log_text_lower
-        )
-        
-        is_xan_order = has_xanax and has_hjsx and has_transfer
-        is_extc_order = has_xanax and has_hjse and has_transfer
-        
-        if not (is_xan_order or is_extc_order):
-            continue
-        
-        # Extract sender name
-        sender_name = None
-        name_match = re.search(r'from.*?>([^<]+)</a>', log_text)
-        if name_match:
-            sender_name = name_match.group(1).strip()
-        else:
-            parts = log_text.split(' from ')
-            if len(parts) > 1:
-                name_part = parts[1].split(' with')[0].strip()
-                sender_name = name_part.split()[0]
-        
-        if not sender_name:
-            continue
-        
-        # Extract payment amount
-        payment_amount = 0
-        xanax_pattern = re.search(r'(\d+)x?\s*xanax', log_text_lower)
-        if xanax_pattern:
-            payment_amount = int(xanax_pattern.group(1))
-        elif 'some xanax' in log_text_lower:
-            payment_amount = 1
-        
-        if payment_amount == 0:
-            continue
-        
-        detected_orders.append({
-            'sender_name': sender_name,
-            'coverage_type': 'XAN' if is_xan_order else 'EXTC',
-            'payment_amount': payment_amount,
-            'timestamp': log_time,
-            'log_text': log_text
-        })
-    
-    return detected_orders
+    return detect_orders(parse_payment_events(events))
@@ -0,0 +1,239 @@
+"""
+Transactional outbox for outbound webhooks.
+
+State changes are noticed in an after_flush hook on the ORM session and
+written as OutboxEvent rows on the same connection, so a notification exists
+exactly when the change it describes was committed. There is one row per
+destination in WEBHOOK_URLS. The hook sees every ORM write path: the
+verifier, auto-detected orders, bulk and manual activation, reconciliation,
+expiry, reports and confirmations. Core-level UPDATEs are not seen.
+
+deliver_due() is run by the scheduler. It claims due rows with
+FOR UPDATE SKIP LOCKED, commits, and then POSTs each destination's rows as
+one batch outside any transaction:
+
+    {"events": [{"id", "event", "created_at", "data"}, ...]}
+
+The body is signed with HMAC-SHA256 (X-HJS-Signature: sha256=<hex>) when
+WEBHOOK_SECRET is set. When a destination fails, all of its pending rows
+back off together, which keeps the order for that destination. A row is
+dead-lettered after MAX_ATTEMPTS. Delivery is at least once; receivers
+should dedupe on event id.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, inspect, or_, select
+
+MAX_ATTEMPTS = 10
+BATCH_SIZE = 100
+MAX_PASSES = 10  # batches per deliver_due call, so one run can't monopolise the scheduler
+LEASE_SECONDS = 120
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+HTTP_TIMEOUT = (3.05, 10)
+
+_installed = set()
+
+
+def webhook_urls() -> list:
+    return [url.strip() for url in os.environ.get("WEBHOOK_URLS", "").split(",") if url.strip()]
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _order_data(order, users):
+    torn_user_id, torn_name = users.get(order.user_id, (None, None))
+    return {
+        "order_id": order.id,
+        "torn_user_id": torn_user_id,
+        "torn_name": torn_name,
+        "coverage_type": order.coverage_type,
+        "tier": order.hours if order.coverage_type == 'XAN' else order.jumps,
+        "xanax_payment": order.xanax_payment,
+        "activated_at": _iso(order.activated_at),
+        "expires_at": _iso(order.expires_at),
+    }
+
+
+def _overdose_data(overdose, users):
+    torn_user_id, torn_name = users.get(overdose.user_id, (None, None))
+    return {
+        "overdose_id": overdose.id,
+        "torn_user_id": torn_user_id,
+        "torn_name": torn_name,
+        "coverage_type": overdose.coverage_type,
+        "reported_at": _iso(overdose.reported_at),
+        "confirmed_at": _iso(overdose.confirmed_at),
+        "payout_details": overdose.payout_details,
+    }
+
+
+def _changed_to(obj, attribute, values) -> bool:
+    history = inspect(obj).attrs[attribute].history
+    return bool(history.added) and history.added[0] in values and getattr(obj, attribute) in values
+
+
+def collect_events(session, User, Order, Overdose) -> list:
+    """(event, obj) pairs for the flush in progress; the session still shows pre-flush new/dirty"""
+    found = []
+    for obj in session.new:
+        if isinstance(obj, Order) and obj.status == 'active':
+            found.append(('order.activated', obj))
+        elif isinstance(obj, Overdose):
+            found.append(('overdose.reported', obj))
+    for obj in session.dirty:
+        if isinstance(obj, Order) and _changed_to(obj, 'status', ('active', 'expired')):
+            found.append(('order.activated' if obj.status == 'active' else 'order.expired', obj))
+        elif isinstance(obj, Overdose) and _changed_to(obj, 'confirmed', (True,)):
+            found.append(('overdose.confirmed', obj))
+    return found
+
+
+def init_outbox(app, db, User, Order, Overdose, OutboxEvent):
+    """Record state changes into the outbox when WEBHOOK_URLS is configured"""
+    destinations = webhook_urls()
+    if not destinations or OutboxEvent in _installed:
+        return
+    _installed.add(OutboxEvent)
+
+    @event.listens_for(db.session, "after_flush")
+    def _write_outbox(session, flush_context):
+        found = collect_events(session, User, Order, Overdose)
+        if not found:
+            return
+
+        connection = session.connection()
+        user_ids = {obj.user_id for _, obj in found}
+        users = {
+            row.id: (row.torn_user_id, row.torn_name)
+            for row in connection.execute(
+                select(User.id, User.torn_user_id, User.torn_name).where(User.id.in_(user_ids))
+            )
+        }
+
+        now = datetime.utcnow()
+        rows = []
+        for name, obj in found:
+            data = _order_data(obj, users) if isinstance(obj, Order) else _overdose_data(obj, users)
+            payload = json.dumps(data)
+            rows.extend(
+                dict(destination=destination, event=name, payload=payload, created_at=now,
+                     status='pending', attempts=0, next_attempt_at=now)
+                for destination in destinations
+            )
+        connection.execute(OutboxEvent.__table__.insert(), rows)
+
+
+def sign(body: bytes, secret: str) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def _claim(db, OutboxEvent, now):
+    """Lock, mark 'sending' and commit up to BATCH_SIZE due rows (abandoned 'sending' rows are due again)"""
+    lease_cutoff = now - timedelta(seconds=LEASE_SECONDS)
+    rows = (
+        OutboxEvent.query
+        .filter(or_(
+            and_(OutboxEvent.status == 'pending', OutboxEvent.next_attempt_at <= now),
+            and_(OutboxEvent.status == 'sending', OutboxEvent.locked_at < lease_cutoff),
+        ))
+        .order_by(OutboxEvent.id)
+        .limit(BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    claimed = [
+        (row.id, row.destination, {"id": row.id, "event": row.event, "created_at": _iso(row.created_at),
+                                   "data": json.loads(row.payload)}, row.attempts)
+        for row in rows
+    ]
+    for row in rows:
+        row.status = 'sending'
+        row.locked_at = now
+    db.session.commit()
+    return claimed
+
+
+def _post(http, destination, events, secret):
+    body = json.dumps({"events": events}).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-HJS-Signature"] = sign(body, secret)
+    response = http.post(destination, data=body, headers=headers, timeout=HTTP_TIMEOUT)
+    if not 200 <= response.status_code < 300:
+        raise RuntimeError(f"HTTP {response.status_code}")
+
+
+def deliver_due(db, OutboxEvent, http=None) -> dict:
+    """Deliver due outbox rows, one POST per destination per batch"""
+    import requests
+
+    http = http or requests.Session()
+    secret = os.environ.get("WEBHOOK_SECRET", "")
+    counts = {"delivered": 0, "failed": 0, "dead": 0}
+
+    for _ in range(MAX_PASSES):
+        now = datetime.utcnow()
+        claimed = _claim(db, OutboxEvent, now)
+        if not claimed:
+            break
+
+        by_destination = {}
+        for row_id, destination, item, attempts in claimed:
+            by_destination.setdefault(destination, []).append((row_id, item, attempts))
+
+        for destination, items in by_destination.items():
+            ids = [row_id for row_id, _, _ in items]
+            try:
+                _post(http, destination, [item for _, item, _ in items], secret)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"[:500]
+                attempts = max(a for _, _, a in items) + 1
+                delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+                retry_at = datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+                dead = attempts >= MAX_ATTEMPTS
+                db.session.execute(
+                    db.update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(
+                        status='dead' if dead else 'pending', attempts=attempts, last_error=error,
+                        next_attempt_at=retry_at, locked_at=None,
+                    )
+                )
+                if not dead:
+                    # Later rows for this destination wait too, so it receives events in order
+                    db.session.execute(
+                        db.update(OutboxEvent)
+                        .where(OutboxEvent.destination == destination, OutboxEvent.status == 'pending',
+                               OutboxEvent.next_attempt_at < retry_at)
+                        .values(next_attempt_at=retry_at)
+                    )
+                db.session.commit()
+                counts["dead" if dead else "failed"] += len(ids)
+                continue
+
+            db.session.execute(
+                db.update(OutboxEvent).where(OutboxEvent.id.in_(ids)).values(
+                    status='delivered', delivered_at=datetime.utcnow(), attempts=OutboxEvent.attempts + 1,
+                    locked_at=None, last_error=None,
+                )
+            )
+            db.session.commit()
+            counts["delivered"] += len(ids)
+
+    return counts
+
+
+def prune_outbox(db, OutboxEvent, keep_days: int = 7) -> dict:
+    """Drop delivered rows older than keep_days (dead rows stay for inspection)"""
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    deleted = OutboxEvent.query.filter(
+        OutboxEvent.status == 'delivered', OutboxEvent.delivered_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return {"deleted": deleted}
@@ -0,0 +1,159 @@
+"""
+Overdose reporting rules, evaluated in one query.
+
+XAN: one confirmed overdose per XAN_REPORT_COOLDOWN. The cooldown end is
+stored on User.next_xan_report_at by confirm_overdose, so checking it is a
+column read rather than an Overdose scan.
+
+EXTC: one confirmed overdose per active EXTC order (confirmed since the order
+was activated).
+
+Only one unconfirmed report per user and coverage type may exist; the
+ux_overdose_pending_report unique index enforces that under concurrency.
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import and_, exists, func, select
+
+from services.cache import get_cache
+
+XAN_REPORT_COOLDOWN = timedelta(hours=4)
+USER_STATE_TTL = 30  # order/overdose/user commits invalidate the user's namespace sooner
+
+logger = logging.getLogger("hjs.overdose_eligibility")
+
+
+def eligibility_columns(User, Order, Overdose) -> list:
+    """Labelled columns, correlated on User, that eligibility_from_row reads"""
+    def active_order(coverage_type, column):
+        return (
+            select(column)
+            .where(Order.user_id == User.id, Order.coverage_type == coverage_type, Order.status == 'active')
+            .order_by(Order.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+
+    def pending_report(coverage_type):
+        return exists().where(
+            Overdose.user_id == User.id,
+            Overdose.coverage_type == coverage_type,
+            Overdose.confirmed.is_(False),
+        )
+
+    extc_activated_at = active_order('EXTC', Order.activated_at)
+    extc_used = exists().where(
+        Overdose.user_id == User.id,
+        Overdose.coverage_type == 'EXTC',
+        Overdose.confirmed.is_(True),
+        Overdose.confirmed_at >= extc_activated_at,
+    )
+
+    return [
+        User.next_xan_report_at,
+        active_order('XAN', Order.id).label('xan_order_id'),
+        active_order('EXTC', Order.id).label('extc_order_id'),
+        extc_used.label('extc_used'),
+        pending_report('XAN').label('xan_pending'),
+        pending_report('EXTC').label('extc_pending'),
+    ]
+
+
+def eligibility_from_row(row, now) -> dict:
+    next_xan = row.next_xan_report_at
+    xan_cooling_down = next_xan is not None and next_xan > now
+    return {
+        "has_xan": row.xan_order_id is not None,
+        "has_extc": row.extc_order_id is not None,
+        "can_report_xan": not xan_cooling_down,
+        "can_report_extc": not row.extc_used,
+        "hours_until_next_xan": max(0.0, (next_xan - now).total_seconds() / 3600) if xan_cooling_down else 0.0,
+        "xan_pending": bool(row.xan_pending),
+        "extc_pending": bool(row.extc_pending),
+    }
+
+
+def check_eligibility(db, User, Order, Overdose, user_id: int, now=None):
+    """
+    Everything report_overdose/check_overdose_limits need, from one statement.
+    Returns None when the user doesn't exist.
+    """
+    now = now or datetime.utcnow()
+    row = db.session.execute(
+        select(*eligibility_columns(User, Order, Overdose)).where(User.id == user_id)
+    ).first()
+    return eligibility_from_row(row, now) if row is not None else None
+
+
+def cached_eligibility(db, User, Order, Overdose, user_id: int, now=None):
+    """
+    check_eligibility with the row kept in the shared cache, for display only;
+    report_overdose reads it fresh. The countdown is still computed from `now`.
+    """
+    def load():
+        row = db.session.execute(
+            select(*eligibility_columns(User, Order, Overdose)).where(User.id == user_id)
+        ).first()
+        return dict(row._mapping) if row is not None else None
+
+    row = get_cache().get_or_set(f"user:{user_id}", "eligibility", load, ttl=USER_STATE_TTL)
+    return eligibility_from_row(SimpleNamespace(**row), now or datetime.utcnow()) if row is not None else None
+
+
+def refresh_next_xan_report_at(db, User, Overdose, user_id: int):
+    """Recompute a user's XAN cooldown from their confirmed reports (after a confirmed one is deleted)"""
+    last_confirmed = db.session.execute(
+        select(func.max(Overdose.confirmed_at)).where(
+            Overdose.user_id == user_id,
+            Overdose.coverage_type == 'XAN',
+            Overdose.confirmed.is_(True),
+        )
+    ).scalar()
+    next_at = last_confirmed + XAN_REPORT_COOLDOWN if last_confirmed else None
+    db.session.execute(db.update(User).where(User.id == user_id).values(next_xan_report_at=next_at))
+
+
+def migration_steps(User, Overdose) -> dict:
+    """Data fix-ups for services.schema.migrate when these columns/indexes are first created"""
+    users = User.__table__
+    overdoses = Overdose.__table__
+
+    def backfill_next_xan_report_at(conn):
+        cutoff = datetime.utcnow() - XAN_REPORT_COOLDOWN
+        rows = conn.execute(
+            select(overdoses.c.user_id, func.max(overdoses.c.confirmed_at))
+            .where(
+                overdoses.c.coverage_type == 'XAN',
+                overdoses.c.confirmed.is_(True),
+                overdoses.c.confirmed_at > cutoff,
+            )
+            .group_by(overdoses.c.user_id)
+        ).all()
+        for user_id, confirmed_at in rows:
+            conn.execute(
+                users.update().where(users.c.id == user_id).values(next_xan_report_at=confirmed_at + XAN_REPORT_COOLDOWN)
+            )
+
+    def drop_duplicate_pending_reports(conn):
+        # Keep the earliest unconfirmed report per user/coverage type. The rest are logged
+        # in full first, so an admin can re-enter any that turn out to be real.
+        keep = (
+            select(func.min(overdoses.c.id))
+            .where(overdoses.c.confirmed.is_(False))
+            .group_by(overdoses.c.user_id, overdoses.c.coverage_type)
+        )
+        duplicate = and_(overdoses.c.confirmed.is_(False), overdoses.c.id.not_in(keep))
+        dropped = conn.execute(select(overdoses).where(duplicate).order_by(overdoses.c.id)).mappings().all()
+        for row in dropped:
+            logger.warning("Dropping duplicate pending overdose report: %s", json.dumps(dict(row), default=str))
+        if dropped:
+            conn.execute(overdoses.delete().where(overdoses.c.id.in_([row["id"] for row in dropped])))
+            logger.warning("Dropped %d duplicate pending overdose reports", len(dropped))
+
+    return {
+        "column user.next_xan_report_at": backfill_next_xan_report_at,
+        "index overdose.ux_overdose_pending_report": drop_duplicate_pending_reports,
+    }
@@ -0,0 +1,128 @@
+"""
+Overdose confirmation and payout sheets.
+
+confirm_overdoses() confirms any number of reports in one transaction: the
+reports and the active orders that determine their payouts are each loaded
+with one query, and everything is written with a single commit.
+payout_sheet() aggregates confirmed payouts per user in SQL so rewards can be
+sent in one batch.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
+
+from services.overdose_eligibility import XAN_REPORT_COOLDOWN
+
+
+def payout_for(order) -> dict:
+    """Payout columns for an overdose on this order's cover"""
+    if order.coverage_type == 'XAN':
+        return {
+            "payout": order.xanax_reward,
+            "payout_xanax": order.xanax_reward,
+            "payout_details": f"{order.xanax_reward} Xanax",
+        }
+    return {
+        "payout": order.xanax_reward,  # Store primary payout
+        "payout_xanax": order.xanax_reward,
+        "payout_edvds": order.edvds_reward,
+        "payout_ecstasy": order.ecstasy_reward,
+        "payout_details": f"{order.xanax_reward} Xanax, {order.edvds_reward} eDVDs, {order.ecstasy_reward} Ecstasy",
+    }
+
+
+def confirm_overdoses(db, User, Order, Overdose, overdose_ids, notes: str = "", now=None) -> dict:
+    """
+    Confirm unconfirmed overdoses and pay them from each user's active cover.
+    Returns {"confirmed": {id: payout_details}, "skipped": {id: reason}} where
+    reason is 'not_found', 'already_confirmed' or 'no_active_cover'.
+    """
+    now = now or datetime.utcnow()
+    ids = sorted({int(i) for i in overdose_ids})
+    confirmed, skipped = {}, {}
+    if not ids:
+        return {"confirmed": confirmed, "skipped": skipped}
+
+    overdoses = {o.id: o for o in Overdose.query.filter(Overdose.id.in_(ids)).with_for_update().all()}
+    for overdose_id in ids:
+        overdose = overdoses.get(overdose_id)
+        if overdose is None:
+            skipped[overdose_id] = 'not_found'
+        elif overdose.confirmed:
+            skipped[overdose_id] = 'already_confirmed'
+    to_confirm = [overdoses[i] for i in ids if i not in skipped]
+
+    # Active covers for every (user, coverage type) involved, in one query
+    keys = {(o.user_id, o.coverage_type) for o in to_confirm}
+    active = {}
+    if keys:
+        for order in (
+            Order.query
+            .filter(Order.status == 'active', tuple_(Order.user_id, Order.coverage_type).in_(keys))
+            .order_by(Order.id)
+        ):
+            active.setdefault((order.user_id, order.coverage_type), order)
+
+    xan_users = set()
+    for overdose in to_confirm:
+        order = active.get((overdose.user_id, overdose.coverage_type))
+        if order is None:
+            skipped[overdose.id] = 'no_active_cover'
+            continue
+
+        for column, value in payout_for(order).items():
+            setattr(overdose, column, value)
+        overdose.confirmed = True
+        overdose.confirmed_at = now
+        overdose.notes = notes
+
+        if overdose.coverage_type == 'EXTC':
+            # Move EXTC order to expired so user can place a new one
+            order.status = 'expired'
+        else:
+            xan_users.add(overdose.user_id)
+        confirmed[overdose.id] = overdose.payout_details
+
+    if xan_users:
+        # XAN cooldown, read by check_eligibility
+        db.session.execute(
+            db.update(User).where(User.id.in_(xan_users)).values(next_xan_report_at=now + XAN_REPORT_COOLDOWN)
+        )
+
+    db.session.commit()
+    return {"confirmed": confirmed, "skipped": skipped}
+
+
+def payout_sheet(db, User, Overdose, since=None, until=None, overdose_ids=None) -> list:
+    """Confirmed payouts totalled per user (by confirmation time, or for specific overdoses)"""
+    query = (
+        db.session.query(
+            User.torn_user_id,
+            User.torn_name,
+            func.count(Overdose.id).label("overdoses"),
+            func.coalesce(func.sum(Overdose.payout_xanax), 0).label("xanax"),
+            func.coalesce(func.sum(Overdose.payout_edvds), 0).label("edvds"),
+            func.coalesce(func.sum(Overdose.payout_ecstasy), 0).label("ecstasy"),
+        )
+        .join(User, User.id == Overdose.user_id)
+        .filter(Overdose.confirmed.is_(True))
+    )
+    if overdose_ids is not None:
+        query = query.filter(Overdose.id.in_(list(overdose_ids)))
+    if since is not None:
+        query = query.filter(Overdose.confirmed_at >= since)
+    if until is not None:
+        query = query.filter(Overdose.confirmed_at < until)
+
+    rows = query.group_by(User.torn_user_id, User.torn_name).order_by(User.torn_name).all()
+    return [
+        {
+            "torn_user_id": row.torn_user_id,
+            "torn_name": row.torn_name,
+            "overdoses": row.overdoses,
+            "xanax": int(row.xanax),
+            "edvds": int(row.edvds),
+            "ecstasy": int(row.ecstasy),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,214 @@
+"""
+Overdose auto-detection from members' own Torn events.
+
+Members opt in at login, which stores their key. Each pass reads only the
+users that have active coverage, an opt-in and a key, so the work grows with
+active covers, not with all users. Their events are fetched concurrently by a
+bounded thread pool. Each key is rate limited on its own, well under Torn's
+per-user limit, and a key over its budget waits for a later pass.
+
+An overdose event newer than the user's events_cursor becomes an unconfirmed
+Overdose row, but only if a manual report would be accepted and it happened
+after the covering order was activated. Cursors only move for users with
+active coverage, so the first pass after a purchase reads back over the gap. That row lands in
+the same confirmation queue as self-reports. The threads only do HTTP; every
+database read and write happens on the calling thread.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+
+from services.order_verification import iter_events
+from services.overdose_eligibility import eligibility_columns, eligibility_from_row
+from services.torn_client import CircuitBreaker, TornAPIError, TornUnavailable, fetch_events
+
+POLL_WORKERS = int(os.environ.get("OVERDOSE_POLL_WORKERS", "8"))
+# Torn allows 100 calls a minute per player across all their keys and tools; take a sliver
+KEY_CALLS_PER_MINUTE = float(os.environ.get("OVERDOSE_POLL_KEY_CALLS_PER_MINUTE", "2"))
+
+AUTO_DETECTED_NOTE = "Auto-detected from Torn events"
+
+_OVERDOSE_RE = re.compile(r'overdos', re.IGNORECASE)
+_DRUGS = (('XAN', re.compile(r'xanax', re.IGNORECASE)), ('EXTC', re.compile(r'ecstasy', re.IGNORECASE)))
+
+logger = logging.getLogger("hjs.overdose_poller")
+
+
+class KeyRateLimiter:
+    """Token bucket per API key; acquire() never blocks, it just says no"""
+
+    def __init__(self, per_minute: float = KEY_CALLS_PER_MINUTE, burst: float = 1.0):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}  # key digest -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, api_key: str) -> bool:
+        digest = hashlib.sha256(api_key.encode()).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(digest, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self._buckets[digest] = (tokens, now)
+                return False
+            self._buckets[digest] = (tokens - 1, now)
+            return True
+
+
+key_limiter = KeyRateLimiter()
+# Members' keys fail for reasons of their own; keep that away from the breaker login and payments use
+poll_breaker = CircuitBreaker("torn-overdose-poll")
+
+
+def parse_overdose_event(entry: dict):
+    """(coverage_type, timestamp) for a Torn overdose event, or None"""
+    text = entry.get('event', '') or entry.get('log', '')
+    timestamp = entry.get('timestamp')
+    if not isinstance(text, str) or not isinstance(timestamp, (int, float)) or not _OVERDOSE_RE.search(text):
+        return None
+    for coverage_type, drug in _DRUGS:
+        if drug.search(text):
+            return coverage_type, int(timestamp)
+    return None
+
+
+def find_candidates(db, User, Order) -> list:
+    """(user_id, api_key, events_cursor) for opted-in users with any active coverage"""
+    has_active = exists().where(Order.user_id == User.id, Order.status == 'active')
+    return db.session.execute(
+        select(User.id, User.api_key, User.events_cursor)
+        .where(User.overdose_autodetect.is_(True), User.api_key.isnot(None), has_active)
+        .order_by(User.id)
+    ).all()
+
+
+def _fetch(api_key: str, since):
+    """(events, error kind) - runs on a pool thread, so no database access here"""
+    try:
+        return fetch_events(api_key, since=since, circuit=poll_breaker), None
+    except TornAPIError as e:
+        return None, "rejected" if e.key_rejected else "failed"
+    except TornUnavailable:
+        return None, "unavailable"
+    except Exception as e:
+        # SECURITY: request errors embed the URL, which carries the key
+        logger.warning("Overdose poll fetch failed: %s", type(e).__name__)
+        return None, "failed"
+
+
+def poll_overdoses(db, User, Order, Overdose, limiter=None, workers: int = POLL_WORKERS) -> dict:
+    """One pass over opted-in users with active coverage"""
+    limiter = limiter or key_limiter
+    counts = {"polled": 0, "rate_limited": 0, "failed": 0, "disabled": 0, "detected": 0, "ineligible": 0}
+
+    candidates = find_candidates(db, User, Order)
+    due = []
+    for row in candidates:
+        if limiter.acquire(row.api_key):
+            due.append(row)
+        else:
+            counts["rate_limited"] += 1
+    # Release the read transaction before the (slow) HTTP calls
+    db.session.commit()
+    if not due:
+        return counts
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(due))), thread_name_prefix="od-poll") as pool:
+        results = list(pool.map(lambda row: _fetch(row.api_key, row.events_cursor), due))
+
+    cursors = {}
+    detections = {}  # (user_id, coverage_type) -> new overdose timestamps
+    rejected = []
+    for row, (events, error) in zip(due, results):
+        if error == "rejected":
+            rejected.append(row.id)
+            continue
+        if error:
+            counts["failed"] += 1
+            continue
+        counts["polled"] += 1
+
+        cursor = row.events_cursor or 0
+        newest = cursor
+        for _, entry in iter_events(events):
+            timestamp = entry.get('timestamp')
+            if isinstance(timestamp, (int, float)):
+                newest = max(newest, int(timestamp))
+            found = parse_overdose_event(entry)
+            if found and found[1] > cursor:
+                detections.setdefault((row.id, found[0]), []).append(found[1])
+        if newest > cursor:
+            cursors[row.id] = newest
+
+    if rejected:
+        # The key was revoked or downgraded; the member can opt in again at login
+        db.session.execute(db.update(User).where(User.id.in_(rejected)).values(overdose_autodetect=False))
+        counts["disabled"] = len(rejected)
+    if cursors:
+        db.session.execute(
+            db.update(User),
+            [{"id": user_id, "events_cursor": cursor} for user_id, cursor in cursors.items()],
+        )
+    db.session.commit()
+
+    if detections:
+        created, ineligible = _record_detections(db, User, Order, Overdose, detections)
+        counts["detected"] = created
+        counts["ineligible"] = ineligible
+    return counts
+
+
+def _record_detections(db, User, Order, Overdose, detections: dict) -> tuple:
+    """Create unconfirmed Overdose rows where a manual report would be accepted"""
+    now = datetime.utcnow()
+    user_ids = {user_id for user_id, _ in detections}
+    rows = db.session.execute(
+        select(User.id, *eligibility_columns(User, Order, Overdose)).where(User.id.in_(user_ids))
+    ).all()
+    eligibility = {row.id: eligibility_from_row(row, now) for row in rows}
+    # Activation of the order each report would be checked against; earlier overdoses aren't covered
+    order_ids = {
+        (row.id, coverage_type): order_id
+        for row in rows
+        for coverage_type, order_id in (('XAN', row.xan_order_id), ('EXTC', row.extc_order_id))
+        if order_id is not None
+    }
+    activated = dict(db.session.execute(
+        select(Order.id, Order.activated_at).where(Order.id.in_(set(order_ids.values())))
+    ).all()) if order_ids else {}
+
+    created = ineligible = 0
+    for (user_id, coverage_type), timestamps in sorted(detections.items()):
+        e = eligibility.get(user_id)
+        prefix = "xan" if coverage_type == 'XAN' else "extc"
+        activated_at = activated.get(order_ids.get((user_id, coverage_type)))
+        happened = (datetime.utcfromtimestamp(timestamp) for timestamp in timestamps)
+        covered = [at for at in happened if activated_at is None or at >= activated_at]
+        if not e or not e[f"has_{prefix}"] or not e[f"can_report_{prefix}"] or e[f"{prefix}_pending"] or not covered:
+            ineligible += 1
+            continue
+        reported_at = min(covered)
+
+        db.session.add(Overdose(
+            user_id=user_id,
+            coverage_type=coverage_type,
+            reported_at=reported_at,
+            notes=AUTO_DETECTED_NOTE,
+        ))
+        try:
+            db.session.commit()
+            created += 1
+        except IntegrityError:
+            # ux_overdose_pending_report: the member reported it by hand meanwhile
+            db.session.rollback()
+            ineligible += 1
+    return created, ineligible
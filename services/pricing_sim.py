@@ -0,0 +1,307 @@
+"""
+Monte Carlo pricing risk simulator.
+
+History comes from the daily Rollup rows (services/rollups.py): paid orders
+and confirmed overdoses per day, coverage type and tier. These are loaded
+once into a (days x tiers) NumPy matrix and refreshed every few minutes.
+
+Each simulation run:
+- draws a horizon of days from history with replacement, which gives the
+  order volume per tier
+- draws each tier's overdose rate from a Gamma posterior (a Poisson rate
+  shrunk toward the coverage type's pooled rate, so thin tiers aren't taken
+  at face value)
+- draws the claim counts
+
+Order volumes and claims don't depend on price, since no elasticity is
+modelled. Every candidate price set is therefore scored against the same
+draws with two matrix products. That makes hundreds of candidates about as
+cheap as one, and keeps the comparison between them free of sampling noise.
+
+Profit is in Xanax: premiums minus Xanax rewards. eDVDs and Ecstasy count
+at the `item_values` given (default 0, i.e. reported but not priced).
+The history arrays and the results live in the shared cache
+(services/cache.py); results are keyed by a hash of the price sets, the
+parameters and the loaded history.
+"""
+import hashlib
+import itertools
+import json
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from services.cache import get_cache
+
+LOOKBACK_DAYS = 90
+HISTORY_TTL_SECONDS = 300
+DEFAULT_SIMULATIONS = 10000
+DEFAULT_HORIZON_DAYS = 30
+MAX_SIMULATIONS = 100000
+MAX_CANDIDATES = 1000
+GRID_BLOCK = 100  # candidates scored per matrix product, bounds memory at simulations x GRID_BLOCK
+SAMPLE_BLOCK = 2_000_000  # history cells (simulations x days x tiers) gathered per step when drawing volumes
+PRIOR_STRENGTH = 20.0  # pseudo-orders behind the pooled overdose rate
+RESULT_TTL_SECONDS = 3600
+HISTORY_NAMESPACE = "pricing_history"
+RESULT_NAMESPACE = "pricing_sim"
+
+PRICE_FIELDS = ("cost", "xanax_reward", "edvds_reward", "ecstasy_reward")
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+class PricingHistory:
+    """Daily paid orders and confirmed overdoses per tier, as columnar arrays"""
+
+    def __init__(self, Rollup, lookback_days: int = LOOKBACK_DAYS, ttl: float = HISTORY_TTL_SECONDS):
+        self.Rollup = Rollup
+        self.lookback_days = lookback_days
+        self.ttl = ttl
+        self.tiers = []  # [(coverage_type, tier)], column order of the arrays
+        self.orders = np.zeros((0, 0))  # days x tiers
+        self.overdoses = np.zeros((0, 0))
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> tuple:
+        start = (datetime.utcnow() - timedelta(days=self.lookback_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        rows = (
+            self.Rollup.query
+            .with_entities(self.Rollup.bucket_start, self.Rollup.coverage_type, self.Rollup.tier,
+                           self.Rollup.orders, self.Rollup.overdoses)
+            .filter(self.Rollup.granularity == 'day', self.Rollup.bucket_start >= start, self.Rollup.tier > 0)
+            .all()
+        )
+
+        tiers = sorted({(coverage_type, tier) for _, coverage_type, tier, _, _ in rows})
+        column = {key: i for i, key in enumerate(tiers)}
+        # Days without any rollup row are real zero-volume days and stay in the sample
+        orders = np.zeros((self.lookback_days + 1, len(tiers)))
+        overdoses = np.zeros_like(orders)
+        for bucket_start, coverage_type, tier, order_count, overdose_count in rows:
+            day = min((bucket_start - start).days, self.lookback_days)
+            orders[day, column[(coverage_type, tier)]] += order_count
+            overdoses[day, column[(coverage_type, tier)]] += overdose_count
+
+        digest = hashlib.sha256(repr(tiers).encode())
+        digest.update(orders.tobytes())
+        digest.update(overdoses.tobytes())
+        return tiers, orders, overdoses, digest.hexdigest()[:16]
+
+    def _apply(self, loaded: tuple):
+        with self._lock:
+            self.tiers, self.orders, self.overdoses, self.version = loaded
+
+    def refresh(self):
+        """Reload from the Rollup table and share the result; needs an app context"""
+        loaded = self._load()
+        get_cache().set(HISTORY_NAMESPACE, str(self.lookback_days), loaded, ttl=self.ttl)
+        self._apply(loaded)
+
+    def ensure_fresh(self):
+        """Arrays from the shared cache, loaded from the Rollup table at most once per TTL"""
+        self._apply(get_cache().get_or_set(HISTORY_NAMESPACE, str(self.lookback_days), self._load, ttl=self.ttl))
+
+    def rate_posterior(self):
+        """(shape, rate) of each tier's Gamma posterior for overdoses per paid order"""
+        orders = self.orders.sum(axis=0)
+        overdoses = self.overdoses.sum(axis=0)
+        prior_mean = np.zeros(len(self.tiers))
+        for coverage_type in {c for c, _ in self.tiers}:
+            mask = np.array([c == coverage_type for c, _ in self.tiers])
+            pooled_orders = orders[mask].sum()
+            prior_mean[mask] = overdoses[mask].sum() / pooled_orders if pooled_orders else 0.0
+        return PRIOR_STRENGTH * prior_mean + overdoses, PRIOR_STRENGTH + orders
+
+    def cached(self, key, compute):
+        return get_cache().get_or_set(RESULT_NAMESPACE, key, compute, ttl=RESULT_TTL_SECONDS)
+
+
+def get_pricing_history(Rollup) -> PricingHistory:
+    """Process-wide history for this Rollup model"""
+    with _models_lock:
+        history = _models.get(Rollup)
+        if history is None:
+            history = _models[Rollup] = PricingHistory(Rollup)
+        return history
+
+
+def current_prices(PricingConfig) -> dict:
+    """{(coverage_type, duration): {cost, xanax_reward, edvds_reward, ecstasy_reward}} for active tiers"""
+    prices = {}
+    for p in PricingConfig.query.filter_by(active=True).order_by(PricingConfig.id):
+        prices[(p.coverage_type, p.duration)] = {field: getattr(p, field) or 0 for field in PRICE_FIELDS}
+    return prices
+
+
+def _tier_key(item):
+    if not isinstance(item, dict):
+        raise ValueError("Each tier must be an object with coverage_type and duration")
+    coverage_type = str(item.get("coverage_type") or "").upper()
+    if coverage_type not in ("XAN", "EXTC"):
+        raise ValueError("coverage_type must be XAN or EXTC")
+    try:
+        return coverage_type, int(item["duration"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("duration must be an integer")
+
+
+def _price(value, field):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be an integer")
+    if value < 0:
+        raise ValueError(f"{field} must not be negative")
+    return value
+
+
+def expand_candidates(base: dict, candidates=None, grid=None) -> list:
+    """
+    Price sets to score, each a full {(type, duration): prices} dict.
+    `candidates`: list of price sets, each a list of
+        {coverage_type, duration, cost?, xanax_reward?, edvds_reward?, ecstasy_reward?}
+    `grid`: list of {coverage_type, duration, <field>: [values...]}; every combination is a candidate
+    Unspecified tiers and fields keep their current (`base`) prices.
+    """
+    price_sets = []
+    for candidate in candidates or []:
+        if not isinstance(candidate, list):
+            raise ValueError("Each candidate must be a list of tiers")
+        prices = {key: dict(value) for key, value in base.items()}
+        for item in candidate:
+            key = _tier_key(item)
+            prices.setdefault(key, dict.fromkeys(PRICE_FIELDS, 0))
+            for field in PRICE_FIELDS:
+                if field in item:
+                    prices[key][field] = _price(item[field], field)
+        price_sets.append(prices)
+
+    if grid:
+        if not isinstance(grid, list):
+            raise ValueError("grid must be a list of tiers")
+        axes = []
+        for item in grid:
+            key = _tier_key(item)
+            for field in PRICE_FIELDS:
+                values = item.get(field)
+                if values is None:
+                    continue
+                values = values if isinstance(values, list) else [values]
+                axes.append([(key, field, _price(v, field)) for v in values])
+        combinations = 1
+        for axis in axes:
+            combinations *= len(axis)
+        if combinations > MAX_CANDIDATES:
+            raise ValueError(f"Grid has {combinations} combinations; at most {MAX_CANDIDATES}")
+        for combination in itertools.product(*axes):
+            prices = {key: dict(value) for key, value in base.items()}
+            for key, field, value in combination:
+                prices.setdefault(key, dict.fromkeys(PRICE_FIELDS, 0))[field] = value
+            price_sets.append(prices)
+
+    if not price_sets:
+        price_sets.append(base)
+    if len(price_sets) > MAX_CANDIDATES:
+        raise ValueError(f"At most {MAX_CANDIDATES} candidates per simulation")
+    return price_sets
+
+
+def _canonical(price_set: dict) -> list:
+    return [[coverage_type, duration, [prices[f] for f in PRICE_FIELDS]]
+            for (coverage_type, duration), prices in sorted(price_set.items())]
+
+
+def simulate(history: PricingHistory, price_sets: list, simulations: int = DEFAULT_SIMULATIONS,
+             horizon_days: int = DEFAULT_HORIZON_DAYS, item_values: dict = None) -> dict:
+    """Score every price set over the same simulated horizons. Cached per (history, inputs)"""
+    simulations = max(100, min(int(simulations), MAX_SIMULATIONS))
+    horizon_days = max(1, min(int(horizon_days), 365))
+    item_values = {"edvds": float((item_values or {}).get("edvds", 0)),
+                   "ecstasy": float((item_values or {}).get("ecstasy", 0))}
+
+    history.ensure_fresh()
+    payload = json.dumps([history.version, simulations, horizon_days, item_values,
+                          [_canonical(p) for p in price_sets]], sort_keys=True)
+    key = hashlib.sha256(payload.encode()).hexdigest()
+    return history.cached(key, lambda: _run(history, price_sets, simulations, horizon_days, item_values, key))
+
+
+def _run(history, price_sets, simulations, horizon_days, item_values, key) -> dict:
+    tiers = history.tiers
+    # Same seed for the same inputs: reruns and cache misses give identical numbers
+    rng = np.random.default_rng(int(key[:16], 16))
+
+    if tiers:
+        # Drawn a few horizon days at a time; the full simulations x horizon x tiers gather
+        # would run to gigabytes at the limits
+        volumes = np.zeros((simulations, len(tiers)))
+        step = max(1, SAMPLE_BLOCK // (simulations * len(tiers)))
+        for start in range(0, horizon_days, step):
+            days = rng.integers(0, history.orders.shape[0], size=(simulations, min(step, horizon_days - start)))
+            volumes += history.orders[days].sum(axis=1)
+        shape, rate = history.rate_posterior()
+        rates = rng.gamma(np.maximum(shape, 1e-9), 1.0 / rate, size=(simulations, len(tiers)))
+        claims = rng.poisson(rates * volumes).astype(float)
+    else:
+        volumes = claims = np.zeros((simulations, 0))
+
+    # tiers x candidates; tiers without history contribute nothing
+    costs = np.array([[p.get(t, {}).get("cost", 0) for p in price_sets] for t in tiers], dtype=float).reshape(len(tiers), len(price_sets))
+    def payout_value(prices):
+        return (prices.get("xanax_reward", 0)
+                + prices.get("edvds_reward", 0) * item_values["edvds"]
+                + prices.get("ecstasy_reward", 0) * item_values["ecstasy"])
+
+    payouts = np.array([[payout_value(p.get(t, {})) for p in price_sets] for t in tiers], dtype=float).reshape(len(tiers), len(price_sets))
+    tail = max(1, simulations // 20)
+
+    results = []
+    for start in range(0, len(price_sets), GRID_BLOCK):
+        block = slice(start, start + GRID_BLOCK)
+        premiums = volumes @ costs[:, block]  # simulations x block
+        paid = claims @ payouts[:, block]
+        profit = premiums - paid
+        ordered = np.sort(profit, axis=0)
+        mean_premiums = premiums.mean(axis=0)
+        stats = {
+            "expected_profit": profit.mean(axis=0),
+            "profit_std": profit.std(axis=0),
+            "profit_p5": ordered[tail - 1],
+            "profit_p1": ordered[max(1, simulations // 100) - 1],
+            "cvar_5": ordered[:tail].mean(axis=0),
+            "probability_of_loss": (profit < 0).mean(axis=0),
+            "expected_premiums": mean_premiums,
+            "expected_payouts": paid.mean(axis=0),
+        }
+        for i in range(profit.shape[1]):
+            row = {name: round(float(values[i]), 4) for name, values in stats.items()}
+            row["loss_ratio"] = round(row["expected_payouts"] / row["expected_premiums"], 4) if row["expected_premiums"] else None
+            results.append(row)
+
+    for price_set, row in zip(price_sets, results):
+        row["prices"] = [
+            {"coverage_type": coverage_type, "duration": duration, **prices}
+            for (coverage_type, duration), prices in sorted(price_set.items())
+        ]
+
+    known = set(tiers)
+    return {
+        "simulations": simulations,
+        "horizon_days": horizon_days,
+        "history_days": int(history.orders.shape[0]),
+        "history_version": history.version,
+        "tiers": [
+            {"coverage_type": c, "duration": d, "orders": int(o), "overdoses": int(x),
+             "overdose_rate": round(float(s / r), 4)}
+            for (c, d), o, x, s, r in zip(tiers, history.orders.sum(axis=0), history.overdoses.sum(axis=0),
+                                          *history.rate_posterior())
+        ],
+        "tiers_without_history": sorted(
+            {f"{c} {d}" for price_set in price_sets for (c, d) in price_set if (c, d) not in known}
+        ),
+        "results": results,
+    }
@@ -0,0 +1,367 @@
+"""
+Offline replay of Torn event dumps against the Order table.
+
+For when the verifier was down, or only saw the latest events: a dump (JSONL,
+or a JSON events payload of any size) is streamed from disk, parsed in chunks
+across a process pool with the same parse_payment_event rules the verifier
+uses, and reconciled against every order:
+
+- paid_not_activated: pending orders a payment in the dump pays for
+- unmatched_payments: payments that match no pending order
+- double_payments: unmatched payments whose (sender, type, amount) matches an
+  order that was already paid
+- duplicate_events: payment events seen more than once in the dump (kept once)
+
+Payments already recorded in the PaymentMatch ledger are skipped, so replaying
+the same dump twice is harmless. apply_fixes() activates the paid orders in
+batches, writing ledger rows in the same transaction as each batch.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from services.order_verification import (
+    MESSAGE_CODES, activate_order, consumed_event_ids, match_pending_orders, parse_payment_event, record_payment,
+)
+
+CHUNK_SIZE = 5000
+APPLY_BATCH_SIZE = 500
+READ_SIZE = 1 << 20
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class _JSONStream:
+    """Just enough of an incremental JSON reader to walk one container without loading the file"""
+
+    def __init__(self, fp, read_size=READ_SIZE):
+        self.fp = fp
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.fp.read(self.read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ('' at end of file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Malformed JSON dump: expected {char!r} near offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise ValueError("Malformed or truncated JSON dump")
+                continue
+            # A value ending exactly at the buffer edge may continue in the next read
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def members(self, descend: str = None):
+        """(key, value) for the object/array at the cursor; descends into `descend` instead of decoding it"""
+        opening = self.peek()
+        if opening not in "{[":
+            raise ValueError("JSON dump must be an object or a list")
+        closing = "}" if opening == "{" else "]"
+        self.pos += 1
+
+        index = 0
+        while True:
+            if self.peek() == closing:
+                self.pos += 1
+                return
+            if index:
+                self.expect(",")
+            if opening == "{":
+                key = self.value()
+                self.expect(":")
+            else:
+                key = index
+            index += 1
+            if descend is not None and key == descend and self.peek() in "{[":
+                yield from self.members()
+            else:
+                yield key, self.value()
+
+
+def _entries(record, fallback_id):
+    """(event_id, entry) pairs from one dump record: an event, {id: event}, or a Torn {"events": ...} response"""
+    if not isinstance(record, dict):
+        return
+    events = record.get("events")
+    if isinstance(events, dict):
+        yield from events.items()
+    elif isinstance(events, list):
+        for index, entry in enumerate(events):
+            if isinstance(entry, dict):
+                yield entry.get("id", f"{fallback_id}-{index}"), entry
+    elif "timestamp" in record:
+        yield record.get("id", record.get("event_id", fallback_id)), record
+    else:
+        for key, entry in record.items():
+            if isinstance(entry, dict):
+                yield key, entry
+
+
+def _parse_items(items):
+    """Process-pool worker: parse (event_id, entry) pairs. Returns (events_seen, payments)"""
+    payments = []
+    seen = 0
+    for event_id, entry in items:
+        if not isinstance(entry, dict):
+            continue
+        seen += 1
+        payment = parse_payment_event(str(event_id), entry)
+        if payment:
+            payments.append(payment)
+    return seen, payments
+
+
+def _parse_lines(lines):
+    """Process-pool worker: decode and parse a chunk of JSONL lines. Returns (events_seen, payments, bad_lines)"""
+    items = []
+    bad = 0
+    for line_number, line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            bad += 1
+            continue
+        items.extend(_entries(record, f"line-{line_number}"))
+    seen, payments = _parse_items(items)
+    return seen, payments, bad
+
+
+def _chunks(fp, fmt, chunk_size):
+    """(worker, chunk) tuples from the dump, chunk_size lines/events each"""
+    if fmt == "jsonl":
+        chunk = []
+        for line_number, line in enumerate(fp, start=1):
+            if line.strip():
+                chunk.append((line_number, line))
+            if len(chunk) >= chunk_size:
+                yield _parse_lines, chunk
+                chunk = []
+        if chunk:
+            yield _parse_lines, chunk
+        return
+
+    chunk = []
+    for key, value in _JSONStream(fp).members(descend="events"):
+        if isinstance(value, dict) and "timestamp" in value:
+            chunk.append((value.get("id", key), value))
+        if len(chunk) >= chunk_size:
+            yield _parse_items, chunk
+            chunk = []
+    if chunk:
+        yield _parse_items, chunk
+
+
+def read_payments(path: str, fmt: str = None, workers: int = None, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Stream the dump and parse it across `workers` processes (None: one per CPU,
+    0: in this process). Returns {"payments": [...], "events_read", "bad_lines",
+    "duplicate_events"}; payments are unique by event id, first occurrence kept.
+    """
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "json")
+    stats = {"events_read": 0, "bad_lines": 0, "duplicate_events": 0}
+    payments = {}
+
+    def collect(result):
+        stats["events_read"] += result[0]
+        if len(result) > 2:
+            stats["bad_lines"] += result[2]
+        for payment in result[1]:
+            if payment["event_id"] in payments:
+                stats["duplicate_events"] += 1
+            else:
+                payments[payment["event_id"]] = payment
+
+    with open(path, encoding="utf-8") as fp:
+        if workers == 0:
+            for func, chunk in _chunks(fp, fmt, chunk_size):
+                collect(func(chunk))
+        else:
+            workers = workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                # Bounded number of chunks in flight so a large dump never sits in memory
+                in_flight = []
+                limit = workers * 2
+                for func, chunk in _chunks(fp, fmt, chunk_size):
+                    in_flight.append(pool.submit(func, chunk))
+                    if len(in_flight) >= limit:
+                        collect(in_flight.pop(0).result())
+                for future in in_flight:
+                    collect(future.result())
+
+    stats["payments"] = sorted(payments.values(), key=lambda p: (p["timestamp"], p["event_id"]))
+    return stats
+
+
+def _coverage_type(payment):
+    return "XAN" if payment["message_code"] == MESSAGE_CODES["XAN"] else "EXTC"
+
+
+def reconcile(db, User, Order, PaymentMatch, payments: list, directory=None) -> dict:
+    """Compare parsed payments with every order; read-only"""
+    consumed = consumed_event_ids(PaymentMatch, [p["event_id"] for p in payments])
+    fresh = [p for p in payments if p["event_id"] not in consumed]
+
+    pending = (
+        Order.query.options(joinedload(Order.user))
+        .filter(Order.status == 'pending', Order.payment_verified.is_(False))
+        .all()
+    )
+    matches = match_pending_orders(pending, fresh, directory)
+
+    covered = set()
+    matched_users = {order.user_id for order in pending if order.id in matches}
+    if matched_users:
+        covered = set(
+            Order.query.with_entities(Order.user_id, Order.coverage_type)
+            .filter(Order.status == 'active', Order.user_id.in_(matched_users))
+            .all()
+        )
+
+    paid_not_activated = []
+    for order in pending:
+        payment = matches.get(order.id)
+        if not payment:
+            continue
+        has_cover = (order.user_id, order.coverage_type) in covered
+        paid_not_activated.append({
+            "order_id": order.id,
+            "torn_user_id": order.user.torn_user_id,
+            "coverage_type": order.coverage_type,
+            "amount": order.xanax_payment,
+            "event_id": payment["event_id"],
+            "paid_at": payment["timestamp"].isoformat(),
+            "fixable": not has_cover,
+            "reason": "user already has active cover of this type" if has_cover else None,
+        })
+
+    used = {payment["event_id"] for payment in matches.values()}
+    leftover = []
+    for payment in fresh:
+        if payment["event_id"] in used:
+            continue
+        sender = payment["sender_torn_id"]
+        if sender is None and directory is not None:
+            sender = directory.resolve(payment["sender_name"])
+        leftover.append((payment, sender))
+
+    # Leftovers from someone who already has a paid order of the same type and amount
+    senders = {sender for _, sender in leftover if sender is not None}
+    paid_keys = {}
+    if senders:
+        for order_id, torn_user_id, coverage_type, amount in (
+            db.session.query(Order.id, User.torn_user_id, Order.coverage_type, Order.xanax_payment)
+            .join(User, User.id == Order.user_id)
+            .filter(User.torn_user_id.in_(senders), Order.payment_verified.is_(True))
+            .order_by(Order.id)
+        ):
+            paid_keys[(torn_user_id, coverage_type, amount)] = order_id
+
+    unmatched, double_payments = [], []
+    for payment, sender in leftover:
+        row = {
+            "event_id": payment["event_id"],
+            "torn_user_id": sender,
+            "sender_name": payment["sender_name"],
+            "coverage_type": _coverage_type(payment),
+            "amount": payment["quantity"],
+            "paid_at": payment["timestamp"].isoformat(),
+        }
+        paid_order = paid_keys.get((sender, row["coverage_type"], row["amount"]))
+        if paid_order:
+            double_payments.append(dict(row, paid_order_id=paid_order))
+        else:
+            unmatched.append(row)
+
+    return {
+        "payments": len(payments),
+        "already_recorded": len(consumed),
+        "paid_not_activated": paid_not_activated,
+        "unmatched_payments": unmatched,
+        "double_payments": double_payments,
+    }
+
+
+def apply_fixes(db, Order, PaymentMatch, payments: list, report: dict, batch_size: int = APPLY_BATCH_SIZE) -> dict:
+    """
+    Activate the fixable paid_not_activated orders, batch_size per transaction.
+    Each batch re-checks that its orders are still pending; a batch whose event
+    was consumed concurrently is rolled back and the orders it tried to
+    activate are counted as failed (the rest of the batch as skipped).
+    """
+    by_event = {payment["event_id"]: payment for payment in payments}
+    fixes = [row for row in report["paid_not_activated"] if row["fixable"]]
+    activated = failed = 0
+
+    for start in range(0, len(fixes), batch_size):
+        batch = {row["order_id"]: by_event[row["event_id"]] for row in fixes[start:start + batch_size]}
+        orders = (
+            Order.query.options(joinedload(Order.user))
+            .filter(Order.id.in_(batch), Order.status == 'pending', Order.payment_verified.is_(False))
+            .all()
+        )
+        covered = set(
+            Order.query.with_entities(Order.user_id, Order.coverage_type)
+            .filter(Order.status == 'active', Order.user_id.in_({o.user_id for o in orders}))
+            .all()
+        ) if orders else set()
+
+        done = 0
+        for order in orders:
+            if (order.user_id, order.coverage_type) in covered:
+                continue
+            payment = batch[order.id]
+            activate_order(order, payment["timestamp"])
+            db.session.add(record_payment(PaymentMatch, order, payment))
+            covered.add((order.user_id, order.coverage_type))
+            done += 1
+        try:
+            db.session.commit()
+            activated += done
+        except IntegrityError:
+            db.session.rollback()
+            failed += done
+
+    return {"activated": activated, "failed": failed, "skipped": len(fixes) - activated - failed}
+
+
+def summarize(report: dict) -> dict:
+    """Counts only, for printing"""
+    return {key: len(value) if isinstance(value, list) else value for key, value in report.items()}
+
+
+def to_json(report: dict) -> str:
+    return json.dumps(report, indent=2, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v))
@@ -0,0 +1,196 @@
+"""
+Hourly and daily business rollups: premiums, payouts, orders, overdoses and
+loss ratio per coverage type and pricing tier.
+
+Premiums are counted when an order is activated (Order.activated_at), payouts
+when an overdose is confirmed (Overdose.confirmed_at). Both are written at
+"now", so the scheduler only has to recompute a trailing window
+(refresh_recent) to keep the table current. Anything that rewrites older
+history, such as deleting a confirmed overdose or backfilling activations,
+needs `manage.py rebuild-rollups`.
+
+Hourly rows are aggregated from raw rows in SQL, and daily rows are summed
+from the hourly ones. Reads (rollup_series/rollup_totals) only touch the
+Rollup table, so their cost grows with the number of buckets, not the
+history.
+
+Loss ratio is Xanax paid out / Xanax collected. eDVDs and Ecstasy have no
+Xanax price, so they are reported next to it rather than folded in.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+GRANULARITIES = ("hour", "day")
+REFRESH_WINDOW = timedelta(days=2)
+METRICS = ("orders", "premiums", "overdoses", "payout_xanax", "payout_edvds", "payout_ecstasy")
+
+
+def _hour_bucket(db, column):
+    if db.engine.dialect.name == "postgresql":
+        return func.date_trunc("hour", column)
+    return func.strftime("%Y-%m-%d %H:00:00", column)
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _day_start(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _hourly(db, Order, Overdose, since, until) -> dict:
+    """{(hour, coverage_type, tier): metrics} from raw orders and overdoses in [since, until)"""
+    buckets = {}
+
+    def bucket(hour, coverage_type, tier):
+        key = (_as_datetime(hour), coverage_type, tier or 0)
+        return buckets.setdefault(key, dict.fromkeys(METRICS, 0))
+
+    order_hour = _hour_bucket(db, Order.activated_at)
+    order_tier = func.coalesce(Order.hours, Order.jumps, 0)
+    orders = (
+        select(order_hour, Order.coverage_type, order_tier, func.count(Order.id), func.sum(Order.xanax_payment))
+        .where(Order.activated_at >= since, Order.activated_at < until, Order.payment_verified.is_(True))
+        .group_by(order_hour, Order.coverage_type, order_tier)
+    )
+    for hour, coverage_type, tier, count, premiums in db.session.execute(orders):
+        row = bucket(hour, coverage_type, tier)
+        row["orders"] += count
+        row["premiums"] += premiums or 0
+
+    # Tier of the cover the overdose was reported under: the user's latest activation before the report
+    overdose_tier = (
+        select(func.coalesce(Order.hours, Order.jumps))
+        .where(
+            Order.user_id == Overdose.user_id,
+            Order.coverage_type == Overdose.coverage_type,
+            Order.activated_at <= Overdose.reported_at,
+        )
+        .order_by(Order.activated_at.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    payouts = (
+        select(
+            _hour_bucket(db, Overdose.confirmed_at).label("hour"),
+            Overdose.coverage_type,
+            overdose_tier.label("tier"),
+            Overdose.payout_xanax,
+            Overdose.payout_edvds,
+            Overdose.payout_ecstasy,
+        )
+        .where(
+            Overdose.confirmed.is_(True),
+            Overdose.confirmed_at >= since,
+            Overdose.confirmed_at < until,
+            Overdose.coverage_type.isnot(None),
+        )
+        .subquery()
+    )
+    grouped = (
+        select(
+            payouts.c.hour, payouts.c.coverage_type, payouts.c.tier, func.count(),
+            func.sum(payouts.c.payout_xanax), func.sum(payouts.c.payout_edvds), func.sum(payouts.c.payout_ecstasy),
+        )
+        .group_by(payouts.c.hour, payouts.c.coverage_type, payouts.c.tier)
+    )
+    for hour, coverage_type, tier, count, xanax, edvds, ecstasy in db.session.execute(grouped):
+        row = bucket(hour, coverage_type, tier)
+        row["overdoses"] += count
+        row["payout_xanax"] += xanax or 0
+        row["payout_edvds"] += edvds or 0
+        row["payout_ecstasy"] += ecstasy or 0
+
+    return buckets
+
+
+def refresh_rollups(db, Order, Overdose, Rollup, since: datetime, until: datetime = None) -> dict:
+    """
+    Recompute every hourly and daily bucket from `since` (rounded down to the
+    day, so daily rows stay complete) to `until` in one transaction
+    """
+    since = _day_start(since)
+    until = until or datetime.utcnow() + timedelta(hours=1)
+    hourly = _hourly(db, Order, Overdose, since, until)
+
+    daily = {}
+    for (hour, coverage_type, tier), metrics in hourly.items():
+        row = daily.setdefault((_day_start(hour), coverage_type, tier), dict.fromkeys(METRICS, 0))
+        for name in METRICS:
+            row[name] += metrics[name]
+
+    now = datetime.utcnow()
+    rows = [
+        dict(granularity=granularity, bucket_start=start, coverage_type=coverage_type, tier=tier,
+             updated_at=now, **metrics)
+        for granularity, buckets in (("hour", hourly), ("day", daily))
+        for (start, coverage_type, tier), metrics in buckets.items()
+    ]
+
+    db.session.execute(
+        db.delete(Rollup).where(Rollup.bucket_start >= since, Rollup.bucket_start < until)
+    )
+    for i in range(0, len(rows), 5000):
+        db.session.execute(db.insert(Rollup), rows[i:i + 5000])
+    db.session.commit()
+    return {"buckets": len(rows)}
+
+
+def refresh_recent(db, Order, Overdose, Rollup, window: timedelta = REFRESH_WINDOW) -> dict:
+    """Scheduler entry point: recompute the trailing window"""
+    return refresh_rollups(db, Order, Overdose, Rollup, datetime.utcnow() - window)
+
+
+def rebuild_rollups(db, Order, Overdose, Rollup) -> dict:
+    """Recompute everything from the earliest activation or confirmation"""
+    earliest = [
+        db.session.execute(select(func.min(Order.activated_at))).scalar(),
+        db.session.execute(select(func.min(Overdose.confirmed_at))).scalar(),
+    ]
+    earliest = [moment for moment in earliest if moment is not None]
+    if not earliest:
+        db.session.execute(db.delete(Rollup))
+        db.session.commit()
+        return {"buckets": 0}
+    # Older buckets can't have data, but may be left over from deleted rows
+    db.session.execute(db.delete(Rollup).where(Rollup.bucket_start < _day_start(min(earliest))))
+    return refresh_rollups(db, Order, Overdose, Rollup, min(earliest))
+
+
+def loss_ratio(premiums, payout_xanax):
+    return round(payout_xanax / premiums, 4) if premiums else None
+
+
+def rollup_series(Rollup, granularity: str = "day", since: datetime = None, until: datetime = None,
+                  coverage_type: str = None) -> list:
+    """Bucket rows (one per bucket, coverage type and tier), oldest first"""
+    query = Rollup.query.filter(Rollup.granularity == granularity)
+    if since is not None:
+        query = query.filter(Rollup.bucket_start >= since)
+    if until is not None:
+        query = query.filter(Rollup.bucket_start < until)
+    if coverage_type:
+        query = query.filter(Rollup.coverage_type == coverage_type)
+
+    series = []
+    for row in query.order_by(Rollup.bucket_start, Rollup.coverage_type, Rollup.tier):
+        item = {"bucket_start": row.bucket_start.isoformat(), "coverage_type": row.coverage_type, "tier": row.tier}
+        item.update({name: getattr(row, name) for name in METRICS})
+        item["loss_ratio"] = loss_ratio(row.premiums, row.payout_xanax)
+        series.append(item)
+    return series
+
+
+def rollup_totals(series: list) -> list:
+    """Totals per coverage type and tier over a series"""
+    totals = {}
+    for item in series:
+        row = totals.setdefault((item["coverage_type"], item["tier"]), dict.fromkeys(METRICS, 0))
+        for name in METRICS:
+            row[name] += item[name]
+    return [
+        dict(coverage_type=coverage_type, tier=tier, loss_ratio=loss_ratio(row["premiums"], row["payout_xanax"]), **row)
+        for (coverage_type, tier), row in sorted(totals.items())
+    ]
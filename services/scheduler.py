@@ -0,0 +1,240 @@
+"""
+Periodic task scheduler - each task registers with its own interval, jitter,
+timeout and overrun policy, and every run is recorded in TaskRun.
+
+    scheduler = Scheduler(app, db, TaskRun)
+
+    @scheduler.task("expire", interval=60, timeout=30)
+    def expire():
+        return expire_orders(db, Order)   # dict of counts -> TaskRun.rows
+
+Tasks registered with record_idle=False only record runs that errored or
+touched rows, so frequent polling tasks don't bury the others' history.
+
+Overrun policies:
+    'skip'      don't start a run while the previous one is still going (default)
+    'parallel'  start on schedule regardless
+
+Every replica starts a scheduler process. Given a `Lease` model,
+run_forever only ticks while it holds the single lease row, so one process
+in the deployment runs the tasks. The others stand by and take over within
+LEASE_SECONDS if it dies.
+"""
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from services.sessions import session_scope
+
+OVERRUN_POLICIES = ("skip", "parallel")
+LEASE_NAME = "scheduler"
+LEASE_SECONDS = 30  # a standby takes over this long after the holder stops renewing
+
+
+class PeriodicTask:
+    def __init__(self, name, func, interval, jitter=0.0, timeout=None, overrun="skip", enabled=None,
+                 record_idle=True):
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy: {overrun}")
+        self.name = name
+        self.func = func
+        self.interval = interval  # seconds, or a callable returning seconds (read from settings)
+        self.jitter = jitter  # fraction of the interval, e.g. 0.1 = +/-10%
+        self.timeout = timeout
+        self.overrun = overrun
+        self.enabled = enabled  # optional callable -> bool, checked when the task is due
+        self.record_idle = record_idle  # False: ok runs that touched no rows leave no TaskRun
+        self.next_run = 0.0
+        self.running = []  # [(thread, started_monotonic, TaskRun started_at)]
+        self.timed_out = set()
+
+    def current_interval(self) -> float:
+        interval = self.interval() if callable(self.interval) else self.interval
+        return max(1.0, float(interval))
+
+    def schedule_next(self, now: float):
+        interval = self.current_interval()
+        spread = interval * self.jitter
+        self.next_run = now + interval + (random.uniform(-spread, spread) if spread else 0.0)
+
+
+def _rows_touched(result) -> int:
+    """Sum of the integer counts a task returned"""
+    if isinstance(result, dict):
+        return sum(v for v in result.values() if isinstance(v, int) and not isinstance(v, bool))
+    if isinstance(result, int):
+        return result
+    return 0
+
+
+class Scheduler:
+    def __init__(self, app, db, TaskRun, tick_seconds: float = 1.0, Lease=None):
+        self.app = app
+        self.db = db
+        self.TaskRun = TaskRun
+        self.Lease = Lease
+        self.tick_seconds = tick_seconds
+        self.tasks = {}
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.leading = False
+        self._lease_checked = 0.0
+
+    def task(self, name, interval, jitter=0.0, timeout=None, overrun="skip", enabled=None, record_idle=True):
+        """Decorator registering `func` as a periodic task"""
+        def decorator(func):
+            self.tasks[name] = PeriodicTask(name, func, interval, jitter, timeout, overrun, enabled, record_idle)
+            return func
+        return decorator
+
+    def _record(self, name, started_at, status, rows=0, error=None):
+        finished_at = datetime.utcnow()
+        self.db.session.add(self.TaskRun(
+            task=name,
+            started_at=started_at,
+            finished_at=finished_at,
+            duration_ms=int((finished_at - started_at).total_seconds() * 1000),
+            status=status,
+            rows=rows,
+            error=error[-2000:] if error else None,
+        ))
+        self.db.session.commit()
+
+    def _execute(self, task, started_at):
+        with session_scope(self.app, self.db):
+            try:
+                result = task.func()
+                status, rows, error = "ok", _rows_touched(result), None
+            except Exception:
+                self.db.session.rollback()
+                status, rows, error = "error", 0, traceback.format_exc()
+
+            try:
+                # A run already reported as timed out keeps that status
+                idle = status == "ok" and not rows and not task.record_idle
+                if started_at not in task.timed_out and not idle:
+                    self._record(task.name, started_at, status, rows, error)
+                task.timed_out.discard(started_at)
+            except Exception:
+                self.db.session.rollback()
+
+    def run_now(self, name: str):
+        """Run a task synchronously in the calling thread (manual runs, soak tests)"""
+        self._execute(self.tasks[name], datetime.utcnow())
+
+    def _check_timeouts(self, task, now: float):
+        alive = []
+        for thread, started, started_at in task.running:
+            if not thread.is_alive():
+                continue
+            alive.append((thread, started, started_at))
+            if task.timeout and now - started > task.timeout and started_at not in task.timed_out:
+                # Threads can't be killed; record the overrun and let the skip policy hold new runs
+                task.timed_out.add(started_at)
+                with session_scope(self.app, self.db):
+                    try:
+                        self._record(task.name, started_at, "timeout",
+                                     error=f"Still running after {task.timeout}s")
+                    except Exception:
+                        self.db.session.rollback()
+        task.running = alive
+
+    def _is_enabled(self, task) -> bool:
+        if task.enabled is None:
+            return True
+        with session_scope(self.app, self.db):
+            return bool(task.enabled())
+
+    def tick(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        for task in self.tasks.values():
+            self._check_timeouts(task, now)
+            if now < task.next_run:
+                continue
+            if task.running and task.overrun == "skip":
+                continue
+
+            try:
+                enabled = self._is_enabled(task)
+                if enabled:
+                    started_at = datetime.utcnow()
+                    thread = threading.Thread(target=self._execute, args=(task, started_at),
+                                              name=f"task-{task.name}", daemon=True)
+                    thread.start()
+                    task.running.append((thread, now, started_at))
+                with session_scope(self.app, self.db):
+                    task.schedule_next(now)
+            except Exception:
+                # Settings unreadable (database down): retry shortly
+                task.next_run = now + 5
+
+    def _claim_lease(self) -> bool:
+        """Take or renew the lease row; False while another live process holds it"""
+        Lease = self.Lease
+        now = datetime.utcnow()
+        with session_scope(self.app, self.db):
+            try:
+                renewed = self.db.session.execute(
+                    self.db.update(Lease)
+                    .where(Lease.name == LEASE_NAME, or_(Lease.holder == self.holder, Lease.expires_at < now))
+                    .values(holder=self.holder, expires_at=now + timedelta(seconds=LEASE_SECONDS))
+                ).rowcount
+                if not renewed:
+                    if self.db.session.get(Lease, LEASE_NAME) is not None:
+                        self.db.session.rollback()
+                        return False
+                    self.db.session.add(Lease(name=LEASE_NAME, holder=self.holder,
+                                              expires_at=now + timedelta(seconds=LEASE_SECONDS)))
+                self.db.session.commit()
+                return True
+            except IntegrityError:
+                # Another process created the row first
+                self.db.session.rollback()
+                return False
+            except Exception:
+                # Database unreachable: stop running tasks until the lease can be confirmed
+                self.db.session.rollback()
+                return False
+
+    def _release_lease(self):
+        with session_scope(self.app, self.db):
+            try:
+                self.db.session.execute(
+                    self.db.update(self.Lease)
+                    .where(self.Lease.name == LEASE_NAME, self.Lease.holder == self.holder)
+                    .values(expires_at=datetime.utcnow())
+                )
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+
+    def has_lease(self, now: float) -> bool:
+        """Whether this process should run the tasks; the lease is renewed every third of its length"""
+        if self.Lease is None:
+            return True
+        if now - self._lease_checked >= (LEASE_SECONDS / 3 if self.leading else self.tick_seconds * 5):
+            self._lease_checked = now
+            self.leading = self._claim_lease()
+        return self.leading
+
+    def run_forever(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            if self.has_lease(time.monotonic()):
+                self.tick()
+            stop_event.wait(self.tick_seconds)
+        if self.Lease is not None and self.leading:
+            self._release_lease()
+
+
+def prune_task_runs(db, TaskRun, keep_days: int = 7) -> dict:
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    deleted = TaskRun.query.filter(TaskRun.started_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return {"deleted": deleted}
@@ -0,0 +1,76 @@
+"""
+Schema checks and additive migrations - compares the models against the live
+database and creates whatever is missing (tables, columns, indexes).
+
+Only additive changes are handled; drops and type changes stay manual.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+
+def schema_diff(db) -> list:
+    """Return (kind, table, obj) tuples for every model object missing from the database"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            missing.append(("table", table, None))
+            continue
+
+        existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                missing.append(("column", table, column))
+
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                missing.append(("index", table, index))
+
+    return missing
+
+
+def describe(item) -> str:
+    kind, table, obj = item
+    if kind == "table":
+        return f"table {table.name}"
+    return f"{kind} {table.name}.{obj.name}"
+
+
+def migrate(db, data_steps=None) -> list:
+    """
+    Create missing tables, columns and indexes; returns what was applied.
+
+    `data_steps` maps describe() strings to fn(conn) data fix-ups, run in the
+    same transaction: after a new table or column (backfills), before a new
+    index (existing rows may violate a unique one).
+    """
+    data_steps = data_steps or {}
+    missing = schema_diff(db)
+    if not missing:
+        return []
+
+    engine = db.engine
+    preparer = engine.dialect.identifier_preparer
+    with engine.begin() as conn:
+        for item in missing:
+            kind, table, obj = item
+            step = data_steps.get(describe(item))
+            if step and kind == "index":
+                step(conn)
+
+            if kind == "table":
+                # checkfirst guards against a concurrent deploy creating it first
+                table.create(conn, checkfirst=True)
+            elif kind == "column":
+                column_ddl = CreateColumn(obj).compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}"))
+            elif kind == "index":
+                obj.create(conn, checkfirst=True)
+
+            if step and kind != "index":
+                step(conn)
+
+    return [describe(item) for item in missing]
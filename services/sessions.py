@@ -0,0 +1,26 @@
+"""
+Session scoping for long-running background loops.
+
+Every scheduler tick and job gets its own app context and session; when it
+ends, any open transaction is rolled back, loaded objects are expunged and
+the connection goes back to the pool. Nothing outlives a tick, so the
+identity map can't grow without bound and no connection sits "idle in
+transaction" between ticks (which would hold back Postgres vacuum).
+"""
+from contextlib import contextmanager
+
+
+@contextmanager
+def session_scope(app, db):
+    """Fresh app context + session for one unit of background work"""
+    with app.app_context():
+        try:
+            yield db.session
+        finally:
+            session = db.session()
+            try:
+                if session.in_transaction():
+                    session.rollback()
+                session.expunge_all()
+            finally:
+                db.session.remove()
@@ -0,0 +1,107 @@
+"""
+Background work units - expiry, payment verification, stale-order sweep and
+user total recomputation. Each returns a small dict of counts so callers (job
+workers, admin routes) can report what happened.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from services.order_verification import fetch_new_payments, run_verification_pass, consumed_event_ids
+from services.auto_orders import create_auto_orders
+from services.user_directory import get_user_directory
+
+
+def find_admin_with_key(User, admin_torn_id: int, user_id=None):
+    """The admin whose API key reads the payment events"""
+    if user_id:
+        user = User.query.get(user_id)
+        if user and user.role_id == 3 and user.api_key:
+            return user
+
+    admin_user = User.query.filter_by(torn_user_id=admin_torn_id, role_id=3).first()
+    if not admin_user or not admin_user.api_key:
+        # Fallback: any admin with api_key
+        admin_user = User.query.filter(User.role_id == 3, User.api_key.isnot(None)).first()
+    return admin_user
+
+
+def expire_orders(db, Order) -> dict:
+    """Expire active orders past their expires_at"""
+    now = datetime.utcnow()
+    expired_active = Order.query.filter(
+        Order.status == 'active',
+        Order.expires_at.isnot(None),
+        Order.expires_at < now
+    ).all()
+    for order in expired_active:
+        order.status = 'expired'
+
+    if expired_active:
+        db.session.commit()
+    return {"expired": len(expired_active)}
+
+
+def verify_payments(db, User, Order, PricingConfig, PaymentMatch, admin_torn_id: int, user_id=None) -> dict:
+    """
+    Verify pending orders against new payments (one Torn fetch), then turn the
+    payments no pending order claimed into auto-detected orders
+    """
+    admin_user = find_admin_with_key(User, admin_torn_id, user_id)
+    if not admin_user:
+        raise RuntimeError("No admin API key configured")
+
+    directory = get_user_directory(User)
+    payments = fetch_new_payments(PaymentMatch, admin_user.api_key)
+    verified, pending = run_verification_pass(db, Order, PaymentMatch, directory, admin_user.api_key, payments)
+
+    auto_created = 0
+    if payments:
+        consumed = consumed_event_ids(PaymentMatch, [p['event_id'] for p in payments])
+        unclaimed = [p for p in payments if p['event_id'] not in consumed]
+        auto_created = create_auto_orders(db, User, Order, PricingConfig, PaymentMatch, unclaimed, directory)
+
+    return {"verified": verified, "failed": pending - verified, "auto_created": auto_created}
+
+
+def sweep_pending_orders(db, Order, AutoVerifySettings) -> dict:
+    """Delete unpaid pending orders older than the auto-delete window (if enabled)"""
+    settings = AutoVerifySettings.query.first()
+    if not settings or not settings.auto_delete_enabled:
+        return {"deleted": 0}
+
+    cutoff = datetime.utcnow() - timedelta(hours=settings.auto_delete_hours or 24)
+    deleted = Order.query.filter(
+        Order.status == 'pending',
+        Order.payment_verified.isnot(True),
+        Order.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return {"deleted": deleted}
+
+
+def recompute_user_totals(db, User, Order) -> dict:
+    """
+    Refresh User.sent_xanax_total from verified orders in one statement.
+    insurance_total is left alone: nothing defines how it is derived.
+    """
+    paid = (
+        db.session.query(func.coalesce(func.sum(Order.xanax_payment), 0))
+        .filter(Order.user_id == User.id, Order.payment_verified.is_(True))
+        .scalar_subquery()
+    )
+    updated = User.query.update({User.sent_xanax_total: paid}, synchronize_session=False)
+    db.session.commit()
+    return {"users": updated}
+
+
+def build_job_handlers(db, User, Order, PricingConfig, AutoVerifySettings, PaymentMatch, admin_torn_id: int) -> dict:
+    """{job kind: handler(payload) -> result dict} for the job queue workers"""
+    return {
+        "verify": lambda payload: verify_payments(
+            db, User, Order, PricingConfig, PaymentMatch, admin_torn_id, payload.get("user_id")
+        ),
+        "expire": lambda payload: expire_orders(db, Order),
+        "sweep": lambda payload: sweep_pending_orders(db, Order, AutoVerifySettings),
+        "recompute": lambda payload: recompute_user_totals(db, User, Order),
+    }
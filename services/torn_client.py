@@ -0,0 +1,224 @@
+"""
+Torn API client - every call goes through one circuit breaker, and event
+fetches are served from a short-lived snapshot cache.
+
+Breaker: after TORN_BREAKER_FAILURES consecutive transport failures (timeouts,
+connection errors, 5xx) calls fail fast with TornUnavailable for
+TORN_BREAKER_RESET_SECONDS; then a single half-open probe decides whether to
+close it again. Torn's own error payloads (bad key etc.) mean the API is up
+and don't count as failures. Callers working through many members' keys pass
+their own breaker, so their failures can't lock out login and payments.
+
+Events snapshot (stale-while-revalidate): a snapshot younger than
+TORN_EVENTS_FRESH_SECONDS is returned as is; an older one (up to
+TORN_EVENTS_STALE_SECONDS) is returned immediately while one background
+thread refreshes it. Payments are matched idempotently through the ledger,
+so a slightly stale snapshot only delays an activation to the next pass.
+Snapshots live in the shared cache (services/cache.py), so with a shared
+backend one worker's refresh serves all of them.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from services.cache import get_cache
+
+TORN_API_BASE = os.environ.get("TORN_API_BASE", "https://api.torn.com").rstrip("/")
+
+# (connect, read) seconds; login is interactive so it gets the tighter budget
+LOGIN_TIMEOUT = (3.05, 4)
+EVENTS_TIMEOUT = (3.05, 8)
+
+BREAKER_FAILURES = int(os.environ.get("TORN_BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("TORN_BREAKER_RESET_SECONDS", "30"))
+EVENTS_FRESH_SECONDS = float(os.environ.get("TORN_EVENTS_FRESH_SECONDS", "15"))
+EVENTS_STALE_SECONDS = float(os.environ.get("TORN_EVENTS_STALE_SECONDS", "300"))
+EVENTS_KEEP_SECONDS = 86400  # served past EVENTS_STALE_SECONDS only when a refresh fails
+EVENTS_NAMESPACE = "torn_events"
+
+logger = logging.getLogger("hjs.torn")
+
+
+class TornUnavailable(Exception):
+    """The Torn API is failing; the circuit breaker is open"""
+
+
+# Torn error codes meaning the key itself is no good: empty, incorrect, owner in federal
+# jail, disabled for inactivity, access level too low, paused by its owner
+KEY_REJECTED_CODES = frozenset({1, 2, 10, 13, 16, 18})
+
+
+class TornAPIError(ValueError):
+    """Torn answered with an error payload (bad key, access level, ...); `code` is Torn's error code"""
+
+    def __init__(self, message: str, code=None):
+        super().__init__(message)
+        self.code = code
+
+    @property
+    def key_rejected(self) -> bool:
+        return self.code in KEY_REJECTED_CODES
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one probe at a time"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit %s closed", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit %s opened after %d failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"name": self.name, "state": self.state, "failures": self.failures}
+
+
+breaker = CircuitBreaker("torn")
+
+
+def torn_get(path: str, params: dict, timeout, circuit: CircuitBreaker = breaker) -> dict:
+    """GET a Torn API endpoint through a breaker; raises TornUnavailable, TornAPIError or requests errors"""
+    # Imported lazily: requests/urllib3 are a large share of cold-start import time
+    import requests
+
+    if not circuit.allow():
+        raise TornUnavailable("Torn API is unavailable, try again shortly")
+
+    try:
+        response = requests.get(f"{TORN_API_BASE}{path}", params=params, timeout=timeout)
+        if response.status_code >= 500:
+            response.raise_for_status()
+    except requests.RequestException:
+        circuit.record_failure()
+        raise
+    circuit.record_success()
+
+    response.raise_for_status()
+    data = response.json()
+
+    # Torn API commonly returns {"error": {"code": ..., "error": "..."}}
+    if isinstance(data, dict) and "error" in data:
+        raise TornAPIError(data["error"].get("error", "Torn API error"), data["error"].get("code"))
+    return data
+
+
+def fetch_user_basic(api_key: str) -> dict:
+    # SECURITY: never log the key
+    return torn_get("/user/", {"selections": "basic", "key": api_key}, LOGIN_TIMEOUT)
+
+
+def fetch_events(api_key: str, since: int = None, circuit: CircuitBreaker = breaker) -> dict:
+    params = {"selections": "events", "key": api_key}
+    if since:
+        # Unix timestamp; Torn then only returns events from that time on
+        params["from"] = since
+    return torn_get("/user/", params, EVENTS_TIMEOUT, circuit).get("events", {})
+
+
+class EventsSnapshot:
+    """Per-key events cache served stale-while-revalidate, kept in the shared cache"""
+
+    def __init__(self, fetch=fetch_events, fresh_seconds: float = EVENTS_FRESH_SECONDS,
+                 stale_seconds: float = EVENTS_STALE_SECONDS):
+        self.fetch = fetch
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self._refreshing = set()  # per process; another worker may refresh the same key meanwhile
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(api_key: str) -> str:
+        # Keys aren't kept as cache keys in plain text
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    def _refresh(self, api_key: str, digest: str):
+        try:
+            events = self.fetch(api_key)
+            # Wall clock: entries are shared between processes
+            get_cache().set(EVENTS_NAMESPACE, digest, (time.time(), events), ttl=EVENTS_KEEP_SECONDS)
+            return events
+        finally:
+            with self._lock:
+                self._refreshing.discard(digest)
+
+    def _refresh_in_background(self, api_key: str, digest: str):
+        with self._lock:
+            if digest in self._refreshing:
+                return
+            self._refreshing.add(digest)
+
+        def run():
+            try:
+                self._refresh(api_key, digest)
+            except Exception as e:
+                logger.warning("Background events refresh failed: %s", type(e).__name__)
+
+        threading.Thread(target=run, name="torn-events-refresh", daemon=True).start()
+
+    def get(self, api_key: str) -> dict:
+        """Events for this key; stale data is served while Torn is slow or down"""
+        digest = self._digest(api_key)
+        entry = get_cache().get(EVENTS_NAMESPACE, digest)
+        age = time.time() - entry[0] if entry else None
+
+        if entry and age < self.fresh_seconds:
+            return entry[1]
+        if entry and age < self.stale_seconds:
+            self._refresh_in_background(api_key, digest)
+            return entry[1]
+
+        with self._lock:
+            self._refreshing.add(digest)
+        try:
+            return self._refresh(api_key, digest)
+        except Exception:
+            if entry:
+                # Too old to serve by default, but better than nothing during an outage
+                return entry[1]
+            raise
+
+    def invalidate(self, api_key: str = None):
+        if api_key is None:
+            get_cache().invalidate(EVENTS_NAMESPACE)
+        else:
+            get_cache().delete(EVENTS_NAMESPACE, self._digest(api_key))
+
+
+events_snapshot = EventsSnapshot()
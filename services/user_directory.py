@@ -0,0 +1,92 @@
+"""
+Name -> Torn id directory, refreshed from the User table.
+
+Used to resolve payment senders when an event only carries a display name.
+Names are normalized (case/whitespace); names shared by several users are
+treated as unknown rather than guessed.
+
+The map is kept in the shared cache ("user_directory" namespace), so one
+worker's reload serves the others and invalidate() reaches all of them. Each
+process holds its copy until the namespace version moves or the TTL passes;
+the version is read at most every VERSION_CHECK_SECONDS, so a batch of
+resolves costs one cache round trip, not one each.
+"""
+import threading
+import time
+
+from services.cache import get_cache
+from services.order_verification import normalize_name
+
+DEFAULT_TTL_SECONDS = 60
+VERSION_CHECK_SECONDS = 2.0
+NAMESPACE = "user_directory"
+
+_directories = {}
+_directories_lock = threading.Lock()
+
+
+class UserDirectory:
+    def __init__(self, User, ttl: float = DEFAULT_TTL_SECONDS):
+        self.User = User
+        self.ttl = ttl
+        self._by_name = {}
+        self._loaded_at = None
+        self._version = None
+        self._version_checked_at = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        by_name = {}
+        ambiguous = set()
+        for torn_user_id, torn_name in self.User.query.with_entities(self.User.torn_user_id, self.User.torn_name):
+            name = normalize_name(torn_name)
+            if name in by_name and by_name[name] != torn_user_id:
+                ambiguous.add(name)
+            by_name[name] = torn_user_id
+        for name in ambiguous:
+            del by_name[name]
+        return by_name
+
+    def refresh(self):
+        """Reload every (name, torn id) pair from the shared cache or the database; needs an app context"""
+        cache = get_cache()
+        version = cache.version(NAMESPACE)
+        by_name = cache.get_or_set(NAMESPACE, "by_name", self._load, ttl=self.ttl)
+
+        with self._lock:
+            self._by_name = by_name
+            self._version = version
+            self._loaded_at = self._version_checked_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        loaded_at = self._loaded_at
+        if loaded_at is None or now - loaded_at > self.ttl:
+            self.refresh()
+            return
+        if now - self._version_checked_at < VERSION_CHECK_SECONDS:
+            return
+        self._version_checked_at = now
+        if get_cache().version(NAMESPACE) != self._version:
+            self.refresh()
+
+    def resolve(self, name: str):
+        """Torn user id for a display name, or None if unknown/ambiguous"""
+        if not name:
+            return None
+        self._ensure_fresh()
+        return self._by_name.get(normalize_name(name))
+
+    def invalidate(self):
+        """Drop this directory in every worker"""
+        get_cache().invalidate(NAMESPACE)
+        self._loaded_at = None
+
+
+def get_user_directory(User) -> UserDirectory:
+    """Process-wide directory for this User model"""
+    with _directories_lock:
+        directory = _directories.get(User)
+        if directory is None:
+            directory = _directories[User] = UserDirectory(User)
+        return directory
@@ -0,0 +1,31 @@
+"""
+Background worker - the scheduler plus a pool of job queue workers. Any
+number may run; the scheduler lease lets only one of them run periodic tasks
+at a time.
+
+Started and stopped by the gunicorn master (see gunicorn.conf.py),
+or run on its own when the scheduler is deployed as a separate service:
+
+    python worker.py               # scheduler + JOB_WORKERS job threads
+    python worker.py --jobs-only   # extra job capacity; run as many as needed
+"""
+import argparse
+import os
+import threading
+
+from app import create_app, run_scheduler, start_job_workers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HJS background worker")
+    parser.add_argument("--jobs-only", action="store_true", help="only process queued jobs, no scheduler")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("JOB_WORKERS", "2")))
+    args = parser.parse_args()
+
+    app = create_app()
+    start_job_workers(app, args.workers)
+
+    if args.jobs_only:
+        threading.Event().wait()
+    else:
+        run_scheduler(app)
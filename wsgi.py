@@ -0,0 +1,9 @@
+"""
+Production WSGI entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+Building the app does not touch the database; connections are opened lazily
+on the first request and the schema is managed by `python manage.py migrate`.
+"""
+from app import create_app
+
+app = create_app()